@@ -0,0 +1,161 @@
+"""Admission control in front of every route.
+
+Each request takes a token from its user's bucket and, for routes listed in
+``RATE_LIMIT_ROUTES``, from that user's bucket for the route; an empty bucket
+answers 429 with ``Retry-After``. Users are the ``sub`` of a valid bearer
+token (see ``deps.token_subject``), anonymous requests are keyed by client
+address.
+
+When the server is overloaded, measured by requests in flight or by how long
+the oldest database pool checkout has been waiting, every route except the
+cheap ones in ``ADMISSION_SHED_EXEMPT`` fails fast with 503 instead of
+queueing for a connection until it times out.
+"""
+
+import math
+import time
+from dataclasses import dataclass
+
+from fastapi.responses import ORJSONResponse
+from starlette.routing import Match
+
+from . import caching
+from . import deps
+from . import instrumentation
+from . import metrics
+from . import models
+
+
+rejected = metrics.Counter(
+    "admission_rejected_total", "Requests turned away by admission control", ("reason",)
+)
+
+enabled = False
+user_limit: tuple[float, float] | None = None
+route_limits: dict[str, tuple[float, float]] = {}
+shed_exempt: set[str] = set()
+max_in_flight = 0
+max_pool_wait = 0.0
+buckets: caching.TTLCache | None = None
+# Route objects of the app mapped to their endpoint names, resolved on first use
+named_routes: list | None = None
+
+
+@dataclass
+class TokenBucket:
+    rate: float
+    burst: float
+    tokens: float
+    updated: float
+
+    def take(self, now: float) -> float:
+        """Take a token; return 0, or the seconds until one is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def init_admission(settings):
+    global enabled, user_limit, route_limits, shed_exempt
+    global max_in_flight, max_pool_wait, buckets, named_routes
+
+    enabled = settings.ADMISSION_ENABLED
+    user_limit = tuple(settings.RATE_LIMIT_PER_USER) or None
+    route_limits = {
+        name: tuple(limit) for name, limit in settings.RATE_LIMIT_ROUTES.items()
+    }
+    shed_exempt = set(settings.ADMISSION_SHED_EXEMPT)
+    max_in_flight = settings.ADMISSION_MAX_IN_FLIGHT
+    max_pool_wait = settings.ADMISSION_MAX_POOL_WAIT
+    buckets = caching.TTLCache("rate_limits", maxsize=settings.RATE_LIMIT_MAX_KEYS)
+    named_routes = None
+
+
+def _take(key: tuple, limit: tuple[float, float], now: float) -> float:
+    rate, burst = limit
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = TokenBucket(rate, burst, burst, now)
+    wait = bucket.take(now)
+    # An idle bucket is full again after burst / rate seconds, so it can go
+    buckets.set(key, bucket, ttl=burst / rate)
+    return wait
+
+
+def _route_name(scope) -> str | None:
+    """The endpoint name of the request, looked up among configured routes only."""
+    global named_routes
+
+    if named_routes is None:
+        names = route_limits.keys() | shed_exempt
+        named_routes = [
+            route
+            for route in scope["app"].routes
+            if getattr(route, "name", None) in names
+        ]
+    for route in named_routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.name
+    return None
+
+
+def _subject(scope) -> str:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            subject = deps.token_subject(value.decode("latin-1"))
+            if subject is not None:
+                return f"user:{subject}"
+            break
+    client = scope.get("client")
+    return f"addr:{client[0] if client else ''}"
+
+
+def _reject(status_code: int, reason: str, detail: str, retry_after: float):
+    rejected.inc(reason=reason)
+    return ORJSONResponse(
+        dict(detail=detail),
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def admit(scope) -> ORJSONResponse | None:
+    """Return the response that turns the request away, or None to let it in."""
+    route = _route_name(scope)
+
+    if route not in shed_exempt:
+        # Counted by the metrics middleware, which also counts this request
+        if max_in_flight and instrumentation.in_flight.get() > max_in_flight:
+            return _reject(503, "in_flight", "Server is busy, try again", 1)
+        if max_pool_wait and models.pool_wait() >= max_pool_wait:
+            return _reject(503, "pool_wait", "Server is busy, try again", 1)
+
+    if user_limit is None and route not in route_limits:
+        return None
+
+    subject = _subject(scope)
+    now = time.monotonic()
+    wait = _take((subject,), user_limit, now) if user_limit else 0.0
+    if not wait and route in route_limits:
+        wait = _take((subject, route), route_limits[route], now)
+    if wait:
+        return _reject(429, "rate_limit", "Too many requests", wait)
+    return None
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled:
+            return await self.app(scope, receive, send)
+
+        response = admit(scope)
+        if response is not None:
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
@@ -0,0 +1,196 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Request, status
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import counters
+from . import models
+
+
+CHUNK_ROWS = 5000
+MAX_REPORTED_ERRORS = 1000
+
+ITEM_COLUMNS = [
+    "name",
+    "description",
+    "price",
+    "tax",
+    "merchant_id",
+    "user_id",
+    "version",
+]
+
+
+async def _lines(request: Request) -> AsyncIterator[str]:
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode()
+    if pending:
+        yield pending.decode()
+
+
+async def _csv_records(request: Request) -> AsyncIterator[list[str]]:
+    """Parsed CSV records, one per row even when a quoted field spans lines."""
+    record = []
+    async for line in _lines(request):
+        record.append(line)
+        text = "\n".join(record)
+        if not text.strip():
+            record = []
+            continue
+        try:
+            rows = list(csv.reader(io.StringIO(text), strict=True))
+        except csv.Error as e:
+            if str(e) == "unexpected end of data":
+                # A quoted field is still open; the record goes on in the next line
+                continue
+            # Malformed but readable, e.g. text after a closing quote
+            rows = list(csv.reader(io.StringIO(text)))
+        record = []
+        for values in rows:
+            if values:
+                yield values
+    if record:
+        # A quote left open runs to the end of the upload
+        for values in csv.reader(io.StringIO("\n".join(record))):
+            if values:
+                yield values
+
+
+async def read_rows(request: Request) -> AsyncIterator[list[dict]]:
+    """Yield the uploaded rows in chunks of ``CHUNK_ROWS`` dicts.
+
+    NDJSON and CSV bodies are parsed while they stream in; a JSON array has to
+    be read whole.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+
+    if content_type == "application/json":
+        try:
+            rows = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON body"
+            )
+        if not isinstance(rows, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Expected a JSON array of items",
+            )
+        for start in range(0, len(rows), CHUNK_ROWS):
+            yield rows[start : start + CHUNK_ROWS]
+
+    elif content_type == "text/csv":
+        header = None
+        chunk = []
+        async for values in _csv_records(request):
+            if header is None:
+                header = values
+                continue
+            # Empty CSV cells mean "not set"
+            chunk.append({key: value or None for key, value in zip(header, values)})
+            if len(chunk) >= CHUNK_ROWS:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    elif content_type == "application/x-ndjson":
+        chunk = []
+        async for line in _lines(request):
+            if not line.strip():
+                continue
+            try:
+                chunk.append(json.loads(line))
+            except ValueError as e:
+                # Keep the row number aligned; validation reports it
+                chunk.append(ValueError(f"Invalid JSON: {e}"))
+            if len(chunk) >= CHUNK_ROWS:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Send application/json, application/x-ndjson or text/csv",
+        )
+
+
+def validate_chunk(
+    rows: list, first_row: int, user_id: int
+) -> tuple[list[tuple[int, dict]], list[models.BulkItemError]]:
+    valid, errors = [], []
+    for number, row in enumerate(rows, start=first_row):
+        if isinstance(row, ValueError):
+            errors.append(models.BulkItemError(row=number, errors=[str(row)]))
+            continue
+        try:
+            item = models.CreatedItem.model_validate(row)
+        except ValidationError as e:
+            errors.append(
+                models.BulkItemError(
+                    row=number,
+                    errors=[
+                        f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                        for error in e.errors()
+                    ],
+                )
+            )
+            continue
+        valid.append((number, dict(item.dict(), user_id=user_id, version=1)))
+    return valid, errors
+
+
+async def insert_chunk(
+    session: AsyncSession, valid: list[tuple[int, dict]]
+) -> tuple[int, list[models.BulkItemError]]:
+    """Insert one validated chunk and commit it; return (inserted, errors).
+
+    Rows pointing at a missing merchant are reported instead of letting the
+    foreign key abort the chunk.
+    """
+    merchant_ids = {row["merchant_id"] for _, row in valid} - {None}
+    existing = set(
+        (
+            await session.exec(
+                select(models.DBMerchant.id).where(
+                    models.DBMerchant.id.in_(merchant_ids)
+                )
+            )
+        ).all()
+    )
+    errors = [
+        models.BulkItemError(row=number, errors=["merchant_id: Merchant not found"])
+        for number, row in valid
+        if row["merchant_id"] not in existing
+    ]
+    rows = [row for _, row in valid if row["merchant_id"] in existing]
+    if not rows:
+        return 0, errors
+
+    connection = await session.connection()
+    if connection.dialect.driver == "asyncpg":
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            models.DBItem.__tablename__,
+            records=[tuple(row[column] for column in ITEM_COLUMNS) for row in rows],
+            columns=ITEM_COLUMNS,
+        )
+    else:
+        # Batched into multi-row INSERT ... VALUES by insertmanyvalues
+        await session.execute(insert(models.DBItem.__table__), rows)
+
+    await counters.increment(session, "items", len(rows))
+    await session.commit()
+    return len(rows), errors
@@ -0,0 +1,185 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+from urllib.parse import urlsplit
+
+from . import metrics
+
+
+hits = metrics.Counter("cache_hits_total", "Cache lookups served from memory", ("cache",))
+misses = metrics.Counter("cache_misses_total", "Cache lookups that missed", ("cache",))
+
+MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.entries.get(key, MISSING)
+        if entry is MISSING or entry[0] < time.monotonic():
+            if entry is not MISSING:
+                del self.entries[key]
+            misses.inc(cache=self.name)
+            return default
+
+        self.entries.move_to_end(key)
+        hits.inc(cache=self.name)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class CacheError(Exception):
+    pass
+
+
+class MemoryBackend:
+    """Async string store over a ``TTLCache``, private to this process."""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60.0):
+        self.ttl = ttl
+        self.entries = TTLCache(name, maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> str | None:
+        return self.entries.get(key)
+
+    async def set(self, key: str, value: str, ttl: float | None = None):
+        self.entries.set(key, value, ttl)
+
+    async def add(self, key: str, value: str, ttl: float | None = None) -> bool:
+        """Set ``key`` only if it is missing; return whether it was set."""
+        if self.entries.get(key) is not None:
+            return False
+        self.entries.set(key, value, ttl)
+        return True
+
+    async def close(self):
+        self.entries.clear()
+
+
+class RedisBackend:
+    """Minimal client for the Redis protocol (RESP2).
+
+    Only GET and SET are used, so anything speaking the protocol works: Redis,
+    Valkey, KeyDB or a local stand-in. Idle connections are kept per event loop.
+    """
+
+    def __init__(self, url: str, ttl: float = 60.0, max_idle: int = 8):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.ttl = ttl
+        self.max_idle = max_idle
+        self.idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    async def get(self, key: str) -> str | None:
+        value = await self.execute("GET", key)
+        return value.decode() if value is not None else None
+
+    async def set(self, key: str, value: str, ttl: float | None = None):
+        await self.execute("SET", key, value, "PX", self._milliseconds(ttl))
+
+    async def add(self, key: str, value: str, ttl: float | None = None) -> bool:
+        args = ["SET", key, value, "NX"]
+        if ttl is not None:
+            args += ["PX", self._milliseconds(ttl)]
+        return await self.execute(*args) is not None
+
+    async def close(self):
+        while self.idle:
+            _, writer = self.idle.pop()
+            writer.close()
+
+    async def execute(self, *args):
+        connection = await self._acquire()
+        try:
+            reply = await self._call(connection, *args)
+        except BaseException:
+            connection[1].close()
+            raise
+        self._release(connection)
+        return reply
+
+    def _milliseconds(self, ttl: float | None) -> int:
+        return max(1, int((self.ttl if ttl is None else ttl) * 1000))
+
+    async def _acquire(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # Streams belong to the loop that opened them
+            self.idle, self.loop = [], loop
+        if self.idle:
+            return self.idle.pop()
+
+        connection = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._call(connection, "AUTH", self.password)
+        if self.db:
+            await self._call(connection, "SELECT", self.db)
+        return connection
+
+    def _release(self, connection):
+        if len(self.idle) < self.max_idle:
+            self.idle.append(connection)
+        else:
+            connection[1].close()
+
+    async def _call(self, connection, *args):
+        reader, writer = connection
+        encoded = [str(arg).encode() for arg in args]
+        writer.write(
+            b"*%d\r\n" % len(encoded)
+            + b"".join(b"$%d\r\n%s\r\n" % (len(arg), arg) for arg in encoded)
+        )
+        await writer.drain()
+        return await self._read_reply(reader)
+
+    async def _read_reply(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            raise CacheError("connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            raise CacheError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return (await reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply(reader) for _ in range(length)]
+        raise CacheError(f"unexpected reply {line!r}")
@@ -0,0 +1,29 @@
+import datetime
+
+from fastapi import Response, status
+
+
+def make_etag(*parts) -> str:
+    """Strong entity tag built from the values that identify a representation."""
+    return '"' + "-".join(
+        value.strftime("%Y%m%d%H%M%S%f")
+        if isinstance(value, datetime.datetime)
+        else str(value)
+        for value in parts
+    ) + '"'
+
+
+def matches(if_none_match: str | None, etag: str) -> bool:
+    """``If-None-Match`` uses the weak comparison, so a ``W/`` prefix is ignored."""
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
@@ -3,11 +3,80 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     SQLDB_URL: str
+    SQLDB_READ_URL: str | None = None  # read replica for GET endpoints
+
+    DB_DRIVER: str | None = None  # "asyncpg" or "psycopg", overrides SQLDB_URL
+    DB_SYNC_DRIVER: str = "pg8000"  # used by command line tools
+    DB_ECHO: bool = False  # every statement to stdout; see QUERY_PROFILING instead
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800  # seconds
+    DB_STATEMENT_CACHE_SIZE: int = 100  # asyncpg prepared statements per connection
     SECRET_KEY: str = "secret"
 
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 5 * 60  # 5 minutes
     REFRESH_TOKEN_EXPIRE_MINUTES: int = 7 * 24 * 60  # 7 days
 
+    GROUP_COMMIT_ENABLED: bool = False
+    GROUP_COMMIT_WINDOW_MS: float = 2.0
+    GROUP_COMMIT_MAX_BATCH: int = 64
+
+    # Seeds the row counters and corrects their drift; 0 disables it
+    COUNTER_REFRESH_SECONDS: float = 300
+
+    PRINCIPAL_CACHE_SIZE: int = 10_000
+    PRINCIPAL_CACHE_TTL: float = 60.0
+    PRINCIPAL_CLAIMS_ONLY: bool = False  # trust roles/status carried in the token
+
+    PASSWORD_SCHEMES: list[str] = ["bcrypt"]  # e.g. ["argon2", "bcrypt"]
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_EXECUTOR: str = "thread"  # or "process"
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 256  # 0 disables the 503 on overload
+
+    # List endpoints served from column tuples rather than ORM entities
+    CORE_READ_ENDPOINTS: list[str] = ["read_items", "read_transactions", "read_wallets"]
+
+    ITEM_CACHE_BACKEND: str = "memory"  # "memory", "redis" or "none"
+    ITEM_CACHE_URL: str = "redis://localhost:6379/0"
+    ITEM_CACHE_SIZE: int = 10_000
+    ITEM_CACHE_TTL: float = 30.0
+
+    IDEMPOTENCY_TTL: float = 24 * 60 * 60  # seconds a stored response is replayed
+    IDEMPOTENCY_CACHE_SIZE: int = 10_000
+    IDEMPOTENCY_LEASE: float = 30.0  # seconds duplicates wait for the first request
+
+    ADMISSION_ENABLED: bool = False
+    # Token buckets as [tokens per second, burst]; keyed by the token's user,
+    # or by client address without one. Behind a proxy every anonymous
+    # caller shares the proxy's address, so run uvicorn with
+    # --forwarded-allow-ips for it to resolve X-Forwarded-For first.
+    RATE_LIMIT_PER_USER: list[float] = [50.0, 100]
+    RATE_LIMIT_ROUTES: dict[str, list[float]] = {
+        "authentication": [5.0, 10],
+        "create_transaction": [10.0, 20],
+        "checkout": [5.0, 10],
+        "create_items_bulk": [1.0, 5],
+        "export_transactions": [1.0, 5],
+    }
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+    # Shed with 503 past either threshold (0 disables it), except on cheap routes
+    ADMISSION_MAX_IN_FLIGHT: int = 512
+    ADMISSION_MAX_POOL_WAIT: float = 0.25  # seconds the oldest pool checkout waited
+    ADMISSION_SHED_EXEMPT: list[str] = ["index", "read_item", "read_metrics"]
+
+    # Per-request statement counts and DB time in Server-Timing, repeated
+    # statement (N+1) warnings and the slow query log
+    QUERY_PROFILING: bool = False
+    QUERY_REPEAT_THRESHOLD: int = 5  # runs of one statement in a request
+    SLOW_QUERY_SECONDS: float = 0.1
+    SLOW_QUERY_SAMPLE_RATE: float = 1.0  # fraction of slow statements logged
+
+    LAST_LOGIN_FLUSH_SECONDS: float = 5.0
+    LAST_LOGIN_MAX_PENDING: int = 10_000
+
     model_config = SettingsConfigDict(
         env_file=".env", validate_assignment=True, extra="allow"
     )
@@ -0,0 +1,224 @@
+import asyncio
+import random
+
+from sqlalchemy import (
+    String,
+    and_,
+    bindparam,
+    cast,
+    func,
+    literal,
+    or_,
+    select,
+    text,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import models
+
+
+# The global counter of a table is split over several rows so concurrent
+# inserts do not all queue on one row lock; reads add the slots together.
+SLOTS = 8
+
+refresher: asyncio.Task | None = None
+
+
+def user_scope(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def increment_statement(name: str, amount: int = 1, scopes: tuple = ("",)):
+    counter = models.DBRowCounter
+    slot = random.randrange(SLOTS)
+    return (
+        update(counter)
+        .where(
+            counter.name == name,
+            or_(
+                *[
+                    and_(counter.scope == scope, counter.slot == (0 if scope else slot))
+                    for scope in scopes
+                ]
+            ),
+        )
+        .values(value=counter.value + amount)
+    )
+
+
+async def increment(session, name: str, amount: int = 1, scopes: tuple = ("",)):
+    """Adjust counters in the caller's transaction; unseeded counters are skipped."""
+    await session.execute(increment_statement(name, amount, scopes))
+
+
+async def increment_scopes(session, name: str, amounts: dict[str, int]):
+    """Adjust several scoped counters of ``name`` with one executemany, in the
+    caller's transaction; unseeded counters are skipped."""
+    if not amounts:
+        return
+    counter = models.DBRowCounter.__table__
+    await session.execute(
+        update(counter)
+        .where(
+            counter.c.name == name,
+            counter.c.scope == bindparam("counter_scope"),
+            counter.c.slot == 0,
+        )
+        .values(value=counter.c.value + bindparam("amount")),
+        [dict(counter_scope=scope, amount=amount) for scope, amount in amounts.items()],
+    )
+
+
+async def count(session, table, scope: str = "", *where) -> tuple[int, bool]:
+    """Return ``(count, exact)`` for ``table`` without scanning it when possible.
+
+    Counters are only seeded by ``refresh``. Until then a global count on
+    Postgres is the planner estimate in ``pg_class.reltuples``; other counts
+    are counted exactly, which for a user's rows is an index range.
+    """
+    name = table.__tablename__
+    counter = models.DBRowCounter
+    total, slots = (
+        await session.execute(
+            select(func.sum(counter.value), func.count()).where(
+                counter.name == name, counter.scope == scope
+            )
+        )
+    ).one()
+    if slots:
+        return total, True
+
+    connection = await session.connection()
+    if connection.dialect.name == "postgresql" and not scope:
+        estimate = (
+            await session.execute(
+                text("SELECT reltuples FROM pg_class WHERE relname = :name"),
+                dict(name=name),
+            )
+        ).scalar()
+        # reltuples is -1 until the table has been analyzed
+        if estimate is not None and estimate >= 0:
+            return int(estimate), False
+
+    exact = (
+        await session.execute(
+            select(func.count()).select_from(table.__table__).where(*where)
+        )
+    ).scalar()
+    return exact, True
+
+
+async def refresh(session, table, scope_column=None):
+    """Seed missing counters of ``table`` and correct drift, and commit.
+
+    With ``scope_column`` the per-user counters are refreshed as well.
+
+    Nothing is locked. Missing counters are first committed at zero, so
+    increments from then on are kept. One UPDATE then adds, per scope, the
+    exact count minus the counter's sum, both read in the statement's
+    snapshot, to the row's latest value: increments that commit while it
+    runs are kept on top.
+    """
+    name = table.__tablename__
+    scopes = [""]
+    if scope_column is not None:
+        result = await session.execute(select(scope_column).distinct())
+        scopes += [user_scope(key) for key in result.scalars()]
+    await _create(session, name, scopes)
+    await session.commit()
+
+    exact = select(literal("").label("scope"), func.count().label("value")).select_from(
+        table.__table__
+    )
+    if scope_column is not None:
+        exact = union_all(
+            exact,
+            select(
+                (literal("user:") + cast(scope_column, String)).label("scope"),
+                func.count().label("value"),
+            ).group_by(scope_column),
+        )
+    exact = exact.subquery("exact")
+
+    counter = models.DBRowCounter.__table__
+    seen = (
+        select(counter.c.scope, func.sum(counter.c.value).label("value"))
+        .where(counter.c.name == name)
+        .group_by(counter.c.scope)
+        .subquery("seen")
+    )
+    drift = (
+        select(
+            seen.c.scope,
+            (func.coalesce(exact.c.value, 0) - seen.c.value).label("delta"),
+        )
+        .select_from(seen.outerjoin(exact, exact.c.scope == seen.c.scope))
+        .subquery("drift")
+    )
+    await session.execute(
+        update(counter)
+        .where(
+            counter.c.name == name,
+            counter.c.scope == drift.c.scope,
+            counter.c.slot == 0,
+            drift.c.delta != 0,
+        )
+        .values(value=counter.c.value + drift.c.delta)
+    )
+    await session.commit()
+
+
+async def refresh_all(session):
+    await refresh(session, models.DBItem)
+    await refresh(session, models.DBTransaction, models.DBTransaction.user_id)
+
+
+async def run_refresher(interval: float):
+    while True:
+        try:
+            async with models.async_session() as session:
+                await refresh_all(session)
+        except Exception as e:
+            print("counter refresh failed", e)
+        await asyncio.sleep(interval)
+
+
+def start_refresher(settings):
+    global refresher
+
+    if settings.COUNTER_REFRESH_SECONDS > 0:
+        refresher = asyncio.create_task(
+            run_refresher(settings.COUNTER_REFRESH_SECONDS)
+        )
+
+
+async def stop_refresher():
+    global refresher
+
+    if refresher is not None:
+        refresher.cancel()
+        try:
+            await refresher
+        except asyncio.CancelledError:
+            pass
+        refresher = None
+
+
+async def _create(session, name: str, scopes: list[str]):
+    """Insert the counters of ``scopes`` that are missing, at zero."""
+    connection = await session.connection()
+    insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+
+    rows = [
+        dict(name=name, scope=scope, slot=slot, value=0)
+        for scope in scopes
+        for slot in range(SLOTS if not scope else 1)
+    ]
+    await session.execute(
+        insert(models.DBRowCounter).on_conflict_do_nothing(
+            index_elements=["name", "scope", "slot"]
+        ),
+        rows,
+    )
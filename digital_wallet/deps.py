@@ -5,7 +5,10 @@ import typing
 import jwt
 
 from pydantic import ValidationError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlmodel import select
 
+from . import caching
 from . import models
 from . import security
 from . import config
@@ -16,10 +19,26 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 settings = config.get_settings()
 
 
-async def get_current_user(
-    token: typing.Annotated[str, Depends(oauth2_scheme)],
-    session: typing.Annotated[models.AsyncSession, Depends(models.get_session)],
-) -> models.User:
+principal_cache = caching.TTLCache(
+    "principals",
+    maxsize=settings.PRINCIPAL_CACHE_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL,
+)
+user_cache = caching.TTLCache(
+    "users",
+    maxsize=settings.PRINCIPAL_CACHE_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL,
+)
+
+USER_COLUMNS = models.DBUser.__table__.columns.keys()
+
+
+def invalidate_principal(user_id: int):
+    principal_cache.pop(int(user_id))
+    user_cache.pop(int(user_id))
+
+
+def decode_token(token: str) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -31,31 +50,99 @@ async def get_current_user(
         )
         user_id: int = payload.get("sub")
 
-        if user_id is None:
+        # Refresh tokens are only accepted by /token/refresh
+        if user_id is None or payload.get("typ") == "refresh":
             raise credentials_exception
 
-    except jwt.JWTError as e:
+    except jwt.PyJWTError as e:
         print(e)
         raise credentials_exception
 
+    return payload
+
+
+def token_subject(authorization: str | None) -> str | None:
+    """The ``sub`` of a valid bearer token in an Authorization header, if any."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return str(decode_token(token)["sub"])
+    except HTTPException:
+        return None
+
+
+async def get_current_principal(
+    token: typing.Annotated[str, Depends(oauth2_scheme)],
+    session: typing.Annotated[models.AsyncSession, Depends(models.get_session)],
+) -> models.Principal:
+    payload = decode_token(token)
+    user_id = int(payload["sub"])
+
+    if settings.PRINCIPAL_CLAIMS_ONLY and "roles" in payload and "status" in payload:
+        return models.Principal(
+            id=user_id, roles=payload["roles"], status=payload["status"]
+        )
+
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        # Only the columns needed for authorization, no joined wallet
+        result = await session.exec(
+            select(models.DBUser.id, models.DBUser.roles, models.DBUser.status).where(
+                models.DBUser.id == user_id
+            )
+        )
+        row = result.one_or_none()
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        principal = models.Principal(id=row.id, roles=row.roles or [], status=row.status)
+        principal_cache.set(user_id, principal)
+
+    return principal
+
+
+async def get_current_user(
+    token: typing.Annotated[str, Depends(oauth2_scheme)],
+    session: typing.Annotated[models.AsyncSession, Depends(models.get_session)],
+) -> models.User:
+    payload = decode_token(token)
+    user_id = int(payload["sub"])
+
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None:
+        # Rebuild a persistent instance from the cached columns without a query;
+        # each request gets its own copy, so handlers can still modify it
+        user = models.DBUser(**snapshot)
+        make_transient_to_detached(user)
+        return await session.merge(user, load=False)
+
     user = await session.get(models.DBUser, user_id)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
+    user_cache.set(user_id, {column: getattr(user, column) for column in USER_COLUMNS})
     return user
 
 
 async def get_current_active_user(
-    current_user: typing.Annotated[models.User, Depends(get_current_user)]
-) -> models.User:
+    current_user: typing.Annotated[models.Principal, Depends(get_current_principal)]
+) -> models.Principal:
     if current_user.status != "active":
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 
 async def get_current_active_superuser(
-    current_user: typing.Annotated[models.User, Depends(get_current_user)],
-) -> models.User:
+    current_user: typing.Annotated[models.Principal, Depends(get_current_principal)],
+) -> models.Principal:
     if "admin" not in current_user.roles:
         raise HTTPException(
             status_code=400, detail="The user doesn't have enough privileges"
@@ -69,10 +156,10 @@ class RoleChecker:
 
     def __call__(
         self,
-        user: typing.Annotated[models.User, Depends(get_current_active_user)],
+        user: typing.Annotated[models.Principal, Depends(get_current_active_user)],
     ):
         for role in user.roles:
             if role in self.allowed_roles:
                 return
-        logger.debug(f"User with role {user.roles} not in {self.allowed_roles}")
+        logger.logger.debug(f"User with role {user.roles} not in {self.allowed_roles}")
         raise HTTPException(status_code=403, detail="Role not permitted")
@@ -0,0 +1,288 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import bindparam, insert, select, update
+
+from . import counters
+from . import ledger
+from . import metrics
+from . import models
+
+
+batch_size_histogram = metrics.Histogram(
+    "group_commit_batch_size",
+    "Number of purchases applied per group commit",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, float("inf")),
+)
+wait_histogram = metrics.Histogram(
+    "group_commit_wait_seconds",
+    "Latency added by waiting for the group commit window to close",
+)
+commit_histogram = metrics.Histogram(
+    "group_commit_apply_seconds",
+    "Time spent applying and committing one group commit batch",
+)
+
+writer: "GroupCommitWriter | None" = None
+
+
+@dataclass
+class PendingPurchase:
+    user_id: int
+    item_id: int
+    quantity: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class GroupCommitWriter:
+    """Collect purchases for a short window and apply them in one DB transaction.
+
+    Every caller gets its own ``DBTransaction`` or its own ``HTTPException``;
+    a failed purchase does not fail the rest of the batch.
+    """
+
+    def __init__(self, window_ms: float = 2.0, max_batch: int = 64):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.pending: list[PendingPurchase] = []
+        self.wakeup: asyncio.Event | None = None
+        self.full: asyncio.Event | None = None
+        self.task: asyncio.Task | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.closing = False
+
+    async def submit(
+        self, user_id: int, item_id: int, quantity: int
+    ) -> models.DBTransaction:
+        self._ensure_running()
+        pending = PendingPurchase(
+            user_id, item_id, quantity, self.loop.create_future()
+        )
+        self.pending.append(pending)
+        self.wakeup.set()
+        if len(self.pending) >= self.max_batch:
+            self.full.set()
+        return await pending.future
+
+    async def close(self):
+        if self.task is None:
+            return
+        # Let the loop finish the batch it is applying and drain the rest;
+        # cancelling it mid-batch would leave those callers waiting forever
+        self.closing = True
+        self.wakeup.set()
+        self.full.set()
+        await self.task
+        self.task = None
+        self.closing = False
+        # Whatever arrived after the loop's last look at pending
+        while self.pending:
+            await self._apply(self._take_batch())
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self.task is not None and not self.task.done() and self.loop is loop:
+            return
+        self.loop = loop
+        self.closing = False
+        self.wakeup = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task = loop.create_task(self._run())
+
+    def _take_batch(self) -> list[PendingPurchase]:
+        batch = self.pending[: self.max_batch]
+        del self.pending[: self.max_batch]
+        if len(self.pending) < self.max_batch:
+            self.full.clear()
+        return batch
+
+    async def _run(self):
+        while not (self.closing and not self.pending):
+            await self.wakeup.wait()
+            if not self.closing:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._take_batch()
+            if not self.pending:
+                self.wakeup.clear()
+            if batch:
+                await self._apply(batch)
+
+    async def _apply(self, batch: list[PendingPurchase]):
+        started = time.perf_counter()
+        batch_size_histogram.observe(len(batch))
+        for pending in batch:
+            wait_histogram.observe(started - pending.enqueued_at)
+
+        try:
+            async with models.async_session() as session:
+                results = await apply_purchases(
+                    session,
+                    [(p.user_id, p.item_id, p.quantity) for p in batch],
+                )
+                await session.commit()
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        except BaseException:
+            # Cancelled mid-batch: the batch is out of pending, so release
+            # its callers rather than leave them waiting
+            for pending in batch:
+                pending.future.cancel()
+            raise
+        finally:
+            commit_histogram.observe(time.perf_counter() - started)
+
+        for pending, result in zip(batch, results):
+            if pending.future.done():
+                continue
+            if isinstance(result, Exception):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
+
+
+async def apply_purchases(
+    session: models.AsyncSession, purchases: list[tuple[int, int, int]]
+) -> list[models.DBTransaction | HTTPException]:
+    """Apply ``(user_id, item_id, quantity)`` purchases in arrival order.
+
+    Prices and wallets are loaded with one ``IN`` query each (wallets locked
+    ``FOR UPDATE`` in id order), debits go out as a single executemany and the accepted
+    rows and their ledger entries are written with one multi-row insert each.
+    The caller commits.
+    """
+    item_ids = {item_id for _, item_id, _ in purchases}
+    user_ids = {user_id for user_id, _, _ in purchases}
+
+    prices = dict(
+        (
+            await session.execute(
+                select(models.DBItem.id, models.DBItem.price).where(
+                    models.DBItem.id.in_(item_ids)
+                )
+            )
+        ).all()
+    )
+    wallets = {
+        user_id: [wallet_id, balance]
+        for wallet_id, user_id, balance in (
+            await session.execute(
+                select(
+                    models.DBWallet.id,
+                    models.DBWallet.user_id,
+                    models.DBWallet.balance,
+                )
+                .where(models.DBWallet.user_id.in_(user_ids))
+                # One lock order for every batch, so two cannot deadlock
+                .order_by(models.DBWallet.id)
+                .with_for_update()
+            )
+        ).all()
+    }
+
+    timestamp = datetime.utcnow()
+    results: list = []
+    debits: dict[int, float] = {}
+    rows = []
+    for user_id, item_id, quantity in purchases:
+        wallet = wallets.get(user_id)
+        if wallet is None:
+            results.append(
+                HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found"
+                )
+            )
+            continue
+        if item_id not in prices:
+            results.append(
+                HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail="Item not found"
+                )
+            )
+            continue
+
+        total_cost = prices[item_id] * quantity
+        if wallet[1] < total_cost:
+            results.append(
+                HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Insufficient balance",
+                )
+            )
+            continue
+
+        wallet[1] -= total_cost
+        debits[wallet[0]] = debits.get(wallet[0], 0) + total_cost
+        rows.append(
+            dict(
+                user_id=user_id,
+                item_id=item_id,
+                wallet_id=wallet[0],
+                amount=total_cost,
+                timestamp=timestamp,
+            )
+        )
+        results.append(len(rows) - 1)
+
+    if not rows:
+        return results
+
+    wallets_table = models.DBWallet.__table__
+    await session.execute(
+        update(wallets_table)
+        .where(wallets_table.c.id == bindparam("wallet_id"))
+        .values(
+            balance=wallets_table.c.balance - bindparam("debit"),
+            last_updated=timestamp,
+        ),
+        [dict(wallet_id=wallet_id, debit=debit) for wallet_id, debit in debits.items()],
+    )
+
+    inserted = (
+        await session.execute(
+            insert(models.DBTransaction)
+            .returning(*models.DBTransaction.__table__.c, sort_by_parameter_order=True),
+            rows,
+        )
+    ).all()
+    transactions = [models.DBTransaction(**row._mapping) for row in inserted]
+    await ledger.append(session, ledger.purchase_entries(transactions))
+
+    await counters.increment(session, "transactions", len(rows))
+    per_user: dict[str, int] = {}
+    for row in rows:
+        scope = counters.user_scope(row["user_id"])
+        per_user[scope] = per_user.get(scope, 0) + 1
+    await counters.increment_scopes(session, "transactions", per_user)
+
+    return [
+        transactions[result] if isinstance(result, int) else result
+        for result in results
+    ]
+
+
+def init_group_commit(settings):
+    global writer
+
+    if settings.GROUP_COMMIT_ENABLED:
+        writer = GroupCommitWriter(
+            window_ms=settings.GROUP_COMMIT_WINDOW_MS,
+            max_batch=settings.GROUP_COMMIT_MAX_BATCH,
+        )
+    else:
+        writer = None
+
+
+async def close_group_commit():
+    if writer is not None:
+        await writer.close()
@@ -0,0 +1,262 @@
+"""``Idempotency-Key`` support for purchases.
+
+The first request with a key claims a row in ``idempotency_keys``, runs, and
+stores its response there and in an in-process LRU. Later requests with the
+same key replay the stored response without touching wallets or items.
+Duplicates arriving while the first request runs wait for it: in this
+process on its future, in other workers by polling the claimed row, for up to
+the lease. A claim that outlives its lease, for example because the worker
+died mid-request, can be taken over.
+
+Responses below 500 are stored; server errors release the claim so the
+client can retry. A successful response is stored in the same transaction as
+the purchase, and only while the claim is still ours, so a crash or a lease
+takeover can never leave a debit without its stored response.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import caching
+from . import models
+from . import responses
+
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+POLL_SECONDS = 0.05
+# Expired rows are deleted once every this many claims
+PURGE_EVERY = 1000
+
+cache: caching.TTLCache | None = None
+ttl: float = 24 * 60 * 60
+lease: float = 30.0
+in_flight: dict[tuple[int, str], asyncio.Future] = {}
+claims = 0
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    status_code: int
+    body: str
+
+
+def init_idempotency(settings):
+    global cache, ttl, lease
+
+    ttl = settings.IDEMPOTENCY_TTL
+    lease = settings.IDEMPOTENCY_LEASE
+    cache = caching.TTLCache(
+        "idempotency", maxsize=settings.IDEMPOTENCY_CACHE_SIZE, ttl=ttl
+    )
+    in_flight.clear()
+
+
+def fingerprint(request: Request) -> str:
+    query = sorted(request.query_params.multi_items())
+    return hashlib.sha256(
+        f"{request.method} {request.url.path} {query}".encode()
+    ).hexdigest()
+
+
+async def run(
+    session,
+    user_id: int,
+    key: str,
+    fingerprint: str,
+    execute: Callable[[], Awaitable[Any]],
+):
+    """Run ``execute`` once per ``(user_id, key)`` and respond with its JSON.
+
+    ``execute`` does its writes in ``session`` without committing and returns
+    content for ``responses.encode``; the response is stored and committed
+    with them.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters",
+        )
+
+    cache_key = (user_id, key)
+    stored = cache.get(cache_key)
+    if stored is not None:
+        return _respond(stored, fingerprint, replayed=True)
+
+    pending = in_flight.get(cache_key)
+    if pending is not None:
+        stored = await asyncio.shield(pending)
+        return _respond(stored, fingerprint, replayed=True)
+
+    future = asyncio.get_running_loop().create_future()
+    in_flight[cache_key] = future
+    try:
+        claimed, stored = await _claim_or_wait(user_id, key, fingerprint)
+        replayed = stored is not None
+        if not replayed:
+            stored = await _execute(session, user_id, key, claimed, fingerprint, execute)
+    except BaseException as e:
+        future.set_exception(e)
+        # Nobody may be waiting; do not warn about an unretrieved exception
+        future.exception()
+        raise
+    finally:
+        del in_flight[cache_key]
+
+    future.set_result(stored)
+    cache.set(cache_key, stored)
+    return _respond(stored, fingerprint, replayed=replayed)
+
+
+def _respond(stored: StoredResponse, fingerprint: str, replayed: bool):
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{HEADER} was already used for a different request",
+        )
+    headers = {REPLAYED_HEADER: "true"} if replayed else None
+    return responses.raw_json_response(
+        stored.body, status_code=stored.status_code, headers=headers
+    )
+
+
+async def _claim_or_wait(
+    user_id: int, key: str, fingerprint: str
+) -> tuple[datetime.datetime | None, StoredResponse | None]:
+    """Claim the key and return ``(claim, None)``, or ``(None, response)`` with
+    the response stored for it.
+
+    The claim is the expiry written with it and identifies this claim when the
+    response is stored.
+    """
+    table = models.DBIdempotencyKey
+    deadline = time.monotonic() + lease
+    while True:
+        async with models.async_session() as session:
+            claimed = await _claim(session, user_id, key, fingerprint)
+            if claimed is not None:
+                await session.commit()
+                return claimed, None
+
+            row = (
+                await session.execute(
+                    select(table.fingerprint, table.status_code, table.body).where(
+                        table.user_id == user_id, table.key == key
+                    )
+                )
+            ).first()
+        if row is not None and row.status_code is not None:
+            return None, StoredResponse(*row)
+
+        if time.monotonic() > deadline:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"A request with this {HEADER} is still in progress",
+            )
+        await asyncio.sleep(POLL_SECONDS)
+
+
+async def _claim(
+    session, user_id: int, key: str, fingerprint: str
+) -> datetime.datetime | None:
+    global claims
+
+    table = models.DBIdempotencyKey
+    now = datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(seconds=lease)
+    values = dict(
+        fingerprint=fingerprint, status_code=None, body=None, expires_at=expires_at
+    )
+
+    connection = await session.connection()
+    insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    result = await session.execute(
+        insert(table)
+        .values(user_id=user_id, key=key, **values)
+        .on_conflict_do_nothing(index_elements=["user_id", "key"])
+    )
+    if not result.rowcount:
+        # Take over a stored response past its TTL or an abandoned claim
+        result = await session.execute(
+            update(table)
+            .where(table.user_id == user_id, table.key == key, table.expires_at < now)
+            .values(**values)
+        )
+    if not result.rowcount:
+        return None
+
+    claims += 1
+    if claims % PURGE_EVERY == 0:
+        await session.execute(delete(table).where(table.expires_at < now))
+    return expires_at
+
+
+async def _execute(
+    session, user_id, key, claimed, fingerprint, execute
+) -> StoredResponse:
+    table = models.DBIdempotencyKey
+    where = [table.user_id == user_id, table.key == key]
+    try:
+        try:
+            stored = StoredResponse(
+                fingerprint,
+                status.HTTP_200_OK,
+                responses.encode(await execute()).decode(),
+            )
+        except HTTPException as e:
+            # Nothing of a failed purchase may be committed with its response
+            await session.rollback()
+            if e.status_code >= 500:
+                raise
+            stored = StoredResponse(
+                fingerprint,
+                e.status_code,
+                responses.encode(dict(detail=e.detail)).decode(),
+            )
+        if not await _store(session, where, claimed, stored):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"A request with this {HEADER} is still in progress",
+            )
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        await _release(where, claimed)
+        raise
+    return stored
+
+
+async def _store(session, where: list, claimed, stored: StoredResponse) -> bool:
+    """Store the response unless the claim expired and was taken over."""
+    table = models.DBIdempotencyKey
+    result = await session.execute(
+        update(table)
+        .where(*where, table.status_code.is_(None), table.expires_at == claimed)
+        .values(
+            status_code=stored.status_code,
+            body=stored.body,
+            expires_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl),
+        )
+    )
+    return bool(result.rowcount)
+
+
+async def _release(where: list, claimed):
+    table = models.DBIdempotencyKey
+    async with models.async_session() as session:
+        await session.execute(
+            delete(table).where(
+                *where, table.status_code.is_(None), table.expires_at == claimed
+            )
+        )
+        await session.commit()
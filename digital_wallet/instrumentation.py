@@ -0,0 +1,139 @@
+"""Request, database and pool metrics, exported by GET /metrics.
+
+``MetricsMiddleware`` counts and times every request by method and route
+template, so ``/items/1`` and ``/items/2`` share one series and unknown paths
+fall under ``unmatched``. Statement timings come from cursor execute events
+on the application's engines and are labelled with the route of the request
+that ran them. Pool gauges are read when metrics are rendered rather than
+tracked.
+
+Everything runs on the event loop thread, so the counters are plain dict
+updates without locks.
+"""
+
+import contextvars
+import time
+
+from sqlalchemy import event
+
+from . import metrics
+from . import models
+
+
+in_flight = metrics.Gauge("http_requests_in_flight", "Requests being handled")
+requests_total = metrics.Counter(
+    "http_requests_total", "Requests handled", ("method", "route", "status")
+)
+request_duration = metrics.Histogram(
+    "http_request_duration_seconds", "Time to handle a request", ("method", "route")
+)
+query_duration = metrics.Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing statements, by the route that ran them",
+    ("method", "route"),
+)
+pool_size = metrics.Gauge("db_pool_size", "Connections the pool keeps", ("pool",))
+pool_checked_out = metrics.Gauge(
+    "db_pool_checked_out", "Connections in use", ("pool",)
+)
+pool_overflow = metrics.Gauge(
+    "db_pool_overflow", "Connections open beyond the pool size", ("pool",)
+)
+pool_longest_wait = metrics.Gauge(
+    "db_pool_longest_wait_seconds",
+    "How long the oldest pending checkout has been waiting",
+    ("pool",),
+)
+
+# The scope of the request being handled, in a list the middleware empties
+# when the request ends: tasks started by a request copy this context and
+# must not keep labelling their statements with its route.
+current_request: contextvars.ContextVar[list] = contextvars.ContextVar(
+    "current_request", default=[]
+)
+# Engines whose cursor events are being timed
+instrumented_engines: list = []
+
+
+def init_instrumentation(settings):
+    for engine in instrumented_engines:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+        event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+    instrumented_engines.clear()
+
+    for engine in {models.engine, models.read_engine} - {None}:
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+        instrumented_engines.append(engine.sync_engine)
+
+
+def route_labels(scope) -> tuple[str, str]:
+    route = scope.get("route")
+    return scope["method"], route.path if route is not None else "unmatched"
+
+
+def current_route() -> tuple[str, str]:
+    request = current_request.get()
+    return route_labels(request[0]) if request else ("", "background")
+
+
+# The start time lives on the statement's execution context, so a statement
+# that raises leaves nothing behind on the connection
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    query_duration.observe_key(current_route(), elapsed)
+
+
+def collect_pools():
+    engines = [("primary", models.engine), ("replica", models.read_engine)]
+    for name, engine in engines:
+        if engine is None:
+            continue
+        pool = engine.sync_engine.pool
+        if not isinstance(pool, models.WaitTrackingPool):
+            continue
+        pool_size.set(pool.size(), pool=name)
+        pool_checked_out.set(pool.checkedout(), pool=name)
+        pool_overflow.set(max(pool.overflow(), 0), pool=name)
+        pool_longest_wait.set(pool.longest_wait(), pool=name)
+
+
+metrics.COLLECTORS.append(collect_pools)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        request = [scope]
+        token = current_request.set(request)
+        in_flight.inc_key(())
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.inc_key((), -1)
+            request.clear()
+            current_request.reset(token)
+            # Label keys built directly: the keyword API costs more than
+            # the rest of the middleware together
+            key = route_labels(scope)
+            request_duration.observe_key(key, elapsed)
+            requests_total.inc_key((*key, status))
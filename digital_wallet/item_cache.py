@@ -0,0 +1,144 @@
+import uuid
+from typing import AsyncIterator
+
+from fastapi import Request
+
+from . import caching
+from . import models
+
+
+# Entries are stored under the current version stamp of what they depend on:
+#   items:v:<id>  -> stamp of one item,   items:<id>:<stamp>      -> Item JSON
+#   items:v       -> stamp of the listing, items:page:<stamp>:...  -> ItemList JSON
+# A write replaces the stamp instead of deleting entries, so every worker
+# sharing the backend stops reading the old entries at once and they expire
+# by TTL. Stamps are random, so a stamp lost to eviction is never reused.
+LIST_VERSION = "items:v"
+# Versions are kept longer than entries; the TTL only bounds their memory use
+VERSION_TTL_FACTOR = 10
+
+backend: caching.MemoryBackend | caching.RedisBackend | None = None
+
+
+def init_item_cache(settings):
+    global backend
+
+    if settings.ITEM_CACHE_BACKEND == "redis":
+        backend = caching.RedisBackend(
+            settings.ITEM_CACHE_URL, ttl=settings.ITEM_CACHE_TTL
+        )
+    elif settings.ITEM_CACHE_BACKEND == "memory":
+        backend = caching.MemoryBackend(
+            "items", maxsize=settings.ITEM_CACHE_SIZE, ttl=settings.ITEM_CACHE_TTL
+        )
+    else:
+        backend = None
+
+
+async def close_item_cache():
+    if backend is not None:
+        await backend.close()
+
+
+async def get_session(request: Request) -> AsyncIterator[models.AsyncSession]:
+    """Session for the item reads that fill the cache.
+
+    With a cache, misses read from the primary: a lagging replica could
+    return the row from before the write that set the current stamp, and it
+    would then be served under that stamp until the TTL. Without one, this is
+    ``models.get_read_session``.
+    """
+    if backend is None:
+        async for session in models.get_read_session(request):
+            yield session
+    else:
+        async with models.async_session() as session:
+            yield session
+
+
+def item_version_key(item_id: int) -> str:
+    return f"items:v:{item_id}"
+
+
+async def _version(key: str) -> str:
+    stamp = await backend.get(key)
+    if stamp is None:
+        await backend.add(
+            key, uuid.uuid4().hex, ttl=backend.ttl * VERSION_TTL_FACTOR
+        )
+        stamp = await backend.get(key)
+    return stamp
+
+
+async def _get(version_key: str, key: str, model=None):
+    if backend is None:
+        return None, None
+    try:
+        stamp = await _version(version_key)
+        cached = await backend.get(f"{key}:{stamp}")
+    except (OSError, caching.CacheError) as e:
+        print("item cache unavailable", e)
+        return None, None
+    if cached is not None and model is not None:
+        return model.model_validate_json(cached), stamp
+    if cached is not None:
+        return cached, stamp
+    return None, stamp
+
+
+async def _set(key: str, stamp: str | None, value):
+    if backend is None or stamp is None:
+        return
+    try:
+        if isinstance(value, bytes):
+            value = value.decode()
+        elif not isinstance(value, str):
+            value = value.model_dump_json()
+        await backend.set(f"{key}:{stamp}", value)
+    except (OSError, caching.CacheError) as e:
+        print("item cache unavailable", e)
+
+
+async def get_item(item_id: int) -> tuple[models.Item | None, str | None]:
+    """Return the cached item, if any, and the stamp to store a fresh one under."""
+    return await _get(item_version_key(item_id), f"items:{item_id}", models.Item)
+
+
+async def set_item(item: models.Item, stamp: str | None):
+    await _set(f"items:{item.id}", stamp, item)
+
+
+def page_key(page: int, cursor: str | None) -> str:
+    return f"items:page:{page}:{cursor or ''}"
+
+
+async def get_page(page: int, cursor: str | None):
+    """Return the cached page as encoded JSON, so it can be sent unparsed."""
+    return await _get(LIST_VERSION, page_key(page, cursor))
+
+
+async def set_page(page: int, cursor: str | None, body: bytes, stamp: str | None):
+    """Store an encoded ``ItemList`` page."""
+    await _set(page_key(page, cursor), stamp, body)
+
+
+async def invalidate(item_id: int | None = None):
+    """Retire the listing and, with ``item_id``, that item's entries.
+
+    Call after the write has committed, so a reader that picks up the new
+    stamp cannot store the old row under it; cache misses read from the
+    primary (``get_session``) so a replica cannot hand it the old row either.
+    """
+    if backend is None:
+        return
+    keys = [LIST_VERSION]
+    if item_id is not None:
+        keys.append(item_version_key(item_id))
+    try:
+        for key in keys:
+            await backend.set(
+                key, uuid.uuid4().hex, ttl=backend.ttl * VERSION_TTL_FACTOR
+            )
+    except (OSError, caching.CacheError) as e:
+        # Readers fall back to TTL expiry
+        print("item cache invalidation failed", e)
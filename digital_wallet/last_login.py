@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+
+from sqlalchemy import Integer, DateTime, bindparam, column, update, values
+
+from . import deps
+from . import metrics
+from . import models
+
+
+flush_size = metrics.Histogram(
+    "last_login_flush_size",
+    "Login timestamps written per write-behind flush",
+    buckets=(1, 10, 100, 1000, 10000, float("inf")),
+)
+pending_gauge = metrics.Gauge(
+    "last_login_pending", "Login timestamps waiting to be flushed"
+)
+
+buffer: "LastLoginBuffer | None" = None
+
+
+class LastLoginBuffer:
+    """Keep the newest login time per user in memory and write them in bulk.
+
+    Flushes every ``interval`` seconds, as soon as ``max_pending`` users are
+    waiting, and on shutdown.
+    """
+
+    def __init__(self, interval: float = 5.0, max_pending: int = 10_000):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending: dict[int, datetime.datetime] = {}
+        self.wakeup: asyncio.Event | None = None
+        self.task: asyncio.Task | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.closing = False
+
+    def record(self, user_id: int, timestamp: datetime.datetime):
+        self._ensure_running()
+        self.pending[user_id] = timestamp
+        pending_gauge.set(len(self.pending))
+        if len(self.pending) >= self.max_pending:
+            self.wakeup.set()
+
+    async def flush(self):
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, {}
+        pending_gauge.set(0)
+        try:
+            async with models.async_session() as session:
+                await write_last_logins(session, batch)
+                await session.commit()
+        except BaseException:
+            # Put the batch back unless a newer login arrived meanwhile; also
+            # when cancelled, so a later flush still writes it
+            for user_id, timestamp in batch.items():
+                self.pending.setdefault(user_id, timestamp)
+            pending_gauge.set(len(self.pending))
+            raise
+        flush_size.observe(len(batch))
+        # Cached user snapshots carry last_login_date
+        for user_id in batch:
+            deps.invalidate_principal(user_id)
+
+    async def close(self):
+        if self.task is not None:
+            # Let a flush in progress finish instead of cancelling it
+            self.closing = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+            self.closing = False
+        await self.flush()
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self.task is not None and not self.task.done() and self.loop is loop:
+            return
+        self.loop = loop
+        self.closing = False
+        self.wakeup = asyncio.Event()
+        self.task = loop.create_task(self._run())
+
+    async def _run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print("last login flush failed", e)
+
+
+async def write_last_logins(session, batch: dict[int, datetime.datetime]):
+    users = models.DBUser.__table__
+    connection = await session.connection()
+    if connection.dialect.name == "postgresql":
+        # UPDATE users SET last_login_date = v.ts FROM (VALUES ...) AS v (id, ts)
+        # WHERE users.id = v.id
+        logins = values(
+            column("id", Integer), column("ts", DateTime), name="v"
+        ).data(list(batch.items()))
+        await session.execute(
+            update(users)
+            .where(users.c.id == logins.c.id)
+            .values(last_login_date=logins.c.ts)
+        )
+    else:
+        # SQLite cannot name the columns of a VALUES alias; executemany instead
+        await session.execute(
+            update(users)
+            .where(users.c.id == bindparam("user_id"))
+            .values(last_login_date=bindparam("ts")),
+            [dict(user_id=user_id, ts=ts) for user_id, ts in batch.items()],
+        )
+
+
+def init_last_login(settings):
+    global buffer
+
+    buffer = LastLoginBuffer(
+        interval=settings.LAST_LOGIN_FLUSH_SECONDS,
+        max_pending=settings.LAST_LOGIN_MAX_PENDING,
+    )
+
+
+async def close_last_login():
+    if buffer is not None:
+        await buffer.close()
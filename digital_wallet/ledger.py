@@ -0,0 +1,238 @@
+"""Append-only wallet ledger.
+
+Every change to ``wallets.balance`` also appends a ledger entry in the same
+database transaction, in integer minor units. A wallet's ledger balance is
+its latest snapshot plus the sum of the entries after it, so reads cost
+O(entries since the snapshot). ``snapshot_due`` and ``take_snapshot`` are
+meant for a periodic job (``scripts/ledger.py snapshot``); ``replay`` walks
+a wallet's whole history in chunks to rebuild or verify it.
+"""
+
+from dataclasses import dataclass, field
+
+from sqlalchemy import Integer, cast, delete, func, insert, select
+
+from . import models
+
+
+MINOR_UNITS = 100
+# Entries after the latest snapshot before the periodic job takes a new one
+SNAPSHOT_EVERY = 1000
+CHUNK_ROWS = 10_000
+
+OPENING = "opening"
+PURCHASE = "purchase"
+ADJUSTMENT = "adjustment"
+
+ENTRY_COLUMNS = ["wallet_id", "amount", "kind", "transaction_id", "created_at"]
+
+
+def to_minor(amount: float) -> int:
+    return round(amount * MINOR_UNITS)
+
+
+def to_minor_expression(amount):
+    """SQL counterpart of ``to_minor`` for amounts computed in a statement."""
+    return cast(func.round(amount * MINOR_UNITS), Integer)
+
+
+async def append(session, entries: list[dict]):
+    """Insert entries (see ``entry``) in the caller's transaction."""
+    if entries:
+        await session.execute(insert(models.DBLedgerEntry), entries)
+
+
+def entry(
+    wallet_id: int, amount: int, kind: str, created_at, transaction_id=None
+) -> dict:
+    return dict(
+        wallet_id=wallet_id,
+        amount=amount,
+        kind=kind,
+        transaction_id=transaction_id,
+        created_at=created_at,
+    )
+
+
+def purchase_entries(transactions) -> list[dict]:
+    return [
+        entry(
+            transaction.wallet_id,
+            -to_minor(transaction.amount),
+            PURCHASE,
+            transaction.timestamp,
+            transaction.id,
+        )
+        for transaction in transactions
+    ]
+
+
+async def latest_snapshot(session, wallet_id: int) -> tuple[int, int]:
+    """``(entry_id, balance)`` of the newest snapshot, ``(0, 0)`` without one."""
+    snapshot = models.DBLedgerSnapshot
+    row = (
+        await session.execute(
+            select(snapshot.entry_id, snapshot.balance)
+            .where(snapshot.wallet_id == wallet_id)
+            .order_by(snapshot.entry_id.desc())
+            .limit(1)
+        )
+    ).first()
+    return tuple(row) if row else (0, 0)
+
+
+async def balance(session, wallet_id: int) -> tuple[int, int]:
+    """Return ``(balance, tail)`` in minor units: the latest snapshot plus the
+    ``tail`` entries written after it."""
+    entries = models.DBLedgerEntry
+    entry_id, snapshot_balance = await latest_snapshot(session, wallet_id)
+    total, tail = (
+        await session.execute(
+            select(func.coalesce(func.sum(entries.amount), 0), func.count()).where(
+                entries.wallet_id == wallet_id, entries.id > entry_id
+            )
+        )
+    ).one()
+    return snapshot_balance + total, tail
+
+
+async def snapshot_due(session, every: int = SNAPSHOT_EVERY) -> list[int]:
+    """Wallets with at least ``every`` entries after their latest snapshot."""
+    entries = models.DBLedgerEntry
+    snapshot = models.DBLedgerSnapshot
+    latest = (
+        select(func.max(snapshot.entry_id))
+        .where(snapshot.wallet_id == entries.wallet_id)
+        .correlate(entries)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        select(entries.wallet_id)
+        .where(entries.id > func.coalesce(latest, 0))
+        .group_by(entries.wallet_id)
+        .having(func.count() >= every)
+    )
+    return list(result.scalars())
+
+
+async def take_snapshot(session, wallet_id: int) -> models.DBLedgerSnapshot | None:
+    """Snapshot the wallet's current ledger balance; the caller commits.
+
+    Entries are always appended together with a wallet update, so locking the
+    wallet row first waits out in-flight writers: no entry with a lower id
+    can commit after the snapshot has been taken.
+    """
+    await session.execute(
+        select(models.DBWallet.id)
+        .where(models.DBWallet.id == wallet_id)
+        .with_for_update()
+    )
+    entries = models.DBLedgerEntry
+    last_entry = (
+        await session.execute(
+            select(func.max(entries.id)).where(entries.wallet_id == wallet_id)
+        )
+    ).scalar()
+    entry_id, snapshot_balance = await latest_snapshot(session, wallet_id)
+    if last_entry is None or last_entry == entry_id:
+        return None
+
+    total = (
+        await session.execute(
+            select(func.sum(entries.amount)).where(
+                entries.wallet_id == wallet_id,
+                entries.id > entry_id,
+                entries.id <= last_entry,
+            )
+        )
+    ).scalar()
+    snapshot = models.DBLedgerSnapshot(
+        wallet_id=wallet_id, entry_id=last_entry, balance=snapshot_balance + total
+    )
+    session.add(snapshot)
+    return snapshot
+
+
+@dataclass
+class Replay:
+    wallet_id: int
+    balance: int = 0
+    entries: int = 0
+    # (entry_id, stored balance, replayed balance) of snapshots that disagree
+    bad_snapshots: list[tuple[int, int, int]] = field(default_factory=list)
+    wallet_balance: int | None = None
+
+    @property
+    def ok(self) -> bool:
+        return not self.bad_snapshots and self.wallet_balance in (None, self.balance)
+
+
+async def replay(session, wallet_id: int, rebuild: bool = False) -> Replay:
+    """Replay every entry of a wallet, ``CHUNK_ROWS`` at a time, in id order.
+
+    Stored snapshots are checked against the running balance, and the result
+    against ``wallets.balance``. With ``rebuild`` the wallet's snapshots are
+    replaced by fresh ones every ``SNAPSHOT_EVERY`` entries; the caller
+    commits.
+    """
+    entries = models.DBLedgerEntry
+    snapshot = models.DBLedgerSnapshot
+    report = Replay(wallet_id)
+
+    if rebuild:
+        # As in take_snapshot, keep writers out while the snapshots are redone
+        await session.execute(
+            select(models.DBWallet.id)
+            .where(models.DBWallet.id == wallet_id)
+            .with_for_update()
+        )
+        await session.execute(delete(snapshot).where(snapshot.wallet_id == wallet_id))
+        stored = {}
+    else:
+        stored = dict(
+            (
+                await session.execute(
+                    select(snapshot.entry_id, snapshot.balance).where(
+                        snapshot.wallet_id == wallet_id
+                    )
+                )
+            ).all()
+        )
+
+    last_id = 0
+    while True:
+        rows = (
+            await session.execute(
+                select(entries.id, entries.amount)
+                .where(entries.wallet_id == wallet_id, entries.id > last_id)
+                .order_by(entries.id)
+                .limit(CHUNK_ROWS)
+            )
+        ).all()
+        if not rows:
+            break
+
+        new_snapshots = []
+        for entry_id, amount in rows:
+            report.balance += amount
+            report.entries += 1
+            if entry_id in stored and stored[entry_id] != report.balance:
+                report.bad_snapshots.append(
+                    (entry_id, stored[entry_id], report.balance)
+                )
+            if rebuild and report.entries % SNAPSHOT_EVERY == 0:
+                new_snapshots.append(
+                    dict(wallet_id=wallet_id, entry_id=entry_id, balance=report.balance)
+                )
+        if new_snapshots:
+            await session.execute(insert(snapshot), new_snapshots)
+        last_id = rows[-1][0]
+
+    wallet_balance = (
+        await session.execute(
+            select(models.DBWallet.balance).where(models.DBWallet.id == wallet_id)
+        )
+    ).scalar()
+    if wallet_balance is not None:
+        report.wallet_balance = to_minor(wallet_balance)
+    return report
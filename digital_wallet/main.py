@@ -1,31 +1,57 @@
-# ssl patch
-from gevent import monkey
-
-monkey.patch_all()
-
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 
+from . import admission
 from . import config
+from . import counters
+from . import group_commit
+from . import idempotency
+from . import instrumentation
+from . import item_cache
+from . import last_login
 from . import models
+from . import passwords
+from . import profiling
+from . import reads
 from . import routers
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    counters.start_refresher(config.get_settings())
     yield
+    await counters.stop_refresher()
+    # Write login timestamps still held by the write-behind buffer
+    await last_login.close_last_login()
+    # Apply purchases still waiting for their group commit window
+    await group_commit.close_group_commit()
+    await item_cache.close_item_cache()
     if models.engine is not None:
         # Close the DB connection
-        await models.sesion_close()
+        await models.close_session()
 
 
 def create_app(settings=None):
     if not settings:
         settings = config.get_settings()
 
-    app = FastAPI(lifespan=lifespan)
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+    app.add_middleware(profiling.ProfilingMiddleware)
+    app.add_middleware(admission.AdmissionMiddleware)
+    # Added last so it is outermost and also counts rejected requests
+    app.add_middleware(instrumentation.MetricsMiddleware)
 
     models.init_db(settings)
+    group_commit.init_group_commit(settings)
+    idempotency.init_idempotency(settings)
+    passwords.init_passwords(settings)
+    item_cache.init_item_cache(settings)
+    reads.init_reads(settings)
+    last_login.init_last_login(settings)
+    admission.init_admission(settings)
+    instrumentation.init_instrumentation(settings)
+    profiling.init_profiling(settings)
 
     routers.init_router(app)
     return app
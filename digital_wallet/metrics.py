@@ -0,0 +1,166 @@
+import bisect
+import contextlib
+import math
+import time
+
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    math.inf,
+)
+
+REGISTRY: dict[str, "Metric"] = {}
+# Called before rendering, for values that are cheaper to read than to track
+COLLECTORS: list = []
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _labels(self, key: tuple, extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self):
+        return []
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines += [
+            f"{name}{labels} {_number(value)}" for name, labels, value in self.samples()
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels) if self.labelnames else ()
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def inc_key(self, key: tuple, amount: float = 1):
+        """``inc`` with label values already in ``labelnames`` order."""
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels) if self.labelnames else (), 0)
+
+    def samples(self):
+        return [
+            (self.name, self._labels(key), value)
+            for key, value in list(self.values.items())
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., sum, count]
+        self.values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        self.observe_key(self._key(labels), value)
+
+    def observe_key(self, key: tuple, value: float):
+        """``observe`` with label values already in ``labelnames`` order."""
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self.values.get(self._key(labels))
+        return series[-1] if series else 0
+
+    def sum(self, **labels) -> float:
+        series = self.values.get(self._key(labels))
+        return series[-2] if series else 0.0
+
+    def samples(self):
+        samples = []
+        for key, series in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="' + ("+Inf" if bound == math.inf else repr(bound)) + '"'
+                samples.append(
+                    (f"{self.name}_bucket", self._labels(key, le), cumulative)
+                )
+            samples.append((f"{self.name}_sum", self._labels(key), series[-2]))
+            samples.append((f"{self.name}_count", self._labels(key), series[-1]))
+        return samples
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    for collect in COLLECTORS:
+        collect()
+    return "\n".join(metric.render() for metric in REGISTRY.values()) + "\n"
+
+
+@contextlib.contextmanager
+def timer(histogram: Histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
@@ -0,0 +1,229 @@
+"""Forward-only schema migrations that run against a live database.
+
+``recreate_table`` drops everything, so existing databases are brought up to
+the models here instead. Applied migrations are recorded in
+``schema_migrations``; running again only applies the missing ones. Index
+migrations use ``CREATE INDEX CONCURRENTLY`` on Postgres, which cannot run in
+a transaction block, so they run in autocommit mode and are written to be
+safe to repeat.
+
+    python scripts/migrate.py
+"""
+
+import datetime
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    literal,
+    null,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.schema import CreateIndex
+
+from . import ledger
+from . import models
+
+
+metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass
+class Migration:
+    id: str
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+    # Run outside a transaction, e.g. for CREATE INDEX CONCURRENTLY
+    online: bool = False
+
+
+@dataclass
+class AddColumn:
+    table: str
+    column: str
+    definition: str  # e.g. "INTEGER NOT NULL DEFAULT 1"
+
+    async def __call__(self, connection: AsyncConnection):
+        columns = await connection.run_sync(
+            lambda sync: [c["name"] for c in inspect(sync).get_columns(self.table)]
+        )
+        if self.column not in columns:
+            await connection.execute(
+                text(
+                    f"ALTER TABLE {self.table}"
+                    f" ADD COLUMN {self.column} {self.definition}"
+                )
+            )
+
+
+@dataclass
+class CreateIndexes:
+    """Create the named indexes declared on the models, if they are missing."""
+
+    names: list[str] = field(default_factory=list)
+
+    async def __call__(self, connection: AsyncConnection):
+        indexes = {
+            index.name: index
+            for table in models.SQLModel.metadata.tables.values()
+            for index in table.indexes
+        }
+        for name in self.names:
+            await create_index(connection, indexes[name])
+
+
+async def create_index(connection: AsyncConnection, index):
+    postgresql = connection.dialect.name == "postgresql"
+    if postgresql:
+        # A failed concurrent build leaves an INVALID index behind, which
+        # IF NOT EXISTS would then keep forever
+        invalid = (
+            await connection.execute(
+                text(
+                    "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid"
+                    " WHERE relname = :name AND NOT indisvalid"
+                ),
+                dict(name=index.name),
+            )
+        ).first()
+        if invalid:
+            await connection.execute(text(f"DROP INDEX CONCURRENTLY {index.name}"))
+
+    # Only for this statement: create_all must not build indexes concurrently
+    index.dialect_options["postgresql"]["concurrently"] = postgresql
+    try:
+        statement = str(
+            CreateIndex(index, if_not_exists=True).compile(dialect=connection.dialect)
+        )
+    finally:
+        index.dialect_options["postgresql"]["concurrently"] = False
+    await connection.execute(text(statement))
+
+
+@dataclass
+class CreateTables:
+    """Create the named model tables, if they are missing."""
+
+    names: list[str] = field(default_factory=list)
+
+    async def __call__(self, connection: AsyncConnection):
+        tables = [models.SQLModel.metadata.tables[name] for name in self.names]
+        await connection.run_sync(models.SQLModel.metadata.create_all, tables=tables)
+
+
+async def create_ledger(connection: AsyncConnection):
+    """Create the ledger tables and open every existing wallet at its balance."""
+    await CreateTables(["ledger_entries", "ledger_snapshots"])(connection)
+
+    entries = models.DBLedgerEntry.__table__
+    wallets = models.DBWallet.__table__
+    opened = select(entries.c.id).where(entries.c.wallet_id == wallets.c.id).exists()
+    await connection.execute(
+        entries.insert().from_select(
+            ledger.ENTRY_COLUMNS,
+            select(
+                wallets.c.id,
+                ledger.to_minor_expression(wallets.c.balance),
+                literal(ledger.OPENING),
+                null(),
+                wallets.c.last_updated,
+            ).where(~opened),
+        )
+    )
+
+
+MIGRATIONS = [
+    Migration(
+        "0001_item_versions",
+        AddColumn("items", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ),
+    Migration(
+        "0002_merchant_versions",
+        AddColumn("merchants", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ),
+    Migration(
+        "0003_lookup_indexes",
+        CreateIndexes(
+            [
+                "ix_users_username",
+                "ix_users_email",
+                "ix_wallets_user_id",
+                "ix_transactions_timestamp_id",
+                "ix_transactions_user_id_timestamp_id",
+            ]
+        ),
+        online=True,
+    ),
+    Migration("0004_ledger", create_ledger),
+    Migration("0005_idempotency_keys", CreateTables(["idempotency_keys"])),
+    # Counters are seeded by the refresher (COUNTER_REFRESH_SECONDS)
+    Migration("0006_row_counters", CreateTables(["row_counters"])),
+    # The default backfills every existing user as active
+    Migration(
+        "0007_user_status",
+        AddColumn("users", "status", "VARCHAR NOT NULL DEFAULT 'active'"),
+    ),
+    Migration("0008_refresh_tokens", CreateTables(["refresh_tokens"])),
+    Migration(
+        "0009_refresh_token_expiry",
+        CreateIndexes(["ix_refresh_tokens_expires_at"]),
+        online=True,
+    ),
+]
+
+
+async def migrate(engine, migrations: list[Migration] = MIGRATIONS) -> list[str]:
+    """Apply the migrations that have not run yet, in order; return their ids."""
+    async with engine.begin() as connection:
+        await connection.run_sync(metadata.create_all)
+        applied = set(
+            (await connection.execute(select(schema_migrations.c.id))).scalars()
+        )
+
+    done = []
+    for migration in migrations:
+        if migration.id in applied:
+            continue
+
+        if migration.online:
+            async with engine.connect() as connection:
+                connection = await connection.execution_options(
+                    isolation_level="AUTOCOMMIT"
+                )
+                await migration.apply(connection)
+                await _record(connection, migration)
+        else:
+            async with engine.begin() as connection:
+                await migration.apply(connection)
+                await _record(connection, migration)
+        print("applied migration", migration.id)
+        done.append(migration.id)
+    return done
+
+
+async def _record(connection: AsyncConnection, migration: Migration):
+    await connection.execute(
+        schema_migrations.insert().values(
+            id=migration.id, applied_at=datetime.datetime.utcnow()
+        )
+    )
+
+
+async def main():
+    try:
+        await migrate(models.engine)
+    finally:
+        await models.close_session()
@@ -1,38 +1,145 @@
+import time
 from typing import Optional, AsyncIterator
 
+from fastapi import Request
+
 from sqlmodel import Field, SQLModel, create_engine, Session, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 
+from .. import metrics
 from . import items
 from . import merchants
 from . import users
 from . import wallets
 from . import transactions
+from . import counters
+from . import tokens
+from . import ledger
+from . import idempotency
 
 from .items import *
 from .merchants import *
 from .users import *
 from .wallets import *
 from .transactions import *
+from .counters import *
+from .tokens import *
+from .ledger import *
+from .idempotency import *
+
+# Drivers usable with create_async_engine; pg8000 is synchronous and is only
+# used for command line tooling through sync_engine()
+ASYNC_DRIVERS = {"asyncpg", "psycopg", "aiosqlite"}
 
-connect_args = {}
+READ_PRIMARY_HEADER = "X-Read-Your-Writes"
 
 engine = None
+read_engine = None
+async_session = None
+read_session = None
+sync_url = None
+
+
+def build_url(url: str, driver: str | None):
+    url = make_url(url)
+    if driver and url.get_backend_name() == "postgresql":
+        url = url.set(drivername=f"postgresql+{driver}")
+    return url
+
+
+checkout_wait = metrics.Histogram(
+    "db_pool_checkout_seconds", "Time to check a connection out of the pool"
+)
+
+
+class WaitTrackingPool(AsyncAdaptedQueuePool):
+    """Queue pool that knows how long its oldest pending checkout has waited."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting: dict[object, float] = {}
+
+    def _do_get(self):
+        token = object()
+        started = self.waiting[token] = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            del self.waiting[token]
+            checkout_wait.observe(time.monotonic() - started)
+
+    def longest_wait(self) -> float:
+        if not self.waiting:
+            return 0.0
+        return time.monotonic() - min(self.waiting.values())
+
+
+def engine_options(settings, url) -> dict:
+    options = dict(echo=settings.DB_ECHO, future=True)
+    if url.get_backend_name() == "sqlite":
+        return options
+
+    options.update(
+        poolclass=WaitTrackingPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+    )
+    if url.get_driver_name() == "asyncpg":
+        options["connect_args"] = dict(
+            prepared_statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE
+        )
+    return options
 
 
 def init_db(settings):
-    global engine
+    global engine, read_engine, async_session, read_session, sync_url
 
-    engine = create_async_engine(
-        settings.SQLDB_URL,
-        echo=True,
-        future=True,
-        connect_args=connect_args,
-    )
+    url = build_url(settings.SQLDB_URL, settings.DB_DRIVER)
+    if url.get_driver_name() not in ASYNC_DRIVERS:
+        raise ValueError(
+            f"DB_DRIVER {url.get_driver_name()!r} is not an async driver, "
+            f"use one of {sorted(ASYNC_DRIVERS)}"
+        )
+
+    engine = create_async_engine(url, **engine_options(settings, url))
+    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    if settings.SQLDB_READ_URL:
+        read_url = build_url(settings.SQLDB_READ_URL, settings.DB_DRIVER)
+        read_engine = create_async_engine(read_url, **engine_options(settings, read_url))
+        read_session = sessionmaker(
+            read_engine,
+            class_=AsyncSession,
+            expire_on_commit=False,
+            info={"read_only": True},
+        )
+    else:
+        read_engine = None
+        read_session = async_session
+
+    sync_url = build_url(settings.SQLDB_URL, settings.DB_SYNC_DRIVER)
+    if url.get_backend_name() == "sqlite":
+        sync_url = sync_url.set(drivername="sqlite")
+
+
+def sync_engine(**options):
+    """Blocking engine for scripts and worker processes (pg8000 by default)."""
+    return create_engine(sync_url, **options)
+
+
+def pool_wait() -> float:
+    """Seconds the oldest checkout from the primary pool has been waiting."""
+    pool = engine.sync_engine.pool if engine is not None else None
+    return pool.longest_wait() if isinstance(pool, WaitTrackingPool) else 0.0
 
 
 async def recreate_table():
@@ -42,13 +149,23 @@ async def recreate_table():
 
 
 async def get_session() -> AsyncIterator[AsyncSession]:
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
     async with async_session() as session:
         yield session
 
 
+async def get_read_session(request: Request) -> AsyncIterator[AsyncSession]:
+    # Clients that must see their own recent writes can pin reads to the primary
+    maker = read_session
+    if request.headers.get(READ_PRIMARY_HEADER):
+        maker = async_session
+    async with maker() as session:
+        yield session
+
+
 async def close_session():
     global engine
     if engine is None:
         raise Exception("DatabaseSessionManager is not initialized")
     await engine.dispose()
+    if read_engine is not None:
+        await read_engine.dispose()
@@ -0,0 +1,9 @@
+from sqlmodel import Field, SQLModel
+
+
+class DBRowCounter(SQLModel, table=True):
+    __tablename__ = "row_counters"
+    name: str = Field(primary_key=True)
+    scope: str = Field(default="", primary_key=True)
+    slot: int = Field(default=0, primary_key=True)
+    value: int = Field(default=0)
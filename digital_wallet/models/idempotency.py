@@ -0,0 +1,21 @@
+import datetime
+from typing import Optional
+
+from sqlmodel import Field, SQLModel
+
+
+class DBIdempotencyKey(SQLModel, table=True):
+    """The stored outcome of one ``Idempotency-Key`` per user.
+
+    ``status_code`` stays NULL while the first request is running; that claim
+    is only held until ``expires_at``, after which another request may take it
+    over.
+    """
+
+    __tablename__ = "idempotency_keys"
+    user_id: int = Field(primary_key=True, foreign_key="users.id")
+    key: str = Field(primary_key=True)
+    fingerprint: str  # method, path and query of the first request
+    status_code: Optional[int] = None
+    body: Optional[str] = None
+    expires_at: datetime.datetime = Field(index=True)
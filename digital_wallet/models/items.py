@@ -29,12 +29,15 @@ class UpdatedItem(BaseItem):
 class Item(BaseItem):
     id: int
     merchant_id: int
+    version: int = 1
     # merchant: merchants.Merchant | None
 
 
 class DBItem(BaseItem, SQLModel, table=True):
     __tablename__ = "items"
     id: int = Field(default=None, primary_key=True)
+    # Bumped by every update; the ETag of GET /items/{id}
+    version: int = Field(default=1)
     merchant_id: int = Field(default=None, foreign_key="merchants.id")
     merchant: merchants.DBMerchant = Relationship()
 
@@ -50,3 +53,16 @@ class ItemList(BaseModel):
     page: int
     page_count: int
     size_per_page: int
+    next_cursor: str | None = None
+    count_exact: bool = True
+
+
+class BulkItemError(BaseModel):
+    row: int  # 1-based position in the upload, not counting a CSV header
+    errors: list[str]
+
+
+class BulkItemResult(BaseModel):
+    inserted: int
+    failed: int
+    errors: list[BulkItemError]  # the first bulk.MAX_REPORTED_ERRORS only
@@ -0,0 +1,37 @@
+import datetime
+from typing import Optional
+
+from sqlalchemy import Index
+from sqlmodel import Field, SQLModel
+
+
+class DBLedgerEntry(SQLModel, table=True):
+    """One debit (negative) or credit (positive) on a wallet, never updated.
+
+    Amounts are integer minor units (cents). ``wallet_id`` has no foreign key
+    so the history outlives a deleted wallet.
+    """
+
+    __tablename__ = "ledger_entries"
+    # Tail sums after a snapshot and chunked replays both walk (wallet_id, id)
+    __table_args__ = (Index("ix_ledger_entries_wallet_id_id", "wallet_id", "id"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    wallet_id: int
+    amount: int
+    kind: str  # "opening", "purchase" or "adjustment"
+    transaction_id: Optional[int] = Field(default=None, foreign_key="transactions.id")
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+
+
+class DBLedgerSnapshot(SQLModel, table=True):
+    """The balance of a wallet after every entry up to and including ``entry_id``."""
+
+    __tablename__ = "ledger_snapshots"
+    __table_args__ = (
+        Index("ix_ledger_snapshots_wallet_id_entry_id", "wallet_id", "entry_id"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    wallet_id: int
+    entry_id: int
+    balance: int
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
@@ -25,11 +25,14 @@ class UpdatedMerchant(BaseMerchant):
 
 class Merchant(BaseMerchant):
     id: int
+    version: int = 1
 
 
 class DBMerchant(BaseMerchant, SQLModel, table=True):
     __tablename__ = "merchants"
     id: Optional[int] = Field(default=None, primary_key=True)
+    # Bumped by every update; the ETag of GET /merchants/{id}
+    version: int = Field(default=1)
 
     user_id: int = Field(default=None, foreign_key="users.id")
     user: users.DBUser | None = Relationship()
@@ -39,5 +42,6 @@ class MerchantList(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     merchants: list[Merchant]
     page: int
-    page_size: int
+    page_size: int  # rows on this page
     size_per_page: int
+    next_cursor: str | None = None
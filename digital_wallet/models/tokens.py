@@ -0,0 +1,19 @@
+import datetime
+
+from pydantic import BaseModel
+from sqlmodel import Field, SQLModel
+
+
+class RefreshToken(BaseModel):
+    refresh_token: str
+
+
+class DBRefreshToken(SQLModel, table=True):
+    """One row per login session; rotating a refresh token rewrites the row."""
+
+    __tablename__ = "refresh_tokens"
+    family_id: str = Field(primary_key=True)
+    user_id: int = Field(foreign_key="users.id")
+    current_jti: str
+    revoked: bool = Field(default=False)
+    expires_at: datetime.datetime = Field(index=True)
@@ -1,9 +1,16 @@
 from datetime import datetime
+from pydantic import BaseModel
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel, Relationship
 from typing import Optional
 
 class DBTransaction(SQLModel, table=True):
     __tablename__ = "transactions"
+    # Keyset pagination on (timestamp, id), overall and per user
+    __table_args__ = (
+        Index("ix_transactions_timestamp_id", "timestamp", "id"),
+        Index("ix_transactions_user_id_timestamp_id", "user_id", "timestamp", "id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="users.id")
     item_id: int = Field(foreign_key="items.id")
@@ -20,3 +27,19 @@ class TransactionList(SQLModel):
     page: int
     page_count: int
     size_per_page: int
+    next_cursor: str | None = None
+    count_exact: bool = True
+
+
+class CheckoutLine(BaseModel):
+    item_id: int
+    quantity: int = Field(gt=0)
+
+
+class Checkout(BaseModel):
+    items: list[CheckoutLine] = Field(min_length=1, max_length=100)
+
+
+class CheckoutReceipt(SQLModel):
+    transactions: list[DBTransaction]
+    total: float
@@ -6,12 +6,10 @@ from sqlalchemy import Column
 from sqlalchemy.dialects.postgresql import JSON  # Use JSON for list storage
 from typing import List, Optional
 
-from passlib.context import CryptContext
+from .. import passwords
 from . import wallets
 from . import transactions
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 class BaseUser(BaseModel):
     model_config = ConfigDict(from_attributes=True, populate_by_name=True)
@@ -80,6 +78,13 @@ class TokenData(BaseModel):
     user_id: str | None = None
 
 
+class Principal(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    roles: list[str] = pydantic.Field(default_factory=list)
+    status: str = "active"
+
+
 class ChangedPasswordUser(BaseModel):
     current_password: str
     new_password: str
@@ -88,9 +93,13 @@ class ChangedPasswordUser(BaseModel):
 class DBUser(BaseUser, SQLModel, table=True):
     __tablename__ = "users"
     id: int | None = Field(default=None, primary_key=True)
-    
+    # /token looks users up by either one
+    username: str = Field(index=True)
+    email: str = Field(index=True)
+
     password: str
     roles: List[str] = Field(default_factory=list, sa_column=Column(JSON))  # Use JSON to store roles
+    status: str = Field(default="active")
 
     register_date: datetime.datetime = Field(default_factory=datetime.datetime.now)
     updated_date: datetime.datetime = Field(default_factory=datetime.datetime.now)
@@ -104,10 +113,19 @@ class DBUser(BaseUser, SQLModel, table=True):
         return any(role in self.roles for role in roles)
 
     async def set_password(self, plain_password: str):
-        self.password = pwd_context.hash(plain_password)
+        self.password = await passwords.hash_password(plain_password)
 
     async def verify_password(self, plain_password: str) -> bool:
-        return pwd_context.verify(plain_password, self.password)
+        return await passwords.verify_password(plain_password, self.password)
+
+    async def verify_and_update_password(self, plain_password: str) -> bool:
+        # Rehash transparently when the scheme or work factor has changed
+        verified, new_hash = await passwords.verify_and_update(
+            plain_password, self.password
+        )
+        if verified and new_hash:
+            self.password = new_hash
+        return verified
 
     async def is_use_citizen_id_as_password(self):
-        return pwd_context.verify(self.citizen_id, self.password)
+        return await passwords.verify_password(self.citizen_id, self.password)
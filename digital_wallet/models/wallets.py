@@ -25,7 +25,8 @@ class DBWallet(BaseWallet, SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     last_updated: datetime = Field(default=datetime.utcnow(), sa_column_kwargs={"onupdate": datetime.utcnow})
 
-    user_id: int = Field(default=None, foreign_key="users.id")
+    # One wallet per user; purchases find it by user_id
+    user_id: int = Field(default=None, foreign_key="users.id", index=True, unique=True)
     user: Optional["DBUser"] = Relationship(back_populates="wallet")  # Use a string to reference the class
     
     transactions: list["DBTransaction"] = Relationship(back_populates="wallet")
@@ -35,5 +36,6 @@ class WalletList(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     wallets: list[Wallet]
     page: int
-    page_size: int
+    page_size: int  # rows on this page
     size_per_page: int
+    next_cursor: str | None = None
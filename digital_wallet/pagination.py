@@ -0,0 +1,57 @@
+import base64
+import datetime
+import json
+
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+
+
+def encode_cursor(*values) -> str:
+    """Pack the sort key of the last row on a page into an opaque cursor."""
+    payload = [
+        value.isoformat() if isinstance(value, datetime.datetime) else value
+        for value in values
+    ]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    """Unpack a cursor made by ``encode_cursor``, coercing each value to ``types``."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if len(payload) != len(types):
+            raise ValueError("cursor length mismatch")
+
+        return [
+            datetime.datetime.fromisoformat(value)
+            if type_ is datetime.datetime
+            else type_(value)
+            for type_, value in zip(types, payload)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+def after(columns: list, cursor: str | None, *types):
+    """WHERE clause selecting the rows that sort after ``cursor`` on ``columns``."""
+    if cursor is None:
+        return None
+
+    values = decode_cursor(cursor, *types)
+    if len(columns) == 1:
+        return columns[0] > values[0]
+    return tuple_(*columns) > tuple_(*values)
+
+
+def next_cursor(rows: list, size: int, *attributes) -> tuple[list, str | None]:
+    """Trim the look-ahead row fetched with ``limit(size + 1)`` and build the cursor."""
+    if len(rows) <= size:
+        return rows, None
+
+    rows = rows[:size]
+    last = rows[-1]
+    return rows, encode_cursor(*(getattr(last, attribute) for attribute in attributes))
@@ -0,0 +1,122 @@
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from . import config
+from . import metrics
+
+
+queue_depth = metrics.Gauge(
+    "password_hash_queue_depth", "Password hash/verify calls waiting for a worker"
+)
+in_progress = metrics.Gauge(
+    "password_hash_in_progress", "Password hash/verify calls running on a worker"
+)
+duration = metrics.Histogram(
+    "password_hash_seconds", "Time spent hashing or verifying one password"
+)
+
+settings = config.get_settings()
+
+pwd_context: CryptContext = None
+context_string: str = ""
+executor: Executor = None
+limit: asyncio.Semaphore = None
+max_queue: int = 0
+
+
+def build_context(settings) -> CryptContext:
+    # The first scheme hashes new passwords; the rest only verify and are
+    # marked deprecated so a successful login rehashes them.
+    options = {}
+    if "bcrypt" in settings.PASSWORD_SCHEMES:
+        options["bcrypt__rounds"] = settings.BCRYPT_ROUNDS
+    return CryptContext(
+        schemes=settings.PASSWORD_SCHEMES, deprecated="auto", **options
+    )
+
+
+def init_passwords(settings):
+    global pwd_context, context_string, executor, limit, max_queue
+
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+    pwd_context = build_context(settings)
+    context_string = pwd_context.to_string()
+    if settings.PASSWORD_HASH_EXECUTOR == "process":
+        executor = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+    else:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            thread_name_prefix="password-hash",
+        )
+    limit = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS)
+    max_queue = settings.PASSWORD_HASH_MAX_QUEUE
+
+
+@functools.lru_cache(maxsize=8)
+def _context(config_string: str) -> CryptContext:
+    return CryptContext.from_string(config_string)
+
+
+# Module-level so they can be pickled into a process pool
+def _hash(config_string: str, plain_password: str) -> str:
+    return _context(config_string).hash(plain_password)
+
+
+def _verify(config_string: str, plain_password: str, hashed_password: str) -> bool:
+    return _context(config_string).verify(plain_password, hashed_password)
+
+
+def _verify_and_update(
+    config_string: str, plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    return _context(config_string).verify_and_update(plain_password, hashed_password)
+
+
+async def _run(function, *args):
+    if max_queue and queue_depth.get() >= max_queue:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, try again",
+            headers={"Retry-After": "1"},
+        )
+
+    queue_depth.inc()
+    try:
+        await limit.acquire()
+    finally:
+        queue_depth.dec()
+
+    in_progress.inc()
+    try:
+        loop = asyncio.get_running_loop()
+        with metrics.timer(duration):
+            return await loop.run_in_executor(
+                executor, function, context_string, *args
+            )
+    finally:
+        in_progress.dec()
+        limit.release()
+
+
+async def hash_password(plain_password: str) -> str:
+    return await _run(_hash, plain_password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run(_verify, plain_password, hashed_password)
+
+
+async def verify_and_update(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    """Verify and, if the hash uses an old scheme or cost, return its replacement."""
+    return await _run(_verify_and_update, plain_password, hashed_password)
+
+
+init_passwords(settings)
@@ -0,0 +1,167 @@
+"""Opt-in per-request query profiling (``QUERY_PROFILING``).
+
+Cursor execute events on the application's engines attribute every
+statement to the request that ran it. When the request ends:
+
+* the response carries ``Server-Timing`` with the request's database time
+  and statement count, next to the time to the first response byte,
+* statements the request ran ``QUERY_REPEAT_THRESHOLD`` times or more, the
+  usual sign of an N+1 loop, are logged and counted per route.
+
+Statements slower than ``SLOW_QUERY_SECONDS`` are logged, whether a request
+ran them or not, for a ``SLOW_QUERY_SAMPLE_RATE`` fraction of them. Only
+statement text is logged, never parameters.
+
+This replaces ``DB_ECHO`` for finding out what a request does: echo writes
+every statement to stdout as it runs and cannot tell requests apart.
+"""
+
+import collections
+import contextvars
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+from . import instrumentation
+from . import metrics
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+queries_per_request = metrics.Histogram(
+    "db_queries_per_request",
+    "Statements run by one request, while profiling is on",
+    ("method", "route"),
+    buckets=(1, 2, 5, 10, 20, 50, 100, float("inf")),
+)
+repeated_statements = metrics.Counter(
+    "db_repeated_statements_total",
+    "Statements run repeat threshold times or more by one request",
+    ("method", "route"),
+)
+
+enabled = False
+repeat_threshold = 0
+slow_seconds = 0.0
+slow_sample_rate = 0.0
+# Engines whose cursor events are being listened to
+profiled_engines: list = []
+
+
+@dataclass
+class Profile:
+    started: float
+    queries: int = 0
+    seconds: float = 0.0
+    statements: collections.Counter = field(default_factory=collections.Counter)
+    # Tasks started by the request copy its context; once it has finished
+    # their statements are no longer its own
+    finished: bool = False
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.seconds * 1000:.1f};desc="{self.queries} queries", '
+            f"app;dur={(time.perf_counter() - self.started) * 1000:.1f}"
+        )
+
+    def repeated(self) -> list[tuple[str, int]]:
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= repeat_threshold
+        ]
+
+
+current_profile: contextvars.ContextVar[Profile | None] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+def init_profiling(settings):
+    global enabled, repeat_threshold, slow_seconds, slow_sample_rate
+
+    enabled = settings.QUERY_PROFILING
+    repeat_threshold = settings.QUERY_REPEAT_THRESHOLD
+    slow_seconds = settings.SLOW_QUERY_SECONDS
+    slow_sample_rate = settings.SLOW_QUERY_SAMPLE_RATE
+
+    for engine in profiled_engines:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+        event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+    profiled_engines.clear()
+    if not enabled:
+        return
+
+    # Listeners on these engines only: nothing runs per statement when off
+    for engine in {models.engine, models.read_engine} - {None}:
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+        profiled_engines.append(engine.sync_engine)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._profile_started
+    profile = current_profile.get()
+    if profile is not None and not profile.finished:
+        profile.queries += 1
+        profile.seconds += elapsed
+        profile.statements[statement] += 1
+
+    if elapsed >= slow_seconds and random.random() < slow_sample_rate:
+        method, route = instrumentation.current_route()
+        logger.warning(
+            "slow query %.1f ms in %s %s: %s",
+            elapsed * 1000,
+            method,
+            route,
+            " ".join(statement.split()),
+        )
+
+
+def _report(scope, profile: Profile):
+    method, route = key = instrumentation.route_labels(scope)
+    queries_per_request.observe_key(key, profile.queries)
+    for statement, count in profile.repeated():
+        repeated_statements.inc_key(key)
+        logger.warning(
+            "statement run %d times in %s %s: %s",
+            count,
+            method,
+            route,
+            " ".join(statement.split()),
+        )
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled:
+            return await self.app(scope, receive, send)
+
+        profile = Profile(started=time.perf_counter())
+
+        async def send_timing(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(
+                    "Server-Timing", profile.server_timing()
+                )
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_timing)
+        finally:
+            profile.finished = True
+            current_profile.reset(token)
+            _report(scope, profile)
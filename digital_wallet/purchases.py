@@ -0,0 +1,261 @@
+from datetime import datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import insert, literal, select, true, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import counters
+from . import ledger
+from . import models
+
+
+TRANSACTION_COLUMNS = ["user_id", "item_id", "wallet_id", "amount", "timestamp"]
+
+
+async def debit_and_record(
+    session: AsyncSession,
+    user_id: int,
+    item_id: int,
+    quantity: int,
+    timestamp: datetime | None = None,
+) -> models.DBTransaction:
+    """Debit the user's wallet and record the purchase without a read-modify-write.
+
+    The balance check happens inside the ``UPDATE ... WHERE balance >= cost`` so
+    concurrent purchases on one wallet can never overdraw it. The transaction row
+    and its ledger entry are written in the same statement or transaction. The
+    caller owns the database transaction and is responsible for committing it.
+    """
+    if timestamp is None:
+        timestamp = datetime.utcnow()
+
+    connection = await session.connection()
+    if connection.dialect.name == "postgresql":
+        row = await _debit_and_record_cte(session, user_id, item_id, quantity, timestamp)
+    else:
+        row = await _debit_and_record_fallback(
+            session, user_id, item_id, quantity, timestamp
+        )
+
+    if row is None:
+        await _raise_purchase_error(session, user_id, item_id)
+
+    return models.DBTransaction(**row._mapping)
+
+
+async def purchase(
+    session: AsyncSession,
+    user_id: int,
+    item_id: int,
+    quantity: int,
+) -> models.DBTransaction:
+    try:
+        transaction = await debit_and_record(session, user_id, item_id, quantity)
+    except HTTPException:
+        # End the failed transaction now rather than when the request finishes
+        await session.rollback()
+        raise
+    await session.commit()
+    return transaction
+
+
+async def checkout(
+    session: AsyncSession,
+    user_id: int,
+    lines: list[tuple[int, int]],
+) -> models.CheckoutReceipt:
+    """Buy every ``(item_id, quantity)`` line with one debit, or none of them.
+
+    Prices come from one ``IN`` query, the wallet is debited once with the
+    basket total under the same ``balance >= cost`` guard as ``purchase``, and
+    the transactions are written with one multi-row insert before a single
+    commit.
+    """
+    item_ids = {item_id for item_id, _ in lines}
+    prices = dict(
+        (
+            await session.execute(
+                select(models.DBItem.id, models.DBItem.price).where(
+                    models.DBItem.id.in_(item_ids)
+                )
+            )
+        ).all()
+    )
+    missing = item_ids - prices.keys()
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Item not found: {', '.join(map(str, sorted(missing)))}",
+        )
+
+    costs = [prices[item_id] * quantity for item_id, quantity in lines]
+    total = sum(costs)
+    timestamp = datetime.utcnow()
+    result = await session.execute(
+        update(models.DBWallet)
+        .where(models.DBWallet.user_id == user_id, models.DBWallet.balance >= total)
+        .values(balance=models.DBWallet.balance - total, last_updated=timestamp)
+        .returning(models.DBWallet.id)
+    )
+    wallet_id = result.scalar_one_or_none()
+    if wallet_id is None:
+        await _raise_purchase_error(session, user_id, lines[0][0])
+
+    inserted = (
+        await session.execute(
+            insert(models.DBTransaction).returning(
+                *models.DBTransaction.__table__.c, sort_by_parameter_order=True
+            ),
+            [
+                dict(
+                    user_id=user_id,
+                    item_id=item_id,
+                    wallet_id=wallet_id,
+                    amount=cost,
+                    timestamp=timestamp,
+                )
+                for (item_id, _), cost in zip(lines, costs)
+            ],
+        )
+    ).all()
+    transactions = [models.DBTransaction(**row._mapping) for row in inserted]
+    await ledger.append(session, ledger.purchase_entries(transactions))
+    await counters.increment(
+        session, "transactions", len(lines), ("", counters.user_scope(user_id))
+    )
+    await session.commit()
+
+    return models.CheckoutReceipt(transactions=transactions, total=total)
+
+
+async def _debit_and_record_cte(session, user_id, item_id, quantity, timestamp):
+    # WITH item AS (...), debit AS (UPDATE wallets ... RETURNING ...),
+    #      counted AS (UPDATE row_counters ... WHERE EXISTS (SELECT FROM debit))
+    #      recorded AS (INSERT INTO transactions SELECT ... FROM debit, item
+    #                   RETURNING ...),
+    #      entry AS (INSERT INTO ledger_entries SELECT ... FROM recorded)
+    # SELECT * FROM recorded
+    item = (
+        select(models.DBItem.id, (models.DBItem.price * quantity).label("cost"))
+        .where(models.DBItem.id == item_id)
+        .cte("item")
+    )
+    cost = select(item.c.cost).scalar_subquery()
+    debit = (
+        update(models.DBWallet)
+        .where(models.DBWallet.user_id == user_id, models.DBWallet.balance >= cost)
+        .values(balance=models.DBWallet.balance - cost, last_updated=timestamp)
+        .returning(models.DBWallet.id)
+        .cte("debit")
+    )
+    counted = (
+        counters.increment_statement(
+            "transactions", 1, ("", counters.user_scope(user_id))
+        )
+        .where(select(debit.c.id).exists())
+        .cte("counted")
+    )
+    recorded = (
+        insert(models.DBTransaction)
+        .from_select(
+            TRANSACTION_COLUMNS,
+            select(
+                literal(user_id),
+                item.c.id,
+                debit.c.id,
+                item.c.cost,
+                literal(timestamp, models.DBTransaction.__table__.c.timestamp.type),
+            ).select_from(debit.join(item, true())),
+        )
+        .returning(*models.DBTransaction.__table__.c)
+        .cte("recorded")
+    )
+    entry = (
+        insert(models.DBLedgerEntry)
+        .from_select(
+            ledger.ENTRY_COLUMNS,
+            select(
+                recorded.c.wallet_id,
+                -ledger.to_minor_expression(recorded.c.amount),
+                literal(ledger.PURCHASE),
+                recorded.c.id,
+                recorded.c.timestamp,
+            ),
+        )
+        .cte("entry")
+    )
+    statement = select(*recorded.c).add_cte(item, debit, counted, entry)
+    result = await session.execute(statement)
+    return result.one_or_none()
+
+
+async def _debit_and_record_fallback(session, user_id, item_id, quantity, timestamp):
+    # SQLite cannot run DML inside a CTE, so the debit and the insert are two
+    # statements in the same transaction. The debit is still a single conditional
+    # UPDATE, so the balance is never read back into Python.
+    cost = (
+        select(models.DBItem.price * quantity)
+        .where(models.DBItem.id == item_id)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(models.DBWallet)
+        .where(models.DBWallet.user_id == user_id, models.DBWallet.balance >= cost)
+        .values(balance=models.DBWallet.balance - cost, last_updated=timestamp)
+        .returning(models.DBWallet.id)
+    )
+    wallet_id = result.scalar_one_or_none()
+    if wallet_id is None:
+        return None
+
+    result = await session.execute(
+        insert(models.DBTransaction)
+        .from_select(
+            TRANSACTION_COLUMNS,
+            select(
+                literal(user_id),
+                models.DBItem.id,
+                literal(wallet_id),
+                models.DBItem.price * quantity,
+                literal(timestamp, models.DBTransaction.__table__.c.timestamp.type),
+            ).where(models.DBItem.id == item_id),
+        )
+        .returning(*models.DBTransaction.__table__.c)
+    )
+    row = result.one()
+    await ledger.append(
+        session, ledger.purchase_entries([models.DBTransaction(**row._mapping)])
+    )
+
+    await counters.increment(
+        session, "transactions", 1, ("", counters.user_scope(user_id))
+    )
+    return row
+
+
+async def _raise_purchase_error(session, user_id, item_id):
+    # Only reached when the conditional debit matched nothing, so the extra
+    # lookup stays off the happy path.
+    result = await session.execute(
+        select(
+            select(models.DBWallet.id)
+            .where(models.DBWallet.user_id == user_id)
+            .scalar_subquery(),
+            select(models.DBItem.id)
+            .where(models.DBItem.id == item_id)
+            .scalar_subquery(),
+        )
+    )
+    wallet_id, found_item_id = result.one()
+
+    if wallet_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found"
+        )
+    if found_item_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Item not found"
+        )
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient balance"
+    )
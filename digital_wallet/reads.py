@@ -0,0 +1,32 @@
+from sqlmodel import select
+
+from . import responses
+
+
+# List endpoints that read plain column tuples instead of ORM entities
+core_endpoints: set[str] = set()
+
+
+def init_reads(settings):
+    global core_endpoints
+
+    core_endpoints = set(settings.CORE_READ_ENDPOINTS)
+
+
+def list_query(endpoint: str, model_class, entity):
+    """``SELECT`` for a list endpoint and the function turning its rows into dicts.
+
+    On the Core path only the columns behind ``model_class``'s fields are
+    selected; the rows are never added to the identity map and no relationship
+    loaders run. Otherwise whole ``entity`` objects are loaded as before.
+    """
+    if endpoint in core_endpoints:
+        table = entity.__table__
+        names = responses.field_names(model_class)
+        query = select(*[table.c[name] for name in names])
+        return query, _asdict
+    return select(entity), lambda row: responses.row_dict(model_class, row)
+
+
+def _asdict(row) -> dict:
+    return row._asdict()
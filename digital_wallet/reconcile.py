@@ -0,0 +1,195 @@
+"""Nightly reconciliation of wallets against the ledger and transactions.
+
+For every wallet, in integer cents:
+
+* ``wallets.balance`` must equal the sum of its ledger entries, and
+* its ``transactions.amount`` total must equal its purchase entries, negated.
+
+Wallet ids are split into ranges that a process pool works through. A worker
+streams its range from a server-side cursor ``CHUNK_ROWS`` rows at a time and
+adds every chunk into per-wallet NumPy accumulators with ``np.bincount``, so
+its memory is bounded by the range width plus one chunk, never by the table
+size. Workers connect with the synchronous driver of ``models.sync_url``
+(pg8000 by default), on Postgres in a read-only REPEATABLE READ transaction
+per range.
+"""
+
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+from sqlalchemy import case, create_engine, func, select
+
+from . import ledger
+from . import models
+
+
+CHUNK_ROWS = 10_000
+# Wallet ids per task; each accumulator is this many int64 slots
+RANGE_WALLETS = 50_000
+# Mismatches kept per range; the total count is always exact
+MAX_REPORTED = 100
+
+engine = None
+
+
+@dataclass
+class Mismatch:
+    wallet_id: int
+    balance: int  # wallets.balance in cents
+    ledger: int
+    transactions: int
+    purchases: int  # purchase ledger entries, negated
+
+
+@dataclass
+class Report:
+    wallets: int = 0
+    rows: int = 0
+    mismatched: int = 0
+    mismatches: list[Mismatch] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def add(self, other: "Report"):
+        self.wallets += other.wallets
+        self.rows += other.rows
+        self.mismatched += other.mismatched
+        self.mismatches.extend(other.mismatches)
+
+
+def _init_worker(url: str):
+    global engine
+    engine = create_engine(url)
+    if engine.dialect.name == "postgresql":
+        # The three reads of a range share one snapshot, so a purchase that
+        # commits between them cannot show up as a mismatch
+        engine = engine.execution_options(
+            isolation_level="REPEATABLE READ", postgresql_readonly=True
+        )
+
+
+def _accumulate(connection, query, low: int, width: int, report: Report):
+    """Sum ``(wallet_id, cents, ...)`` rows per wallet into one array per column."""
+    result = connection.execution_options(yield_per=CHUNK_ROWS).execute(query)
+    columns = len(result.keys()) - 1
+    totals = np.zeros((columns, width), dtype=np.int64)
+    for rows in result.partitions():
+        # Rows straight into np.array go through a slow attribute lookup per row
+        chunk = np.fromiter(
+            itertools.chain.from_iterable(rows),
+            dtype=np.float64,
+            count=len(rows) * (columns + 1),
+        ).reshape(-1, columns + 1)
+        report.rows += len(chunk)
+        offsets = chunk[:, 0].astype(np.int64) - low
+        for column in range(columns):
+            # Float weights are exact for cent sums below 2**53
+            totals[column] += np.rint(
+                np.bincount(offsets, weights=chunk[:, column + 1], minlength=width)
+            ).astype(np.int64)
+    result.close()
+    return totals
+
+
+def reconcile_range(low: int, high: int) -> Report:
+    """Reconcile wallets with ``low <= id < high``."""
+    width = high - low
+    report = Report()
+    wallets = models.DBWallet.__table__
+    entries = models.DBLedgerEntry.__table__
+    transactions = models.DBTransaction.__table__
+    started = time.perf_counter()
+
+    with engine.connect() as connection:
+        # At most one row per slot, so the range is read in one go
+        rows = connection.execute(
+            select(wallets.c.id, wallets.c.balance).where(
+                wallets.c.id >= low, wallets.c.id < high
+            )
+        ).all()
+        report.rows += len(rows)
+        report.wallets = len(rows)
+        present = np.zeros(width, dtype=bool)
+        balances = np.zeros(width, dtype=np.int64)
+        if rows:
+            ids, values = np.array([tuple(row) for row in rows], dtype=np.float64).T
+            offsets = ids.astype(np.int64) - low
+            present[offsets] = True
+            balances[offsets] = np.rint(values * ledger.MINOR_UNITS)
+
+        ledger_totals, purchases = _accumulate(
+            connection,
+            select(
+                entries.c.wallet_id,
+                entries.c.amount,
+                case((entries.c.kind == ledger.PURCHASE, -entries.c.amount), else_=0),
+            ).where(entries.c.wallet_id >= low, entries.c.wallet_id < high),
+            low,
+            width,
+            report,
+        )
+        # Rounded per row, like the ledger entries written for them
+        (transaction_totals,) = _accumulate(
+            connection,
+            select(
+                transactions.c.wallet_id,
+                func.round(transactions.c.amount * ledger.MINOR_UNITS),
+            ).where(transactions.c.wallet_id >= low, transactions.c.wallet_id < high),
+            low,
+            width,
+            report,
+        )
+
+    bad = present & ((balances != ledger_totals) | (transaction_totals != purchases))
+    offsets = np.flatnonzero(bad)
+    report.mismatched = len(offsets)
+    report.mismatches = [
+        Mismatch(
+            wallet_id=low + int(offset),
+            balance=int(balances[offset]),
+            ledger=int(ledger_totals[offset]),
+            transactions=int(transaction_totals[offset]),
+            purchases=int(purchases[offset]),
+        )
+        for offset in offsets[:MAX_REPORTED]
+    ]
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def wallet_ranges(low: int, high: int, width: int = RANGE_WALLETS):
+    """Half-open ``(start, stop)`` ranges covering ``low..high`` inclusive."""
+    return [
+        (start, min(start + width, high + 1)) for start in range(low, high + 1, width)
+    ]
+
+
+def reconcile(workers: int | None = None, width: int = RANGE_WALLETS) -> Report:
+    """Reconcile every wallet across a pool of ``workers`` processes."""
+    url = models.sync_url.render_as_string(hide_password=False)
+    _init_worker(url)
+    with engine.connect() as connection:
+        low, high = connection.execute(
+            select(func.min(models.DBWallet.id), func.max(models.DBWallet.id))
+        ).one()
+    engine.dispose()
+
+    report = Report()
+    if low is None:
+        return report
+
+    started = time.perf_counter()
+    ranges = wallet_ranges(low, high, width)
+    workers = min(workers or os.cpu_count() or 1, len(ranges))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(url,)) as pool:
+        for part in pool.map(reconcile_range, *zip(*ranges)):
+            report.add(part)
+    report.seconds = time.perf_counter() - started
+    return report
@@ -0,0 +1,42 @@
+import functools
+
+import orjson
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+
+@functools.cache
+def field_names(model_class: type[BaseModel]) -> tuple[str, ...]:
+    return tuple(model_class.model_fields)
+
+
+def row_dict(model_class: type[BaseModel], row) -> dict:
+    """The fields of ``model_class`` read off a trusted ORM row, unvalidated.
+
+    Loaded column values sit in the instance ``__dict__``; only expired or
+    deferred ones go through the attribute.
+    """
+    values = vars(row)
+    return {
+        name: values[name] if name in values else getattr(row, name)
+        for name in field_names(model_class)
+    }
+
+
+def encode(content) -> bytes:
+    return orjson.dumps(content)
+
+
+def json_response(content, **kwargs) -> ORJSONResponse:
+    """Encode ``content`` once with orjson.
+
+    Returning a ``Response`` makes FastAPI skip validating the handler's result
+    against its return annotation, which stays in place for the OpenAPI schema.
+    """
+    return ORJSONResponse(content, **kwargs)
+
+
+def raw_json_response(body: str | bytes, **kwargs) -> Response:
+    """Send JSON that was encoded earlier, e.g. by a cache, as it is."""
+    return Response(body, media_type="application/json", **kwargs)
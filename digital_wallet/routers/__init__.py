@@ -5,8 +5,10 @@ from . import authentication
 from . import wallets
 from . import transactions
 from . import root
+from . import metrics
 def init_router(app):
     app.include_router(root.router)
+    app.include_router(metrics.router)
     app.include_router(users.router)
     app.include_router(authentication.router)
     app.include_router(items.router)
@@ -7,11 +7,15 @@ from fastapi.security import (
 )
 
 
-from sqlmodel import select
+from sqlalchemy import case, or_
+from sqlmodel import delete, select, update
 from typing import Annotated
 import datetime
+import uuid
 
 from .. import config
+from .. import deps
+from .. import last_login
 from .. import models
 from .. import security
 
@@ -19,6 +23,11 @@ router = APIRouter(tags=["authentication"])
 
 settings = config.get_settings()
 
+# Expired and revoked families are deleted once every this many logins
+PURGE_EVERY = 1000
+
+logins = 0
+
 
 @router.post(
     "/token",
@@ -27,18 +36,18 @@ async def authentication(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     session: Annotated[models.AsyncSession, Depends(models.get_session)],
 ) -> models.Token:
+    global logins
 
+    # One round trip over the username and email indexes; a username match
+    # wins over someone else's email, as with the old two lookups
+    login = form_data.username
     result = await session.exec(
-        select(models.DBUser).where(models.DBUser.username == form_data.username)
+        select(models.DBUser)
+        .where(or_(models.DBUser.username == login, models.DBUser.email == login))
+        .order_by(case((models.DBUser.username == login, 0), else_=1))
+        .limit(1)
     )
-
-    user = result.one_or_none()
-
-    if not user:
-        result = await session.exec(
-            select(models.DBUser).where(models.DBUser.email == form_data.username)
-        )
-        user = result.one_or_none()
+    user = result.first()
 
     print("user", user)
     if not user:
@@ -47,34 +56,131 @@ async def authentication(
             detail="Incorrect username or password",
         )
 
-    print("userx", user, await user.verify_password(form_data.password))
-    if not await user.verify_password(form_data.password):
+    if not await user.verify_and_update_password(form_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
 
-    user.last_login_date = datetime.datetime.now()
+    # Written in bulk by the write-behind buffer, off the login critical path
+    logged_in_at = datetime.datetime.now()
+    last_login.buffer.record(user.id, logged_in_at)
 
-    session.add(user)
+    # Start a refresh token family for this login
+    family_id, jti = uuid.uuid4().hex, uuid.uuid4().hex
+    session.add(
+        models.DBRefreshToken(
+            family_id=family_id,
+            user_id=user.id,
+            current_jti=jti,
+            expires_at=logged_in_at
+            + datetime.timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES),
+        )
+    )
+    logins += 1
+    if logins % PURGE_EVERY == 0:
+        family = models.DBRefreshToken
+        await session.exec(
+            delete(family).where(
+                or_(family.expires_at < logged_in_at, family.revoked == True)
+            )
+        )
+    # Also saves the password if it was rehashed above
     await session.commit()
-    await session.refresh(user)
+    deps.invalidate_principal(user.id)
+
+    return issue_tokens(user.id, user.roles, user.status, family_id, jti, logged_in_at)
+
+
+@router.post("/token/refresh")
+async def refresh_token(
+    token: models.RefreshToken,
+    session: Annotated[models.AsyncSession, Depends(models.get_session)],
+) -> models.Token:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    payload = security.decode_refresh_token(token.refresh_token)
+    if payload is None:
+        raise credentials_exception
 
+    now = datetime.datetime.now()
+    jti = uuid.uuid4().hex
+    family = models.DBRefreshToken
+
+    # Rotate in place: one statement on the family primary key that also
+    # picks up the user's current roles and status for the new access token
+    user = models.DBUser
+    result = await session.exec(
+        update(family)
+        .where(
+            family.family_id == payload["fam"],
+            family.current_jti == payload["jti"],
+            family.revoked == False,
+            family.expires_at > now,
+            select(user.id)
+            .where(user.id == family.user_id, user.status == "active")
+            .exists(),
+        )
+        .values(
+            current_jti=jti,
+            expires_at=now
+            + datetime.timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES),
+        )
+        .returning(
+            family.user_id,
+            select(user.roles).where(user.id == family.user_id).scalar_subquery(),
+            select(user.status).where(user.id == family.user_id).scalar_subquery(),
+        )
+    )
+    row = result.one_or_none()
+
+    if row is None:
+        # A signed token for this family whose jti is no longer current has
+        # been used before: treat it as stolen and revoke the whole family
+        await session.exec(
+            update(family)
+            .where(
+                family.family_id == payload["fam"],
+                family.current_jti != payload["jti"],
+            )
+            .values(revoked=True)
+        )
+        await session.commit()
+        raise credentials_exception
+
+    await session.commit()
+    user_id, roles, user_status = row
+    return issue_tokens(user_id, roles, user_status, payload["fam"], jti, now)
+
+
+def issue_tokens(
+    user_id: int,
+    roles: list[str],
+    user_status: str,
+    family_id: str,
+    jti: str,
+    issued_at: datetime.datetime,
+) -> models.Token:
     access_token_expires = datetime.timedelta(
         minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
     )
     return models.Token(
         access_token=security.create_access_token(
-            data={"sub": user.id},
+            data={"sub": user_id, "roles": roles, "status": user_status},
             expires_delta=access_token_expires,
         ),
         refresh_token=security.create_refresh_token(
-            data={"sub": user.id},
-            expires_delta=access_token_expires,
+            data={"sub": user_id, "fam": family_id, "jti": jti},
+            expires_delta=datetime.timedelta(
+                minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES
+            ),
         ),
         token_type="Bearer",
         scope="",
         expires_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES,
         expires_at=datetime.datetime.now() + access_token_expires,
-        issued_at=user.last_login_date,
+        issued_at=issued_at,
     )
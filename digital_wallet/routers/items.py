@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
 
 from typing import Optional, Annotated
 
@@ -7,8 +7,15 @@ from sqlmodel.ext.asyncio.session import AsyncSession
 
 import math
 
+from .. import bulk
+from .. import conditional
+from .. import counters
 from .. import models
 from .. import deps
+from .. import item_cache
+from .. import pagination
+from .. import reads
+from .. import responses
 
 router = APIRouter(prefix="/items", tags=["items"])
 
@@ -17,69 +24,155 @@ SIZE_PER_PAGE = 50
 
 @router.get("")
 async def read_items(
-    session: Annotated[AsyncSession, Depends(models.get_session)],
+    session: Annotated[AsyncSession, Depends(item_cache.get_session)],
     page: int = 1,
+    cursor: str | None = None,
 ) -> models.ItemList:
-
-    result = await session.exec(
-        select(models.DBItem).offset((page - 1) * SIZE_PER_PAGE).limit(SIZE_PER_PAGE)
-    )
-    items = result.all()
-
-    page_count = int(
-        math.ceil(
-            (await session.exec(select(func.count(models.DBItem.id)))).first()
-            / SIZE_PER_PAGE
-        )
-    )
+    if cursor is not None:
+        # Keyset mode ignores page; normalise it so lookups and stores agree
+        page = 0
+    cached, stamp = await item_cache.get_page(page, cursor)
+    if cached is not None:
+        return responses.raw_json_response(cached)
+
+    query, as_dict = reads.list_query("read_items", models.Item, models.DBItem)
+    query = query.order_by(models.DBItem.id).limit(SIZE_PER_PAGE + 1)
+    if cursor is not None:
+        # Keyset mode: seek past the last id instead of scanning the skipped rows
+        query = query.where(pagination.after([models.DBItem.id], cursor, int))
+    else:
+        query = query.offset((page - 1) * SIZE_PER_PAGE)
+
+    result = await session.exec(query)
+    items, next_cursor = pagination.next_cursor(result.all(), SIZE_PER_PAGE, "id")
+
+    item_count, count_exact = await counters.count(session, models.DBItem)
+    page_count = int(math.ceil(item_count / SIZE_PER_PAGE))
 
     print("page_count", page_count)
     print("items", items)
-    return models.ItemList.from_orm(
-        dict(items=items, page_count=page_count, page=page, size_per_page=SIZE_PER_PAGE)
+    # Encoded once, straight from the rows; the cache keeps the same bytes
+    body = responses.encode(
+        dict(
+            items=[as_dict(item) for item in items],
+            page=page,
+            page_count=page_count,
+            size_per_page=SIZE_PER_PAGE,
+            next_cursor=next_cursor,
+            count_exact=count_exact,
+        )
     )
+    await item_cache.set_page(page, cursor, body, stamp)
+    return responses.raw_json_response(body)
 
 
 @router.post("")
 async def create_item(
     item: models.CreatedItem,
-    current_user: Annotated[models.User, Depends(deps.get_current_user)],
+    current_user: Annotated[models.Principal, Depends(deps.get_current_principal)],
     session: Annotated[AsyncSession, Depends(models.get_session)],
 ) -> models.Item | None:
     data = item.dict()
     dbitem = models.DBItem(**data)
     session.add(dbitem)
+    await counters.increment(session, "items")
     await session.commit()
     await session.refresh(dbitem)
+    await item_cache.invalidate()
 
     return models.Item.from_orm(dbitem)
 
 
+@router.post("/bulk")
+async def create_items_bulk(
+    request: Request,
+    current_user: Annotated[models.Principal, Depends(deps.get_current_principal)],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+) -> models.BulkItemResult:
+    """Import a JSON array, NDJSON or CSV upload, committing chunk by chunk.
+
+    Invalid rows are reported and skipped; the rest of the upload goes in.
+    """
+    inserted = failed = 0
+    errors = []
+    row_number = 1
+    async for rows in bulk.read_rows(request):
+        valid, chunk_errors = bulk.validate_chunk(rows, row_number, current_user.id)
+        row_number += len(rows)
+        if valid:
+            try:
+                count, rejected = await bulk.insert_chunk(session, valid)
+            except Exception as e:
+                await session.rollback()
+                print("bulk item chunk failed", e)
+                count = 0
+                rejected = [
+                    models.BulkItemError(row=number, errors=[f"Database error: {e}"])
+                    for number, _ in valid
+                ]
+            inserted += count
+            chunk_errors += rejected
+
+        failed += len(chunk_errors)
+        errors += chunk_errors[: bulk.MAX_REPORTED_ERRORS - len(errors)]
+
+    if inserted:
+        await item_cache.invalidate()
+    return models.BulkItemResult(
+        inserted=inserted, failed=failed, errors=sorted(errors, key=lambda e: e.row)
+    )
+
+
 @router.get("/{item_id}")
 async def read_item(
-    item_id: int, session: Annotated[AsyncSession, Depends(models.get_session)]
+    item_id: int,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(item_cache.get_session)],
+    if_none_match: Annotated[str | None, Header()] = None,
 ) -> models.Item:
-    db_item = await session.get(models.DBItem, item_id)
-    if db_item:
-        return models.Item.from_orm(db_item)
-
-    raise HTTPException(status_code=404, detail="Item not found")
+    item, stamp = await item_cache.get_item(item_id)
+    if item is None:
+        if if_none_match is not None:
+            # Compare against the version column before loading the whole row
+            version = (
+                await session.exec(
+                    select(models.DBItem.version).where(models.DBItem.id == item_id)
+                )
+            ).first()
+            etag = conditional.make_etag(item_id, version)
+            if version is not None and conditional.matches(if_none_match, etag):
+                return conditional.not_modified(etag)
+
+        db_item = await session.get(models.DBItem, item_id)
+        if db_item is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        item = models.Item.from_orm(db_item)
+        await item_cache.set_item(item, stamp)
+
+    etag = conditional.make_etag(item.id, item.version)
+    if conditional.matches(if_none_match, etag):
+        return conditional.not_modified(etag)
+    response.headers["ETag"] = etag
+    return item
 
 
 @router.put("/{item_id}")
 async def update_item(
     item_id: int,
     item: models.UpdatedItem,
-    current_user: Annotated[models.User, Depends(deps.get_current_user)],
+    current_user: Annotated[models.Principal, Depends(deps.get_current_principal)],
     session: Annotated[AsyncSession, Depends(models.get_session)],
 ) -> models.Item:
     print("update_item", item)
     data = item.dict()
     db_item = await session.get(models.DBItem, item_id)
     db_item.sqlmodel_update(data)
+    # In SQL, so concurrent updates cannot both write the same version
+    db_item.version = models.DBItem.version + 1
     session.add(db_item)
     await session.commit()
     await session.refresh(db_item)
+    await item_cache.invalidate(item_id)
 
     return models.Item.from_orm(db_item)
 
@@ -87,11 +180,13 @@ async def update_item(
 @router.delete("/{item_id}")
 async def delete_item(
     item_id: int,
-    current_user: Annotated[models.User, Depends(deps.get_current_user)],
+    current_user: Annotated[models.Principal, Depends(deps.get_current_principal)],
     session: Annotated[AsyncSession, Depends(models.get_session)],
 ) -> dict:
     db_item = await session.get(models.DBItem, item_id)
     await session.delete(db_item)
+    await counters.increment(session, "items", -1)
     await session.commit()
+    await item_cache.invalidate(item_id)
 
     return dict(message="delete success")
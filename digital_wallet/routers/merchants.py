@@ -1,16 +1,23 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from fastapi.responses import StreamingResponse
 
 from typing import Optional, Annotated
 
 from sqlmodel import Field, SQLModel, create_engine, Session, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from .. import conditional
 from .. import models
 from .. import deps
+from .. import pagination
+from .. import responses
+from .. import streaming
 
 
 router = APIRouter(prefix="/merchants", tags=["merchants"])
 
+SIZE_PER_PAGE = 50
+
 
 @router.post("")
 async def create_merchant(
@@ -31,22 +38,72 @@ async def create_merchant(
 
 @router.get("")
 async def read_merchants(
-    session: Annotated[AsyncSession, Depends(models.get_session)]
+    session: Annotated[AsyncSession, Depends(models.get_read_session)],
+    page: int = 1,
+    cursor: str | None = None,
+    stream: bool = False,
 ) -> models.MerchantList:
-    result = await session.exec(select(models.DBMerchant))
-    merchants = result.all()
-
-    return models.MerchantList.from_orm(
-        dict(merchants=merchants, page_size=0, page=0, size_per_page=0)
+    if stream:
+        # Every merchant as one JSON array, encoded as rows leave the cursor
+        columns = list(models.Merchant.model_fields)
+        table = models.DBMerchant.__table__
+        query = select(*[table.c[name] for name in columns]).order_by(table.c.id)
+        return StreamingResponse(
+            streaming.stream_query(
+                query, streaming.json_array(columns), head="[", tail="]"
+            ),
+            media_type="application/json",
+        )
+
+    query = (
+        select(models.DBMerchant)
+        .order_by(models.DBMerchant.id)
+        .limit(SIZE_PER_PAGE + 1)
+    )
+    if cursor is not None:
+        query = query.where(pagination.after([models.DBMerchant.id], cursor, int))
+        page = 0
+    else:
+        query = query.offset((max(page, 1) - 1) * SIZE_PER_PAGE)
+
+    result = await session.exec(query)
+    merchants, next_cursor = pagination.next_cursor(result.all(), SIZE_PER_PAGE, "id")
+
+    return responses.json_response(
+        dict(
+            merchants=[responses.row_dict(models.Merchant, m) for m in merchants],
+            page=page,
+            page_size=len(merchants),
+            size_per_page=SIZE_PER_PAGE,
+            next_cursor=next_cursor,
+        )
     )
 
 
 @router.get("/{merchant_id}")
 async def read_merchant(
-    merchant_id: int, session: Annotated[AsyncSession, Depends(models.get_session)]
+    merchant_id: int,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(models.get_read_session)],
+    if_none_match: Annotated[str | None, Header()] = None,
 ) -> models.Merchant:
+    if if_none_match is not None:
+        version = (
+            await session.exec(
+                select(models.DBMerchant.version).where(
+                    models.DBMerchant.id == merchant_id
+                )
+            )
+        ).first()
+        etag = conditional.make_etag(merchant_id, version)
+        if version is not None and conditional.matches(if_none_match, etag):
+            return conditional.not_modified(etag)
+
     db_merchant = await session.get(models.DBMerchant, merchant_id)
     if db_merchant:
+        response.headers["ETag"] = conditional.make_etag(
+            db_merchant.id, db_merchant.version
+        )
         return models.Merchant.from_orm(db_merchant)
     raise HTTPException(status_code=404, detail="Merchant not found")
 
@@ -61,6 +118,8 @@ async def update_merchant(
     data = merchant.dict()
     db_merchant = await session.get(models.DBMerchant, merchant_id)
     db_merchant.sqlmodel_update(data)
+    # In SQL, so concurrent updates cannot both write the same version
+    db_merchant.version = models.DBMerchant.version + 1
     session.add(db_merchant)
     await session.commit()
     await session.refresh(db_merchant)
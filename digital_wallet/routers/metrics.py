@@ -0,0 +1,14 @@
+from fastapi import APIRouter, Response
+
+from .. import metrics
+
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def read_metrics() -> Response:
+    # Prometheus text exposition format
+    return Response(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,98 +1,191 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from typing import Annotated
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, status
+from fastapi.responses import StreamingResponse
+from typing import Annotated, Literal
 from sqlmodel.ext.asyncio.session import AsyncSession
-from sqlmodel import select, func
+from sqlmodel import select
 from datetime import datetime
+import csv
+import io
 
-from .. import models, deps
+from .. import models, counters, deps, group_commit, idempotency, pagination
+from .. import purchases, reads, responses, streaming
 
 router = APIRouter(prefix="/transactions", tags=["transactions"])
 
 @router.post("", response_model=models.DBTransaction)
 async def create_transaction(
+    request: Request,
     item_id: int,
-    amount: int,  # Represents the number of items being purchased
+    amount: Annotated[int, Query(gt=0)],  # Represents the number of items being purchased
     current_user: Annotated[models.DBUser, Depends(deps.get_current_user)],
     session: Annotated[AsyncSession, Depends(models.get_session)],
+    idempotency_key: Annotated[str | None, Header()] = None,
 ) -> models.DBTransaction:
-    # Fetch the user's wallet
-    user_wallet = await session.exec(
-        select(models.DBWallet).where(models.DBWallet.user_id == current_user.id)
-    )
-    wallet = user_wallet.first()
-    
-    if not wallet:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Wallet not found"
-        )
-    
-    # Fetch the item to ensure it exists
-    item = await session.get(models.DBItem, item_id)
-    if not item:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Item not found"
-        )
-    
-    # Calculate total cost
-    total_cost = item.price * amount
-    
-    # Ensure the wallet has sufficient balance
-    if wallet.balance < total_cost:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Insufficient balance"
+    async def purchase() -> models.DBTransaction:
+        if group_commit.writer is not None:
+            # Share one commit with the other purchases arriving in this window
+            return await group_commit.writer.submit(current_user.id, item_id, amount)
+
+        # Debit the wallet and record the transaction without reading the balance
+        # back into Python, so concurrent purchases cannot overdraw the wallet
+        return await purchases.purchase(session, current_user.id, item_id, amount)
+
+    if idempotency_key is None:
+        return await purchase()
+
+    # Retries with the same key replay the first response instead of buying
+    # again. The response is committed together with the debit, so keyed
+    # purchases bypass the group commit writer, which commits on its own.
+    async def execute() -> dict:
+        transaction = await purchases.debit_and_record(
+            session, current_user.id, item_id, amount
         )
-    
-    # Create the transaction
-    transaction = models.DBTransaction(
-        user_id=current_user.id,
-        item_id=item_id,
-        wallet_id=wallet.id,
-        amount=total_cost,  # Store the total cost in the transaction
-        timestamp=datetime.utcnow()
+        return responses.row_dict(models.DBTransaction, transaction)
+
+    return await idempotency.run(
+        session,
+        current_user.id,
+        idempotency_key,
+        idempotency.fingerprint(request),
+        execute,
     )
-    
-    # Update the wallet balance by subtracting the total cost
-    wallet.balance -= total_cost
-    session.add(wallet)
-    
-    # Save the transaction
-    session.add(transaction)
-    await session.commit()
-    await session.refresh(transaction)
 
-    return transaction
+
+@router.post("/checkout", response_model=models.CheckoutReceipt)
+async def checkout(
+    basket: models.Checkout,
+    current_user: Annotated[models.DBUser, Depends(deps.get_current_user)],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+) -> models.CheckoutReceipt:
+    # The whole basket is one debit and one commit, so it bypasses the group
+    # commit writer, which applies single purchases
+    return await purchases.checkout(
+        session,
+        current_user.id,
+        [(line.item_id, line.quantity) for line in basket.items],
+    )
 
 
 @router.get("", response_model=models.TransactionList)
 async def read_transactions(
-    session: Annotated[AsyncSession, Depends(models.get_session)],
+    session: Annotated[AsyncSession, Depends(models.get_read_session)],
     page: int = 1,
+    cursor: str | None = None,
+    user_id: int | None = None,
 ) -> models.TransactionList:
     SIZE_PER_PAGE = 50
-    
-    result = await session.exec(
-        select(models.DBTransaction).offset((page - 1) * SIZE_PER_PAGE).limit(SIZE_PER_PAGE)
+
+    key = [models.DBTransaction.timestamp, models.DBTransaction.id]
+    query, as_dict = reads.list_query(
+        "read_transactions", models.DBTransaction, models.DBTransaction
+    )
+    query = query.order_by(*key).limit(SIZE_PER_PAGE + 1)
+    if user_id is not None:
+        query = query.where(models.DBTransaction.user_id == user_id)
+    if cursor is not None:
+        # Keyset mode: seek past (timestamp, id) instead of scanning the skipped rows
+        query = query.where(pagination.after(key, cursor, datetime, int))
+        page = 0
+    else:
+        query = query.offset((page - 1) * SIZE_PER_PAGE)
+
+    result = await session.exec(query)
+    transactions, next_cursor = pagination.next_cursor(
+        result.all(), SIZE_PER_PAGE, "timestamp", "id"
     )
-    transactions = result.all()
 
-    total_transactions = await session.exec(select(func.count(models.DBTransaction.id)))
-    page_count = (total_transactions.first() + SIZE_PER_PAGE - 1) // SIZE_PER_PAGE
+    if user_id is not None:
+        total_transactions, count_exact = await counters.count(
+            session,
+            models.DBTransaction,
+            counters.user_scope(user_id),
+            models.DBTransaction.user_id == user_id,
+        )
+    else:
+        total_transactions, count_exact = await counters.count(
+            session, models.DBTransaction
+        )
+    page_count = (total_transactions + SIZE_PER_PAGE - 1) // SIZE_PER_PAGE
 
-    return models.TransactionList(
-        transactions=transactions,
-        page=page,
-        page_count=page_count,
-        size_per_page=SIZE_PER_PAGE
+    # The rows come straight from the table, so skip validating them again
+    return responses.json_response(
+        dict(
+            transactions=[as_dict(row) for row in transactions],
+            page=page,
+            page_count=page_count,
+            size_per_page=SIZE_PER_PAGE,
+            next_cursor=next_cursor,
+            count_exact=count_exact,
+        )
+    )
+
+
+EXPORT_COLUMNS = ["id", "user_id", "item_id", "wallet_id", "amount", "timestamp"]
+
+
+def _csv_chunk(rows, first) -> str:
+    # stream_query's encoder; CSV chunks need no separator, so first is unused
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+@router.get("/export")
+async def export_transactions(
+    current_user: Annotated[models.Principal, Depends(deps.get_current_active_user)],
+    format: Literal["ndjson", "csv"] = "ndjson",
+    user_id: int | None = None,
+    wallet_id: int | None = None,
+    item_id: int | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> StreamingResponse:
+    if "admin" not in current_user.roles:
+        # Everyone else may only export their own history
+        if user_id not in (None, current_user.id):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not authorized to export other users' transactions",
+            )
+        user_id = current_user.id
+
+    table = models.DBTransaction.__table__
+    query = select(*[table.c[name] for name in EXPORT_COLUMNS]).order_by(
+        table.c.timestamp, table.c.id
+    )
+    for column, value in [
+        (table.c.user_id, user_id),
+        (table.c.wallet_id, wallet_id),
+        (table.c.item_id, item_id),
+    ]:
+        if value is not None:
+            query = query.where(column == value)
+    if since is not None:
+        query = query.where(table.c.timestamp >= since)
+    if until is not None:
+        query = query.where(table.c.timestamp < until)
+
+    if format == "csv":
+        media_type = "text/csv"
+        body = streaming.stream_query(
+            query, _csv_chunk, head=_csv_chunk([EXPORT_COLUMNS], True)
+        )
+    else:
+        media_type = "application/x-ndjson"
+        body = streaming.stream_query(query, streaming.ndjson(EXPORT_COLUMNS))
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="transactions.{format}"'
+        },
     )
 
 
 @router.get("/{transaction_id}", response_model=models.DBTransaction)
 async def read_transaction(
     transaction_id: int,
-    session: Annotated[AsyncSession, Depends(models.get_session)],
+    session: Annotated[AsyncSession, Depends(models.get_read_session)],
 ) -> models.DBTransaction:
     transaction = await session.get(models.DBTransaction, transaction_id)
     if transaction:
@@ -76,6 +76,7 @@ async def change_password(
     # Update the user in the database
     session.add(current_user)
     await session.commit()
+    deps.invalidate_principal(current_user.id)
 
     return {"message": "Password updated successfully"}
 
@@ -102,5 +103,7 @@ async def update_user(
     session.add(current_user)
     await session.commit()
     await session.refresh(current_user)
+    # Roles and status may have changed, drop the cached principal
+    deps.invalidate_principal(current_user.id)
 
     return current_user
\ No newline at end of file
@@ -1,13 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Header, Response, status
+from fastapi.responses import StreamingResponse
 from typing import Annotated
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel import select
 from datetime import datetime
 
-from .. import models, deps
+from .. import conditional, ledger, models, deps, pagination, reads, responses
+from .. import streaming
 
 router = APIRouter(prefix="/wallets", tags=["wallets"])
 
+SIZE_PER_PAGE = 50
+
 @router.post("", response_model=models.Wallet)
 async def create_wallet(
     wallet: models.CreatedWallet,
@@ -26,6 +30,12 @@ async def create_wallet(
     
     db_wallet = models.DBWallet(user_id=current_user.id, **wallet.dict())
     session.add(db_wallet)
+    await session.flush()
+    opening = ledger.to_minor(db_wallet.balance)
+    await ledger.append(
+        session,
+        [ledger.entry(db_wallet.id, opening, ledger.OPENING, db_wallet.last_updated)],
+    )
     await session.commit()
     await session.refresh(db_wallet)
     return models.Wallet.from_orm(db_wallet)
@@ -34,22 +44,76 @@ async def create_wallet(
 @router.get("", response_model=models.WalletList)
 async def read_wallets(
     session: Annotated[AsyncSession, Depends(models.get_session)],
+    page: int = 1,
+    cursor: str | None = None,
+    stream: bool = False,
 ) -> models.WalletList:
-    result = await session.exec(select(models.DBWallet))
-    wallets = result.all()
+    if stream:
+        # Every wallet as one JSON array, encoded as rows leave the cursor;
+        # balances are read from the primary like the paged listing
+        columns = list(models.Wallet.model_fields)
+        table = models.DBWallet.__table__
+        query = select(*[table.c[name] for name in columns]).order_by(table.c.id)
+        return StreamingResponse(
+            streaming.stream_query(
+                query,
+                streaming.json_array(columns),
+                head="[",
+                tail="]",
+                maker=models.async_session,
+            ),
+            media_type="application/json",
+        )
 
-    return models.WalletList.from_orm(
-        dict(wallets=wallets, page_size=0, page=0, size_per_page=0)
+    query, as_dict = reads.list_query("read_wallets", models.Wallet, models.DBWallet)
+    query = query.order_by(models.DBWallet.id).limit(SIZE_PER_PAGE + 1)
+    if cursor is not None:
+        query = query.where(pagination.after([models.DBWallet.id], cursor, int))
+        page = 0
+    else:
+        query = query.offset((max(page, 1) - 1) * SIZE_PER_PAGE)
+
+    result = await session.exec(query)
+    wallets, next_cursor = pagination.next_cursor(result.all(), SIZE_PER_PAGE, "id")
+
+    return responses.json_response(
+        dict(
+            wallets=[as_dict(wallet) for wallet in wallets],
+            page=page,
+            page_size=len(wallets),
+            size_per_page=SIZE_PER_PAGE,
+            next_cursor=next_cursor,
+        )
     )
 
 
 @router.get("/{wallet_id}", response_model=models.Wallet)
 async def read_wallet(
     wallet_id: int,
+    response: Response,
     session: Annotated[AsyncSession, Depends(models.get_session)],
+    if_none_match: Annotated[str | None, Header()] = None,
 ) -> models.Wallet:
+    if if_none_match is not None:
+        # Purchases stamp several debits with one timestamp, so the balance is
+        # part of the tag as well
+        row = (
+            await session.exec(
+                select(models.DBWallet.last_updated, models.DBWallet.balance).where(
+                    models.DBWallet.id == wallet_id
+                )
+            )
+        ).first()
+        if row is not None:
+            etag = conditional.make_etag(wallet_id, *row)
+            if conditional.matches(if_none_match, etag):
+                return conditional.not_modified(etag)
+
     db_wallet = await session.get(models.DBWallet, wallet_id)
     if db_wallet:
+        response.headers["ETag"] = conditional.make_etag(
+            db_wallet.id, db_wallet.last_updated, db_wallet.balance
+        )
         return models.Wallet.from_orm(db_wallet)
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
 
@@ -61,18 +125,35 @@ async def update_wallet(
     current_user: Annotated[models.User, Depends(deps.get_current_user)],
     session: Annotated[AsyncSession, Depends(models.get_session)],
 ) -> models.Wallet:
-    db_wallet = await session.get(models.DBWallet, wallet_id)
+    # Locked so a purchase cannot land between reading the old balance and
+    # recording the adjustment. The wallet may already be in the session,
+    # joined onto the current user, so the locked row must overwrite it.
+    db_wallet = await session.get(
+        models.DBWallet, wallet_id, with_for_update=True, populate_existing=True
+    )
     if db_wallet is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
 
     if db_wallet.user_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to update this wallet")
 
+    previous = ledger.to_minor(db_wallet.balance)
     # Update the wallet fields and set last_updated timestamp
     for key, value in wallet.dict(exclude_unset=True).items():
         setattr(db_wallet, key, value)
     db_wallet.last_updated = datetime.utcnow()  # Update the timestamp
 
+    adjustment = ledger.to_minor(db_wallet.balance) - previous
+    if adjustment:
+        await ledger.append(
+            session,
+            [
+                ledger.entry(
+                    db_wallet.id, adjustment, ledger.ADJUSTMENT, db_wallet.last_updated
+                )
+            ],
+        )
+
     session.add(db_wallet)
     await session.commit()
     await session.refresh(db_wallet)
@@ -33,6 +33,19 @@ def create_refresh_token(data: dict, expires_delta: timedelta | None = None) ->
         expire = datetime.now() + timedelta(
             minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES
         )
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "typ": "refresh"})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+
+def decode_refresh_token(token: str) -> dict | None:
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+
+    if payload.get("typ") != "refresh" or not all(
+        payload.get(claim) for claim in ("sub", "fam", "jti")
+    ):
+        return None
+    return payload
@@ -0,0 +1,68 @@
+import datetime
+import json
+from typing import AsyncIterator, Callable
+
+from sqlalchemy.orm import sessionmaker
+
+from . import models
+
+
+CHUNK_ROWS = 1000
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def stream_query(
+    query,
+    encode: Callable[[list, bool], str],
+    head: str = "",
+    tail: str = "",
+    maker: sessionmaker | None = None,
+) -> AsyncIterator[str]:
+    """Run ``query`` on a server-side cursor and yield one encoded chunk per fetch.
+
+    ``encode(rows, first)`` turns one partition of rows into text. The session
+    is opened here rather than taken from the request, because FastAPI closes
+    dependency sessions before a streamed body is sent. A disconnecting client
+    cancels the generator and the cursor is closed on the way out.
+    """
+    maker = maker or models.read_session
+    async with maker() as session:
+        result = await session.stream(query.execution_options(yield_per=CHUNK_ROWS))
+        try:
+            if head:
+                yield head
+            first = True
+            async for rows in result.partitions():
+                yield encode(rows, first)
+                first = False
+            if tail:
+                yield tail
+        finally:
+            await result.close()
+
+
+def ndjson(columns: list[str]) -> Callable[[list, bool], str]:
+    def encode(rows, first):
+        return "".join(
+            json.dumps(dict(zip(columns, row)), default=_default) + "\n"
+            for row in rows
+        )
+
+    return encode
+
+
+def json_array(columns: list[str]) -> Callable[[list, bool], str]:
+    """Encoder for ``stream_query(..., head="[", tail="]")``."""
+
+    def encode(rows, first):
+        chunk = ",".join(
+            json.dumps(dict(zip(columns, row)), default=_default) for row in rows
+        )
+        return chunk if first else "," + chunk
+
+    return encode
@@ -0,0 +1,138 @@
+"""Overhead of the metrics middleware on GET /.
+
+Two measurements, compared against the 2% budget:
+
+* the middleware's own cost: an ASGI app that answers like ``/`` is called
+  in process with and without ``instrumentation.MetricsMiddleware`` around
+  it, and the best of ``--repeat`` rounds of ``--number`` calls is kept,
+* the latency of a served ``GET /``: the app runs under uvicorn and one
+  keep-alive client times ``--number`` sequential requests; the median is
+  kept.
+
+The overhead is the first divided by the second. Timing the whole app in
+process with and without the middleware instead leaves the server and HTTP
+parsing out of the request, and run-to-run noise of the served request is
+larger than the middleware itself, so neither isolates it.
+
+    SQLDB_URL=sqlite+aiosqlite:// python "performance-tests /bench_metrics_overhead.py"
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from digital_wallet import instrumentation
+
+BUDGET = 0.02
+
+
+class Route:
+    path = "/"
+
+
+async def index(scope, receive, send):
+    scope["route"] = Route
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": b'{"message":"Hello"}'})
+
+
+def call(app, number: int) -> float:
+    scope = {"type": "http", "method": "GET", "path": "/"}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def run():
+        started = time.perf_counter()
+        for _ in range(number):
+            await app(dict(scope), receive, send)
+        return (time.perf_counter() - started) / number
+
+    return asyncio.run(run())
+
+
+def middleware_cost() -> float:
+    apps = {"without": index, "with": instrumentation.MetricsMiddleware(index)}
+    best = {name: float("inf") for name in apps}
+    for turn in range(args.repeat):
+        # Alternate so drift in machine load hits both sides alike
+        for name in sorted(apps, reverse=turn % 2 == 1):
+            best[name] = min(best[name], call(apps[name], args.number))
+    return best["with"] - best["without"]
+
+
+def served_latency() -> float:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    # Admission control off: its rate limits would answer most calls with 429
+    env = dict(os.environ, SQLDB_URL=args.url, ADMISSION_ENABLED="false")
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "--factory",
+            "digital_wallet.main:create_app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+            for _ in range(100):
+                try:
+                    client.get("/")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+            samples = []
+            for index in range(100 + args.number):
+                started = time.perf_counter()
+                client.get("/")
+                if index >= 100:
+                    samples.append(time.perf_counter() - started)
+        return statistics.median(samples)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run():
+    cost = middleware_cost()
+    latency = served_latency()
+    overhead = cost / latency
+    print(f"middleware       {cost * 1e6:8.1f} us/request")
+    print(f"served GET /     {latency * 1e6:8.1f} us/request (median)")
+    print(
+        f"overhead {overhead:+.2%} "
+        f"({'within' if overhead < BUDGET else 'OVER'} the {BUDGET:.0%} budget)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=os.environ.get("SQLDB_URL"))
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+    run()
@@ -0,0 +1,103 @@
+"""Response serialization microbenchmark for a 50-row ItemList and TransactionList.
+
+"validated" is the old path: build the list with from_orm, let FastAPI
+validate it against the return annotation, run jsonable_encoder and render a
+JSONResponse. "direct" is the current one: plain dicts read off the rows
+with responses.row_dict, encoded once by orjson. No database is
+involved; the rows are built in memory.
+
+    SQLDB_URL=sqlite+aiosqlite:// python "performance-tests /bench_serialization.py"
+"""
+
+import argparse
+import asyncio
+import datetime
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from digital_wallet import models, responses
+
+ROWS = 50
+
+
+def rows():
+    items = [
+        models.DBItem(
+            id=i,
+            name=f"item {i}",
+            description="a fairly ordinary catalog description",
+            price=9.99,
+            tax=0.07,
+            merchant_id=1,
+            user_id=1,
+        )
+        for i in range(ROWS)
+    ]
+    epoch = datetime.datetime(2024, 1, 1)
+    transactions = [
+        models.DBTransaction(
+            id=i,
+            user_id=1,
+            item_id=i,
+            wallet_id=1,
+            amount=9.99,
+            timestamp=epoch + datetime.timedelta(seconds=i),
+        )
+        for i in range(ROWS)
+    ]
+    return items, transactions
+
+
+loop = asyncio.new_event_loop()
+
+
+def validated(field, model):
+    content = loop.run_until_complete(
+        serialize_response(field=field, response_content=model)
+    )
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def main(args):
+    items, transactions = rows()
+    page = dict(
+        page=1, page_count=1, size_per_page=ROWS, next_cursor=None, count_exact=True
+    )
+    item_field = create_response_field("item_list", models.ItemList)
+    transaction_field = create_response_field(
+        "transaction_list", models.TransactionList
+    )
+
+    cases = {
+        "ItemList validated": lambda: validated(
+            item_field, models.ItemList.from_orm(dict(items=items, **page))
+        ),
+        "ItemList direct": lambda: responses.json_response(
+            dict(items=[responses.row_dict(models.Item, i) for i in items], **page)
+        ).body,
+        "TransactionList validated": lambda: validated(
+            transaction_field,
+            models.TransactionList(transactions=transactions, **page),
+        ),
+        "TransactionList direct": lambda: responses.json_response(
+            dict(
+                transactions=[
+                    responses.row_dict(models.DBTransaction, t) for t in transactions
+                ],
+                **page,
+            )
+        ).body,
+    }
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=args.number, repeat=5)) / args.number
+        print(f"{name:28} {seconds * 1e6:9.1f} us/response  {len(case()):6} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=500)
+    main(parser.parse_args())
@@ -0,0 +1,248 @@
+"""Mixed workload against a running server, seeding what it needs itself.
+
+When the test starts, the first node creates a merchant with a catalog of
+``CATALOG_ITEMS`` items and ``SHARED_ACCOUNTS`` accounts with funded wallets
+over HTTP. Already seeded servers are reused. Each process then discovers
+the catalog once. Users, by weight:
+
+* ``LoginUser`` logs in to a shared account again and again (bcrypt bound),
+* ``CatalogUser`` reads the first catalog page, deep offset pages, cursor
+  walks and single items,
+* ``SharedWalletBuyer`` buys as one of the shared accounts, so many users
+  debit the same few wallet rows,
+* ``PrivateWalletBuyer`` signs up with a wallet of its own and buys with it,
+
+and both buyers read their wallet and transaction history between purchases.
+Rate limits would answer most of this with 429, so run the server with
+``ADMISSION_ENABLED=false``:
+
+    ADMISSION_ENABLED=false uvicorn --factory digital_wallet.main:create_app
+    poetry run locust -f "performance-tests /locustfile.py" --headless \\
+        -u 200 -r 20 -t 2m --json > locust-results.json
+"""
+
+import random
+import uuid
+
+import gevent.lock
+from locust import HttpUser, between, events, task
+from locust.clients import HttpSession
+from locust.runners import WorkerRunner
+
+
+HOST = "http://localhost:8000"
+PASSWORD = "loadtest-password"
+SEED_USERNAME = "loadtest-merchant"
+SHARED_USERNAME = "loadtest-shared-{}"
+SHARED_ACCOUNTS = 4
+CATALOG_ITEMS = 5_000
+BULK_ROWS = 1_000
+WALLET_BALANCE = 1_000_000_000.0
+
+catalog: list[int] = []
+page_count = 1
+catalog_lock = gevent.lock.Semaphore()
+
+
+def create_account(client, username: str, balance: float) -> dict:
+    """Sign up (or reuse) ``username`` with a wallet; return its auth headers."""
+    with client.post(
+        "/users/create",
+        json=dict(
+            username=username,
+            email=f"{username}@email.local",
+            password=PASSWORD,
+            first_name="Load",
+            last_name="Test",
+        ),
+        name="/users/create",
+        catch_response=True,
+    ) as response:
+        if response.status_code == 409:  # seeded by an earlier run
+            response.success()
+    token = client.post(
+        "/token", data=dict(username=username, password=PASSWORD), name="/token"
+    ).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    with client.post(
+        "/wallets",
+        json=dict(balance=balance),
+        headers=headers,
+        name="/wallets",
+        catch_response=True,
+    ) as response:
+        if response.status_code == 400:  # the account has its wallet already
+            response.success()
+    return headers
+
+
+@events.test_start.add_listener
+def seed(environment, **kwargs):
+    if isinstance(environment.runner, WorkerRunner):
+        return
+
+    client = HttpSession(
+        environment.host or HOST, environment.events.request, user=None
+    )
+    for number in range(SHARED_ACCOUNTS):
+        create_account(client, SHARED_USERNAME.format(number), WALLET_BALANCE)
+
+    headers = create_account(client, SEED_USERNAME, 0.0)
+    first_page = client.get("/items", name="/items").json()
+    if first_page["page_count"] * first_page["size_per_page"] >= CATALOG_ITEMS:
+        return
+    merchant_id = client.post(
+        "/merchants",
+        json=dict(name="Load test merchant"),
+        headers=headers,
+        name="/merchants",
+    ).json()["id"]
+    for start in range(0, CATALOG_ITEMS, BULK_ROWS):
+        rows = [
+            dict(
+                name=f"Load test item {number}",
+                price=round(random.uniform(0.5, 50.0), 2),
+                merchant_id=merchant_id,
+            )
+            for number in range(start, min(start + BULK_ROWS, CATALOG_ITEMS))
+        ]
+        client.post("/items/bulk", json=rows, headers=headers, name="/items/bulk")
+
+
+def discover_catalog(client):
+    """Item ids, up to ``CATALOG_ITEMS``, and the page count, read once per
+    process by cursor."""
+    global page_count
+
+    with catalog_lock:
+        if catalog:
+            return
+        params = {}
+        while True:
+            data = client.get("/items", params=params, name="/items [seed]").json()
+            catalog.extend(item["id"] for item in data["items"])
+            page_count = max(page_count, data.get("page_count") or 1)
+            if not data.get("next_cursor") or len(catalog) >= CATALOG_ITEMS:
+                break
+            params = dict(cursor=data["next_cursor"])
+
+
+class LoginUser(HttpUser):
+    wait_time = between(0.5, 1)
+    host = HOST
+    weight = 1
+
+    @task
+    def login(self):
+        username = SHARED_USERNAME.format(random.randrange(SHARED_ACCOUNTS))
+        self.client.post(
+            "/token", data=dict(username=username, password=PASSWORD), name="/token"
+        )
+
+
+class CatalogUser(HttpUser):
+    wait_time = between(0.05, 0.2)
+    host = HOST
+    weight = 6
+
+    def on_start(self):
+        discover_catalog(self.client)
+
+    @task(4)
+    def first_page(self):
+        self.client.get("/items", name="/items")
+
+    @task(2)
+    def deep_page(self):
+        # The back half of the catalog, where offset paging is most expensive
+        page = random.randint(max(page_count // 2, 1), page_count)
+        self.client.get("/items", params=dict(page=page), name="/items?page=[deep]")
+
+    @task(1)
+    def cursor_walk(self):
+        params = {}
+        for _ in range(5):
+            data = self.client.get("/items", params=params, name="/items?cursor").json()
+            if not data.get("next_cursor"):
+                break
+            params = dict(cursor=data["next_cursor"])
+
+    @task(4)
+    def read_item(self):
+        self.client.get(f"/items/{random.choice(catalog)}", name="/items/[id]")
+
+
+class Buyer(HttpUser):
+    abstract = True
+    wait_time = between(0.1, 0.5)
+    host = HOST
+    headers: dict = {}
+    wallet_id: int | None = None
+    etag: str | None = None
+
+    def on_start(self):
+        discover_catalog(self.client)
+        self.headers = self.account()
+
+    def account(self) -> dict:
+        raise NotImplementedError
+
+    @task(5)
+    def purchase(self):
+        response = self.client.post(
+            "/transactions",
+            params=dict(item_id=random.choice(catalog), amount=random.randint(1, 3)),
+            headers=self.headers,
+            name="/transactions",
+        )
+        if response.ok:
+            self.wallet_id = response.json()["wallet_id"]
+
+    @task(1)
+    def checkout(self):
+        basket = [
+            dict(item_id=item_id, quantity=random.randint(1, 3))
+            for item_id in random.sample(catalog, 3)
+        ]
+        self.client.post(
+            "/transactions/checkout",
+            json=dict(items=basket),
+            headers=self.headers,
+            name="/transactions/checkout",
+        )
+
+    @task(3)
+    def read_wallet(self):
+        if self.wallet_id is None:
+            return
+        headers = dict(self.headers)
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        response = self.client.get(
+            f"/wallets/{self.wallet_id}", headers=headers, name="/wallets/[id]"
+        )
+        self.etag = response.headers.get("ETag", self.etag)
+
+    @task(2)
+    def read_transactions(self):
+        self.client.get("/transactions", headers=self.headers, name="/transactions")
+
+
+class SharedWalletBuyer(Buyer):
+    weight = 2
+
+    def account(self) -> dict:
+        return create_account(
+            self.client,
+            SHARED_USERNAME.format(random.randrange(SHARED_ACCOUNTS)),
+            WALLET_BALANCE,
+        )
+
+
+class PrivateWalletBuyer(Buyer):
+    weight = 2
+
+    def account(self) -> dict:
+        return create_account(
+            self.client, f"loadtest-{uuid.uuid4().hex[:12]}", WALLET_BALANCE
+        )
@@ -0,0 +1,205 @@
+"""Per-endpoint latency, in process, over httpx ``ASGITransport`` and SQLite.
+
+Builds the app on a fresh SQLite file, seeds a catalog, a merchant and a
+funded user, then times ``number`` sequential requests per endpoint after a
+warm-up. Percentiles of every endpoint are written as JSON to
+``LATENCY_RESULTS`` (by default ``digital-wallet-latency.json`` in the
+temporary directory) for trend comparison. With ``LATENCY_BASELINE`` set to
+an earlier results file, an endpoint fails when its median is more than
+``LATENCY_TOLERANCE`` (default 25%) slower than there.
+
+    poetry run pytest "performance-tests /test_latency.py"
+    LATENCY_RESULTS=latency-base.json poetry run pytest "performance-tests /test_latency.py"
+    LATENCY_BASELINE=latency-base.json \\
+        poetry run pytest "performance-tests /test_latency.py"
+
+No server or Postgres is involved, so absolute numbers are lower than in
+production; the point is comparing runs on the same machine.
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import pathlib
+import platform
+import statistics
+import tempfile
+import time
+
+from httpx import ASGITransport, AsyncClient
+import pytest
+
+from digital_wallet import config, main, models
+
+
+RESULTS = pathlib.Path(
+    os.environ.get("LATENCY_RESULTS")
+    or pathlib.Path(tempfile.gettempdir()) / "digital-wallet-latency.json"
+)
+BASELINE = os.environ.get("LATENCY_BASELINE")
+TOLERANCE = float(os.environ.get("LATENCY_TOLERANCE", "0.25"))
+WARMUP = 10
+CATALOG_ITEMS = 2_000
+PASSWORD = "latency-password"
+
+results: dict[str, dict] = {}
+
+
+class Fixture:
+    """The seeded app and what the endpoints need to address it."""
+
+    def __init__(self, client: AsyncClient):
+        self.client = client
+        self.headers: dict = {}
+        self.item_id = 0
+        self.wallet_id = 0
+        self.page_count = 1
+
+
+async def seed(client: AsyncClient) -> Fixture:
+    fixture = Fixture(client)
+    await models.recreate_table()
+    response = await client.post(
+        "/users/create",
+        json=dict(
+            username="latency",
+            email="latency@email.local",
+            password=PASSWORD,
+            first_name="Latency",
+            last_name="Test",
+        ),
+    )
+    assert response.status_code == 200, response.text
+    response = await client.post(
+        "/token", data=dict(username="latency", password=PASSWORD)
+    )
+    fixture.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = await client.post(
+        "/wallets", json=dict(balance=1_000_000_000.0), headers=fixture.headers
+    )
+    fixture.wallet_id = response.json()["id"]
+    response = await client.post(
+        "/merchants", json=dict(name="Latency merchant"), headers=fixture.headers
+    )
+    merchant_id = response.json()["id"]
+    rows = [
+        dict(name=f"Latency item {number}", price=1.25, merchant_id=merchant_id)
+        for number in range(CATALOG_ITEMS)
+    ]
+    response = await client.post("/items/bulk", json=rows, headers=fixture.headers)
+    assert response.json()["inserted"] == CATALOG_ITEMS
+
+    data = (await client.get("/items")).json()
+    fixture.item_id = data["items"][0]["id"]
+    fixture.page_count = data["page_count"]
+    for _ in range(50):
+        await client.post(
+            "/transactions",
+            params=dict(item_id=fixture.item_id, amount=1),
+            headers=fixture.headers,
+        )
+    return fixture
+
+
+@pytest.fixture(name="bench", scope="module")
+def bench_fixture(tmp_path_factory):
+    database = tmp_path_factory.mktemp("latency") / "latency.db"
+    # Rate limits would turn the timed loops into 429s
+    settings = config.Settings(
+        SQLDB_URL=f"sqlite+aiosqlite:///{database}", ADMISSION_ENABLED=False
+    )
+    app = main.create_app(settings)
+    client = AsyncClient(transport=ASGITransport(app=app), base_url="http://bench")
+    yield asyncio.run(seed(client))
+
+    RESULTS.parent.mkdir(parents=True, exist_ok=True)
+    RESULTS.write_text(
+        json.dumps(
+            dict(
+                created=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                python=platform.python_version(),
+                machine=platform.machine(),
+                database="sqlite",
+                endpoints=results,
+            ),
+            indent=2,
+        )
+    )
+
+
+def summarize(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    centiles = statistics.quantiles(samples, n=100, method="inclusive")
+    return dict(
+        number=len(samples),
+        mean_ms=statistics.fmean(samples) * 1000,
+        p50_ms=centiles[49] * 1000,
+        p95_ms=centiles[94] * 1000,
+        p99_ms=centiles[98] * 1000,
+        max_ms=samples[-1] * 1000,
+    )
+
+
+# name -> (number of timed requests, request arguments from the fixture)
+ENDPOINTS = {
+    "index": (500, lambda f: dict(method="GET", url="/")),
+    "read_items": (500, lambda f: dict(method="GET", url="/items")),
+    "read_items_deep": (
+        200,
+        lambda f: dict(method="GET", url="/items", params=dict(page=f.page_count)),
+    ),
+    "read_item": (500, lambda f: dict(method="GET", url=f"/items/{f.item_id}")),
+    "read_merchants": (300, lambda f: dict(method="GET", url="/merchants")),
+    "read_wallet": (300, lambda f: dict(method="GET", url=f"/wallets/{f.wallet_id}")),
+    "read_transactions": (
+        200,
+        lambda f: dict(method="GET", url="/transactions", headers=f.headers),
+    ),
+    "create_transaction": (
+        200,
+        lambda f: dict(
+            method="POST",
+            url="/transactions",
+            params=dict(item_id=f.item_id, amount=1),
+            headers=f.headers,
+        ),
+    ),
+    "authentication": (
+        20,
+        lambda f: dict(
+            method="POST",
+            url="/token",
+            data=dict(username="latency", password=PASSWORD),
+        ),
+    ),
+}
+
+
+@pytest.mark.parametrize("name", list(ENDPOINTS))
+def test_latency(bench: Fixture, name: str) -> None:
+    number, arguments = ENDPOINTS[name]
+    request = arguments(bench)
+
+    async def measure() -> list[float]:
+        samples = []
+        for index in range(WARMUP + number):
+            started = time.perf_counter()
+            response = await bench.client.request(**request)
+            elapsed = time.perf_counter() - started
+            assert response.status_code == 200, response.text
+            if index >= WARMUP:
+                samples.append(elapsed)
+        return samples
+
+    results[name] = summary = summarize(asyncio.run(measure()))
+
+    if BASELINE:
+        baseline = json.loads(pathlib.Path(BASELINE).read_text())["endpoints"]
+        if name in baseline:
+            limit = baseline[name]["p50_ms"] * (1 + TOLERANCE)
+            assert summary["p50_ms"] <= limit, (
+                f"{name} median {summary['p50_ms']:.3f} ms, "
+                f"baseline {baseline[name]['p50_ms']:.3f} ms"
+            )
@@ -0,0 +1,48 @@
+"""/items latency while /token is hammered.
+
+Run with both user classes so logins and catalog reads share the server, then
+compare the 99%ile of GET /items with and without the login users:
+
+    poetry run locust -f "performance-tests /test_login_contention.py"
+"""
+
+from locust import HttpUser, task, between, constant
+
+
+USERNAME = "loadtest"
+PASSWORD = "loadtest-password"
+
+
+class LoginUser(HttpUser):
+    wait_time = constant(0)
+    host = "http://localhost:8000"
+    weight = 1
+
+    def on_start(self):
+        self.client.post(
+            "/users/create",
+            json=dict(
+                username=USERNAME,
+                email=f"{USERNAME}@email.local",
+                password=PASSWORD,
+                first_name="Load",
+                last_name="Test",
+            ),
+            name="/users/create",
+        )
+
+    @task
+    def login(self):
+        self.client.post(
+            "/token", data=dict(username=USERNAME, password=PASSWORD), name="/token"
+        )
+
+
+class CatalogUser(HttpUser):
+    wait_time = between(0.01, 0.05)
+    host = "http://localhost:8000"
+    weight = 3
+
+    @task
+    def read_items(self):
+        self.client.get("/items", name="/items")
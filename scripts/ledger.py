@@ -0,0 +1,70 @@
+"""Maintain the wallet ledger.
+
+    python scripts/ledger.py snapshot           # periodic, e.g. from cron
+    python scripts/ledger.py verify [WALLET...]
+    python scripts/ledger.py rebuild [WALLET...]
+
+verify and rebuild replay every listed wallet (all of them by default) and
+exit with status 1 if any ledger disagrees with its snapshots or with
+wallets.balance.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from sqlalchemy import select
+
+from digital_wallet import config, ledger, models
+
+
+async def snapshot():
+    async with models.async_session() as session:
+        wallet_ids = await ledger.snapshot_due(session)
+    for wallet_id in wallet_ids:
+        async with models.async_session() as session:
+            await ledger.take_snapshot(session, wallet_id)
+            await session.commit()
+    print(f"snapshotted {len(wallet_ids)} wallets")
+    return True
+
+
+async def replay(wallet_ids: list[int], rebuild: bool):
+    if not wallet_ids:
+        async with models.async_session() as session:
+            wallet_ids = list(
+                (await session.execute(select(models.DBWallet.id))).scalars()
+            )
+
+    ok = True
+    for wallet_id in wallet_ids:
+        # One transaction per wallet keeps the rebuild locks short
+        async with models.async_session() as session:
+            report = await ledger.replay(session, wallet_id, rebuild=rebuild)
+            await session.commit()
+        if not report.ok:
+            ok = False
+            print(
+                f"wallet {wallet_id}: ledger {report.balance} over "
+                f"{report.entries} entries, wallet {report.wallet_balance}, "
+                f"bad snapshots {report.bad_snapshots}"
+            )
+    print(f"replayed {len(wallet_ids)} wallets, {'ok' if ok else 'MISMATCH'}")
+    return ok
+
+
+async def main(args):
+    models.init_db(config.get_settings())
+    try:
+        if args.command == "snapshot":
+            return await snapshot()
+        return await replay(args.wallet_ids, rebuild=args.command == "rebuild")
+    finally:
+        await models.close_session()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["snapshot", "verify", "rebuild"])
+    parser.add_argument("wallet_ids", nargs="*", type=int)
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
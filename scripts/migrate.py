@@ -0,0 +1,7 @@
+import asyncio
+from digital_wallet import config, models, migrations
+
+if __name__ == "__main__":
+    settings = config.get_settings()
+    models.init_db(settings)
+    asyncio.run(migrations.main())
@@ -0,0 +1,29 @@
+"""Reconcile every wallet against its ledger and transactions.
+
+    poetry install --with reconcile
+    python scripts/reconcile.py --workers 4
+
+Exits with status 1 when any wallet disagrees.
+"""
+
+import argparse
+import sys
+
+from digital_wallet import config, models, reconcile
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--range-wallets", type=int, default=reconcile.RANGE_WALLETS)
+    args = parser.parse_args()
+
+    models.init_db(config.get_settings())
+    report = reconcile.reconcile(args.workers, args.range_wallets)
+    for mismatch in report.mismatches:
+        print(mismatch)
+    print(
+        f"{report.wallets} wallets, {report.mismatched} mismatched, "
+        f"{report.rows} rows in {report.seconds:.2f}s "
+        f"({report.rows_per_second:,.0f} rows/s)"
+    )
+    sys.exit(1 if report.mismatched else 0)
@@ -0,0 +1,65 @@
+from httpx import AsyncClient
+import pytest
+
+from digital_wallet import admission, config, instrumentation, models
+
+
+@pytest.fixture(name="admission_settings")
+def admission_settings_fixture(app):
+    settings = config.Settings()
+    yield lambda **update: admission.init_admission(
+        settings.model_copy(update=dict(ADMISSION_ENABLED=True, **update))
+    )
+    admission.init_admission(settings)
+
+
+def test_token_bucket_refills_at_its_rate() -> None:
+    bucket = admission.TokenBucket(rate=2.0, burst=2, tokens=2, updated=0.0)
+    assert bucket.take(0.0) == 0
+    assert bucket.take(0.0) == 0
+    assert bucket.take(0.0) == pytest.approx(0.5)
+    assert bucket.take(0.5) == 0
+    # Never more than the burst, however long it was idle
+    assert [bucket.take(100.0) for _ in range(3)][-1] > 0
+
+
+@pytest.mark.asyncio
+async def test_route_limit_is_per_user(
+    client: AsyncClient, user1_headers: dict, admission_settings
+) -> None:
+    admission_settings(RATE_LIMIT_ROUTES={"read_items": [1.0, 2]})
+
+    statuses = [
+        (await client.get("/items", headers=user1_headers)).status_code
+        for _ in range(3)
+    ]
+    assert statuses == [200, 200, 429]
+    response = await client.get("/items", headers=user1_headers)
+    assert response.headers["Retry-After"] == "1"
+
+    # Other routes and other callers have their own buckets
+    assert (await client.get("/merchants", headers=user1_headers)).status_code == 200
+    assert (await client.get("/items")).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_overload_sheds_all_but_cheap_routes(
+    client: AsyncClient, admission_settings, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    admission_settings(ADMISSION_MAX_POOL_WAIT=0.1)
+    monkeypatch.setattr(models, "pool_wait", lambda: 0.5)
+
+    response = await client.get("/items")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert (await client.get("/")).status_code == 200
+    assert (await client.get("/items/999999")).status_code == 404
+
+    monkeypatch.setattr(models, "pool_wait", lambda: 0.0)
+    admission_settings(ADMISSION_MAX_IN_FLIGHT=1)
+    instrumentation.in_flight.inc()
+    try:
+        assert (await client.get("/items")).status_code == 503
+    finally:
+        instrumentation.in_flight.dec()
+    assert (await client.get("/items")).status_code == 200
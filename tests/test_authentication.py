@@ -0,0 +1,196 @@
+import asyncio
+import datetime
+from httpx import AsyncClient
+import pytest
+
+from digital_wallet import last_login, models, passwords
+from digital_wallet.routers import authentication
+
+
+@pytest.mark.asyncio
+async def test_login(client: AsyncClient, user1: models.DBUser) -> None:
+    response = await client.post(
+        "/token", data={"username": "user1", "password": "123456"}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["token_type"] == "Bearer"
+    assert data["access_token"]
+
+
+@pytest.mark.asyncio
+async def test_login_wrong_password(client: AsyncClient, user1: models.DBUser) -> None:
+    response = await client.post(
+        "/token", data={"username": "user1", "password": "wrong"}
+    )
+
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_login_rehashes_when_work_factor_changes(
+    client: AsyncClient, user1: models.DBUser, session: models.AsyncSession
+) -> None:
+    settings = passwords.settings.model_copy(update=dict(BCRYPT_ROUNDS=5))
+    passwords.init_passwords(settings)
+    try:
+        response = await client.post(
+            "/token", data={"username": "user1", "password": "123456"}
+        )
+        assert response.status_code == 200
+
+        await session.refresh(user1)
+        assert user1.password.startswith("$2b$05$")
+        assert await user1.verify_password("123456")
+    finally:
+        passwords.init_passwords(passwords.settings)
+
+
+async def login(client: AsyncClient) -> dict:
+    response = await client.post(
+        "/token", data={"username": "user1", "password": "123456"}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_rotates(client: AsyncClient, user1: models.DBUser) -> None:
+    tokens = await login(client)
+
+    response = await client.post(
+        "/token/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert response.status_code == 200
+    rotated = response.json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+
+    response = await client.get(
+        f"/users/{user1.id}",
+        headers={"Authorization": f"Bearer {rotated['access_token']}"},
+    )
+    assert response.status_code == 200
+
+    response = await client.post(
+        "/token/refresh", json={"refresh_token": rotated["refresh_token"]}
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_reuse_revokes_family(
+    client: AsyncClient, user1: models.DBUser
+) -> None:
+    tokens = await login(client)
+    response = await client.post(
+        "/token/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    rotated = response.json()
+
+    # Replaying the first token is reuse: it fails and takes the family down
+    response = await client.post(
+        "/token/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert response.status_code == 401
+
+    response = await client.post(
+        "/token/refresh", json={"refresh_token": rotated["refresh_token"]}
+    )
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_login_purges_dead_refresh_token_families(
+    client: AsyncClient,
+    user1: models.DBUser,
+    session: models.AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    now = datetime.datetime.now()
+    for family_id, revoked, expires_at in [
+        ("expired", False, now - datetime.timedelta(minutes=1)),
+        ("revoked", True, now + datetime.timedelta(days=1)),
+        ("live", False, now + datetime.timedelta(days=1)),
+    ]:
+        session.add(
+            models.DBRefreshToken(
+                family_id=family_id,
+                user_id=user1.id,
+                current_jti=family_id,
+                revoked=revoked,
+                expires_at=expires_at,
+            )
+        )
+    await session.commit()
+
+    monkeypatch.setattr(authentication, "PURGE_EVERY", 1)
+    await login(client)
+
+    session.expunge_all()
+    assert await session.get(models.DBRefreshToken, "expired") is None
+    assert await session.get(models.DBRefreshToken, "revoked") is None
+    assert await session.get(models.DBRefreshToken, "live") is not None
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_is_not_an_access_token(
+    client: AsyncClient, user1: models.DBUser
+) -> None:
+    tokens = await login(client)
+
+    response = await client.get(
+        f"/users/{user1.id}",
+        headers={"Authorization": f"Bearer {tokens['refresh_token']}"},
+    )
+    assert response.status_code == 401
+
+    response = await client.post(
+        "/token/refresh", json={"refresh_token": tokens["access_token"]}
+    )
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_login_date_is_written_behind(
+    client: AsyncClient, user1: models.DBUser, session: models.AsyncSession
+) -> None:
+    user1.last_login_date = datetime.datetime(2000, 1, 1)
+    session.add(user1)
+    await session.commit()
+
+    await login(client)
+    assert user1.id in last_login.buffer.pending
+
+    await last_login.buffer.flush()
+    assert not last_login.buffer.pending
+
+    await session.refresh(user1)
+    assert user1.last_login_date.year > 2000
+
+
+@pytest.mark.asyncio
+async def test_close_waits_for_flush_in_progress(
+    user1: models.DBUser,
+    session: models.AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    write_last_logins = last_login.write_last_logins
+    writing = asyncio.Event()
+
+    async def slow_write(session, batch):
+        writing.set()
+        await asyncio.sleep(0.1)
+        await write_last_logins(session, batch)
+
+    monkeypatch.setattr(last_login, "write_last_logins", slow_write)
+    buffer = last_login.LastLoginBuffer(interval=60, max_pending=1)
+    logged_in_at = datetime.datetime(2030, 1, 1)
+    buffer.record(user1.id, logged_in_at)
+    await writing.wait()
+
+    # Shutting down mid-flush still writes the batch
+    await buffer.close()
+    assert not buffer.pending
+    await session.refresh(user1)
+    assert user1.last_login_date == logged_in_at
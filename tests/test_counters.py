@@ -0,0 +1,86 @@
+from httpx import AsyncClient
+import pytest
+from sqlmodel import func
+
+from digital_wallet import counters, models
+
+
+async def exact_count(session: models.AsyncSession, table, *where) -> int:
+    result = await session.exec(
+        models.select(func.count()).select_from(table).where(*where)
+    )
+    return result.one()
+
+
+@pytest.mark.asyncio
+async def test_item_counter_follows_create_and_delete(
+    client: AsyncClient,
+    user1: models.DBUser,
+    user1_headers: dict,
+    session: models.AsyncSession,
+) -> None:
+    merchant = models.DBMerchant(name="Counted", user_id=user1.id)
+    session.add(merchant)
+    await session.commit()
+    await session.refresh(merchant)
+
+    await counters.refresh(session, models.DBItem)
+
+    response = await client.post(
+        "/items",
+        json={"name": "Counted item", "merchant_id": merchant.id},
+        headers=user1_headers,
+    )
+    item_id = response.json()["id"]
+    total, exact = await counters.count(session, models.DBItem)
+    assert exact
+    assert total == await exact_count(session, models.DBItem)
+
+    await client.delete(f"/items/{item_id}", headers=user1_headers)
+    total, _ = await counters.count(session, models.DBItem)
+    assert total == await exact_count(session, models.DBItem)
+
+
+@pytest.mark.asyncio
+async def test_refresh_repairs_drift(
+    user1: models.DBUser, session: models.AsyncSession
+) -> None:
+    # Seeds the counters
+    await counters.refresh_all(session)
+    scope = counters.user_scope(user1.id)
+    await counters.increment(session, "transactions", 1000, ("", scope))
+    await session.commit()
+
+    await counters.refresh_all(session)
+
+    total, exact = await counters.count(session, models.DBTransaction)
+    assert exact
+    assert total == await exact_count(session, models.DBTransaction)
+
+    total, _ = await counters.count(
+        session, models.DBTransaction, scope, models.DBTransaction.user_id == user1.id
+    )
+    assert total == await exact_count(
+        session, models.DBTransaction, models.DBTransaction.user_id == user1.id
+    )
+
+
+@pytest.mark.asyncio
+async def test_count_does_not_seed() -> None:
+    # A user without transactions, so no refresh has seeded the scope
+    user_id = 0
+    scope = counters.user_scope(user_id)
+    async with models.async_session(info={"read_only": True}) as replica:
+        total, exact = await counters.count(
+            replica, models.DBTransaction, scope, models.DBTransaction.user_id == user_id
+        )
+        assert exact
+        assert total == await exact_count(
+            replica, models.DBTransaction, models.DBTransaction.user_id == user_id
+        )
+
+    async with models.async_session() as session:
+        seeded = await session.exec(
+            models.select(models.DBRowCounter).where(models.DBRowCounter.scope == scope)
+        )
+        assert seeded.first() is None
@@ -0,0 +1,462 @@
+import asyncio
+
+from httpx import AsyncClient
+import pytest
+import pytest_asyncio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from digital_wallet import caching, item_cache, models, reads
+
+
+@pytest_asyncio.fixture(name="merchant1")
+async def merchant1_fixture(
+    session: models.AsyncSession, user1: models.DBUser
+) -> models.DBMerchant:
+    merchant = models.DBMerchant(name="Catalog", user_id=user1.id)
+    session.add(merchant)
+    await session.commit()
+    await session.refresh(merchant)
+    return merchant
+
+
+@pytest_asyncio.fixture(name="catalog")
+async def catalog_fixture(
+    session: models.AsyncSession,
+    user1: models.DBUser,
+    merchant1: models.DBMerchant,
+) -> list[models.DBItem]:
+    items = [
+        models.DBItem(
+            name=f"Item {i}", price=1.0, merchant_id=merchant1.id, user_id=user1.id
+        )
+        for i in range(120)
+    ]
+    session.add_all(items)
+    await session.commit()
+    # Written behind the API's back, so retire cached pages by hand
+    await item_cache.invalidate()
+    return items
+
+
+@pytest.mark.asyncio
+async def test_read_items_cursor_matches_offset(
+    client: AsyncClient, catalog: list[models.DBItem]
+) -> None:
+    response = await client.get("/items", params={"page": 1})
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["items"]) == 50
+    assert data["next_cursor"] is not None
+
+    offset_ids = [item["id"] for item in data["items"]]
+    cursor_ids = list(offset_ids)
+    cursor = data["next_cursor"]
+    page = 2
+    while cursor:
+        response = await client.get("/items", params={"cursor": cursor})
+        data = response.json()
+        cursor_ids += [item["id"] for item in data["items"]]
+        cursor = data["next_cursor"]
+
+        response = await client.get("/items", params={"page": page})
+        offset_ids += [item["id"] for item in response.json()["items"]]
+        page += 1
+
+    assert cursor_ids == offset_ids
+    assert cursor_ids == sorted(cursor_ids)
+
+
+@pytest.mark.asyncio
+async def test_cursor_pages_are_served_from_cache(
+    client: AsyncClient, catalog: list[models.DBItem]
+) -> None:
+    cursor = (await client.get("/items")).json()["next_cursor"]
+    first = await client.get("/items", params={"cursor": cursor})
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = models.read_engine or models.engine
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        second = await client.get("/items", params={"cursor": cursor})
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+    assert second.json() == first.json()
+    assert statements == []
+
+
+@pytest.mark.asyncio
+async def test_read_items_invalid_cursor(client: AsyncClient) -> None:
+    response = await client.get("/items", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_item_cache_invalidated_by_writes(
+    client: AsyncClient, user1_headers: dict, merchant1: models.DBMerchant
+) -> None:
+    response = await client.post(
+        "/items",
+        json={"name": "Cached", "price": 2.0, "merchant_id": merchant1.id},
+        headers=user1_headers,
+    )
+    item_id = response.json()["id"]
+
+    # Warm both entries, then change the row
+    assert (await client.get(f"/items/{item_id}")).json()["name"] == "Cached"
+    first_page = (await client.get("/items")).json()
+    response = await client.put(
+        f"/items/{item_id}",
+        json={"name": "Renamed", "price": 3.0, "merchant_id": merchant1.id},
+        headers=user1_headers,
+    )
+    assert response.status_code == 200
+
+    assert (await client.get(f"/items/{item_id}")).json()["name"] == "Renamed"
+    names = {
+        item["id"]: item["name"]
+        for item in (await client.get("/items")).json()["items"]
+    }
+    if item_id in {item["id"] for item in first_page["items"]}:
+        assert names[item_id] == "Renamed"
+
+    await client.delete(f"/items/{item_id}", headers=user1_headers)
+    assert (await client.get(f"/items/{item_id}")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_item_cache_fills_from_the_primary(
+    client: AsyncClient,
+    user1_headers: dict,
+    merchant1: models.DBMerchant,
+    tmp_path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    response = await client.post(
+        "/items",
+        json={"name": "Replicated", "merchant_id": merchant1.id},
+        headers=user1_headers,
+    )
+    item_id = response.json()["id"]
+
+    # A replica so far behind that it has none of the rows yet
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    async with replica.begin() as connection:
+        await connection.run_sync(models.SQLModel.metadata.create_all)
+    monkeypatch.setattr(
+        models,
+        "read_session",
+        sessionmaker(
+            replica,
+            class_=models.AsyncSession,
+            expire_on_commit=False,
+            info={"read_only": True},
+        ),
+    )
+    try:
+        await item_cache.invalidate(item_id)
+        response = await client.get(f"/items/{item_id}")
+        assert response.json()["name"] == "Replicated"
+        response = await client.get("/items")
+        assert response.json()["items"]
+    finally:
+        await replica.dispose()
+
+
+async def serve_resp(store: dict):
+    """Tiny stand-in for a Redis server: GET and SET [NX] [PX ms]."""
+
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            args = []
+            for _ in range(int(line[1:])):
+                length = int((await reader.readline())[1:])
+                args.append((await reader.readexactly(length + 2))[:-2])
+            command = args[0].upper()
+            if command == b"GET":
+                value = store.get(args[1])
+                if value is None:
+                    writer.write(b"$-1\r\n")
+                else:
+                    writer.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            elif command == b"SET":
+                if b"NX" in args[3:] and args[1] in store:
+                    writer.write(b"$-1\r\n")
+                else:
+                    store[args[1]] = args[2]
+                    writer.write(b"+OK\r\n")
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_shares_versions_between_workers() -> None:
+    store = {}
+    server = await serve_resp(store)
+    port = server.sockets[0].getsockname()[1]
+    url = f"redis://127.0.0.1:{port}/0"
+    previous = item_cache.backend
+    try:
+        # Two workers, each with its own connection pool to the same server
+        worker1 = caching.RedisBackend(url)
+        worker2 = caching.RedisBackend(url)
+        item = models.Item(id=1, name="Shared", price=1.0, merchant_id=1)
+
+        item_cache.backend = worker1
+        _, stamp = await item_cache.get_item(1)
+        await item_cache.set_item(item, stamp)
+
+        item_cache.backend = worker2
+        cached, _ = await item_cache.get_item(1)
+        assert cached == item
+
+        item_cache.backend = worker1
+        await item_cache.invalidate(1)
+
+        item_cache.backend = worker2
+        cached, _ = await item_cache.get_item(1)
+        assert cached is None
+
+        await worker1.close()
+        await worker2.close()
+    finally:
+        item_cache.backend = previous
+        server.close()
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_item_and_merchant(
+    client: AsyncClient, user1_headers: dict, merchant1: models.DBMerchant
+) -> None:
+    response = await client.post(
+        "/items",
+        json={"name": "Tagged", "merchant_id": merchant1.id},
+        headers=user1_headers,
+    )
+    item_id = response.json()["id"]
+
+    response = await client.get(f"/items/{item_id}")
+    etag = response.headers["ETag"]
+    response = await client.get(f"/items/{item_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # Skip the cache so the narrow version query answers
+    await item_cache.invalidate(item_id)
+    response = await client.get(
+        f"/items/{item_id}", headers={"If-None-Match": f'"other", W/{etag}'}
+    )
+    assert response.status_code == 304
+
+    await client.put(
+        f"/items/{item_id}",
+        json={"name": "Retagged", "merchant_id": merchant1.id},
+        headers=user1_headers,
+    )
+    response = await client.get(f"/items/{item_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["name"] == "Retagged"
+
+    response = await client.get(f"/merchants/{merchant1.id}")
+    etag = response.headers["ETag"]
+    response = await client.get(
+        f"/merchants/{merchant1.id}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+
+@pytest.mark.asyncio
+async def test_bulk_import_reports_row_errors(
+    client: AsyncClient,
+    user1: models.DBUser,
+    user1_headers: dict,
+    merchant1: models.DBMerchant,
+    session: models.AsyncSession,
+) -> None:
+    rows = [
+        {"name": "Bulk 1", "price": 1.5, "merchant_id": merchant1.id},
+        {"name": "Bulk 2", "price": "not a price", "merchant_id": merchant1.id},
+        {"name": "Bulk 3", "merchant_id": 999_999},
+        {"name": "Bulk 4", "merchant_id": merchant1.id},
+    ]
+    response = await client.post("/items/bulk", json=rows, headers=user1_headers)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["inserted"] == 2
+    assert result["failed"] == 2
+    assert [error["row"] for error in result["errors"]] == [2, 3]
+    assert result["errors"][0]["errors"][0].startswith("price:")
+
+    body = "\n".join(
+        [
+            '{"name": "Bulk 5", "merchant_id": %d}' % merchant1.id,
+            "{broken",
+        ]
+    )
+    response = await client.post(
+        "/items/bulk",
+        content=body,
+        headers={**user1_headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.json()["inserted"] == 1
+    assert response.json()["errors"][0]["row"] == 2
+
+    body = f"name,price,tax,merchant_id\nBulk 6,2.5,,{merchant1.id}\n"
+    response = await client.post(
+        "/items/bulk",
+        content=body,
+        headers={**user1_headers, "Content-Type": "text/csv"},
+    )
+    assert response.json() == {"inserted": 1, "failed": 0, "errors": []}
+
+    # Quoted fields may hold newlines and quotes; rows are still numbered by
+    # record, not by line
+    body = (
+        "name,description,price,merchant_id\n"
+        f'Bulk 7,"two\nlines, ""quoted""",1.0,{merchant1.id}\n'
+        "Bulk 8,,not a price,1\n"
+    )
+    response = await client.post(
+        "/items/bulk",
+        content=body,
+        headers={**user1_headers, "Content-Type": "text/csv"},
+    )
+    assert response.json()["inserted"] == 1
+    assert [error["row"] for error in response.json()["errors"]] == [2]
+    description = (
+        await session.exec(
+            models.select(models.DBItem.description).where(
+                models.DBItem.name == "Bulk 7"
+            )
+        )
+    ).one()
+    assert description == 'two\nlines, "quoted"'
+
+    # A bare quote inside an unquoted field is literal and opens nothing
+    body = (
+        "name,description,price,merchant_id\n"
+        f'Bulk 9,TV 55" screen,10,{merchant1.id}\n'
+        f"Bulk 10,d,2,{merchant1.id}\n"
+        f"Bulk 11,d,3,{merchant1.id}\n"
+    )
+    response = await client.post(
+        "/items/bulk",
+        content=body,
+        headers={**user1_headers, "Content-Type": "text/csv"},
+    )
+    assert response.json() == {"inserted": 3, "failed": 0, "errors": []}
+
+    result = await session.exec(
+        models.select(models.DBItem.name, models.DBItem.user_id).where(
+            models.DBItem.name.startswith("Bulk ")
+        )
+    )
+    assert sorted(result.all()) == [
+        ("Bulk 1", user1.id),
+        ("Bulk 10", user1.id),
+        ("Bulk 11", user1.id),
+        ("Bulk 4", user1.id),
+        ("Bulk 5", user1.id),
+        ("Bulk 6", user1.id),
+        ("Bulk 7", user1.id),
+        ("Bulk 9", user1.id),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_read_merchants_paged_and_streamed(
+    client: AsyncClient, session: models.AsyncSession, user1: models.DBUser
+) -> None:
+    session.add_all(
+        [models.DBMerchant(name=f"Paged {i}", user_id=user1.id) for i in range(60)]
+    )
+    await session.commit()
+
+    ids = []
+    response = await client.get("/merchants")
+    data = response.json()
+    assert data["page_size"] == data["size_per_page"] == 50
+    while True:
+        ids += [merchant["id"] for merchant in data["merchants"]]
+        if data["next_cursor"] is None:
+            break
+        response = await client.get(
+            "/merchants", params={"cursor": data["next_cursor"]}
+        )
+        data = response.json()
+
+    response = await client.get("/merchants", params={"stream": True})
+    assert response.headers["content-type"] == "application/json"
+    streamed = response.json()
+    assert [merchant["id"] for merchant in streamed] == ids
+    assert set(streamed[0]) == set(models.Merchant.model_fields)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/items", "/transactions", "/wallets"])
+async def test_core_read_path_matches_orm(
+    client: AsyncClient, catalog: list[models.DBItem], path: str
+) -> None:
+    endpoints = reads.core_endpoints
+    try:
+        reads.core_endpoints = set()
+        orm = (await client.get(path)).json()
+        await item_cache.invalidate()
+        reads.core_endpoints = {"read_items", "read_transactions", "read_wallets"}
+        core = (await client.get(path)).json()
+    finally:
+        reads.core_endpoints = endpoints
+    assert core == orm
+
+
+@pytest.mark.asyncio
+async def test_concurrent_updates_get_distinct_versions(
+    client: AsyncClient,
+    user1_headers: dict,
+    merchant1: models.DBMerchant,
+    session: models.AsyncSession,
+) -> None:
+    response = await client.post(
+        "/items",
+        json={"name": "Raced", "merchant_id": merchant1.id},
+        headers=user1_headers,
+    )
+    item_id = response.json()["id"]
+
+    responses = await asyncio.gather(
+        *[
+            client.put(
+                f"/items/{item_id}",
+                json={"name": f"Raced {number}", "merchant_id": merchant1.id},
+                headers=user1_headers,
+            )
+            for number in range(5)
+        ]
+    )
+    # No version, and so no ETag, stands for two different bodies
+    bodies = {(r.json()["version"], r.json()["name"]) for r in responses}
+    assert len({version for version, _ in bodies}) == len(bodies)
+    item = await client.get(f"/items/{item_id}")
+    assert item.json()["version"] == 6
+
+    before = (await client.get(f"/merchants/{merchant1.id}")).json()["version"]
+    responses = await asyncio.gather(
+        *[
+            client.put(
+                f"/merchants/{merchant1.id}",
+                json={"name": f"Raced merchant {number}"},
+                headers=user1_headers,
+            )
+            for number in range(5)
+        ]
+    )
+    bodies = {(r.json()["version"], r.json()["name"]) for r in responses}
+    assert len({version for version, _ in bodies}) == len(bodies)
+    merchant = await client.get(f"/merchants/{merchant1.id}")
+    assert merchant.json()["version"] == before + 5
@@ -0,0 +1,144 @@
+import datetime
+
+from httpx import AsyncClient
+import pytest
+
+from digital_wallet import deps, group_commit, ledger, models, security
+
+
+@pytest.mark.asyncio
+async def test_ledger_follows_wallet_changes(
+    client: AsyncClient,
+    session: models.AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    user = models.DBUser(
+        username="ledger",
+        password="123456",
+        email="ledger@test.com",
+        first_name="Ledger",
+        last_name="User",
+    )
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+    headers = {
+        "Authorization": f"Bearer {security.create_access_token(data={'sub': user.id})}"
+    }
+    merchant = models.DBMerchant(name="Ledger merchant", user_id=user.id)
+    session.add(merchant)
+    await session.commit()
+    await session.refresh(merchant)
+    item = models.DBItem(
+        name="Ledger item", price=2.35, merchant_id=merchant.id, user_id=user.id
+    )
+    session.add(item)
+    await session.commit()
+    await session.refresh(item)
+
+    response = await client.post("/wallets", json={"balance": 100.0}, headers=headers)
+    assert response.status_code == 200
+    wallet_id = response.json()["id"]
+
+    response = await client.post(
+        "/transactions", params={"item_id": item.id, "amount": 3}, headers=headers
+    )
+    assert response.status_code == 200
+    response = await client.post(
+        "/transactions/checkout",
+        json={"items": [{"item_id": item.id, "quantity": 1}] * 2},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    async with models.async_session() as other:
+        await group_commit.apply_purchases(other, [(user.id, item.id, 2)])
+        await other.commit()
+    response = await client.put(
+        f"/wallets/{wallet_id}", json={"balance": 50.0}, headers=headers
+    )
+    assert response.status_code == 200
+
+    async with models.async_session() as other:
+        balance, tail = await ledger.balance(other, wallet_id)
+        # Opening, one purchase, two checkout lines, one group commit, adjustment
+        assert (balance, tail) == (5000, 6)
+
+        report = await ledger.replay(other, wallet_id)
+        assert report.ok and report.entries == 6
+
+        assert wallet_id in await ledger.snapshot_due(other, every=6)
+        snapshot = await ledger.take_snapshot(other, wallet_id)
+        await other.commit()
+        assert snapshot.balance == 5000
+        assert await ledger.balance(other, wallet_id) == (5000, 0)
+        assert wallet_id not in await ledger.snapshot_due(other, every=1)
+
+        monkeypatch.setattr(ledger, "SNAPSHOT_EVERY", 2)
+        monkeypatch.setattr(ledger, "CHUNK_ROWS", 4)
+        report = await ledger.replay(other, wallet_id, rebuild=True)
+        await other.commit()
+        assert report.ok and report.balance == 5000
+        assert await ledger.balance(other, wallet_id) == (5000, 0)
+
+        # A snapshot that does not match the entries is reported
+        latest = (
+            await other.exec(
+                models.select(models.DBLedgerSnapshot)
+                .where(models.DBLedgerSnapshot.wallet_id == wallet_id)
+                .order_by(models.DBLedgerSnapshot.entry_id.desc())
+            )
+        ).first()
+        latest.balance += 1
+        await other.commit()
+        report = await ledger.replay(other, wallet_id)
+        assert not report.ok
+        assert report.bad_snapshots == [(latest.entry_id, 5001, 5000)]
+
+
+@pytest.mark.asyncio
+async def test_wallet_update_adjusts_from_the_locked_balance(
+    client: AsyncClient,
+    session: models.AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    user = models.DBUser(
+        username="adjusted",
+        password="123456",
+        email="adjusted@test.com",
+        first_name="Adjusted",
+        last_name="User",
+    )
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+    headers = {
+        "Authorization": f"Bearer {security.create_access_token(data={'sub': user.id})}"
+    }
+    response = await client.post("/wallets", json={"balance": 100.0}, headers=headers)
+    wallet_id = response.json()["id"]
+
+    get = models.AsyncSession.get
+
+    async def get_after_purchase(self, entity, ident, **kwargs):
+        # A purchase commits after the user, with its joined wallet, was loaded
+        if entity is models.DBWallet and kwargs.get("with_for_update"):
+            monkeypatch.setattr(models.AsyncSession, "get", get)
+            async with models.async_session() as other:
+                wallet = await other.get(models.DBWallet, wallet_id)
+                wallet.balance = 40.0
+                await ledger.append(
+                    other, [ledger.entry(wallet_id, -6000, ledger.PURCHASE, datetime.datetime.utcnow())]
+                )
+                await other.commit()
+        return await get(self, entity, ident, **kwargs)
+
+    # Load the user, and so the wallet, in the request's session
+    deps.invalidate_principal(user.id)
+    monkeypatch.setattr(models.AsyncSession, "get", get_after_purchase)
+    response = await client.put(
+        f"/wallets/{wallet_id}", json={"balance": 50.0}, headers=headers
+    )
+    assert response.status_code == 200
+
+    async with models.async_session() as other:
+        assert await ledger.balance(other, wallet_id) == (5000, 3)
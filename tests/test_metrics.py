@@ -0,0 +1,72 @@
+import math
+
+from httpx import AsyncClient
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from digital_wallet import instrumentation, metrics, models
+
+
+def test_render_histogram_buckets_are_cumulative() -> None:
+    histogram = metrics.Histogram(
+        "test_render_seconds", "Rendered in tests", ("route",), buckets=(0.1, 1.0, math.inf)
+    )
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, route='/a"b')
+    assert histogram.render().splitlines() == [
+        "# HELP test_render_seconds Rendered in tests",
+        "# TYPE test_render_seconds histogram",
+        'test_render_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+        'test_render_seconds_bucket{route="/a\\"b",le="1.0"} 3',
+        'test_render_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'test_render_seconds_sum{route="/a\\"b"} 6.05',
+        'test_render_seconds_count{route="/a\\"b"} 4',
+    ]
+    del metrics.REGISTRY["test_render_seconds"]
+
+
+@pytest.mark.asyncio
+async def test_metrics_counts_requests_by_route_template(client: AsyncClient) -> None:
+    await client.get("/")
+    await client.get("/items/999999")
+    await client.get("/no-such-page")
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in text
+    assert (
+        'http_requests_total{method="GET",route="/items/{item_id}",status="404"}'
+        in text
+    )
+    assert 'route="unmatched",status="404"' in text
+    assert (
+        'db_query_duration_seconds_count{method="GET",route="/items/{item_id}"}'
+        in text
+    )
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert "# TYPE password_hash_queue_depth gauge" in text
+
+
+@pytest.mark.asyncio
+async def test_statements_are_timed_on_the_application_engines_only(
+    session: models.AsyncSession,
+) -> None:
+    def timed() -> int:
+        return instrumentation.query_duration.count(method="", route="background")
+
+    before = timed()
+    other = create_async_engine("sqlite+aiosqlite://")
+    async with other.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+    await other.dispose()
+    assert timed() == before
+
+    async with models.engine.connect() as connection:
+        with pytest.raises(DBAPIError):
+            await connection.execute(text("SELECT * FROM no_such_table"))
+        await connection.execute(text("SELECT 1"))
+    assert timed() == before + 1
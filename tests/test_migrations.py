@@ -0,0 +1,141 @@
+import pytest
+from sqlalchemy import delete, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from digital_wallet import migrations, models
+
+
+async def index_names(table: str) -> set[str]:
+    async with models.engine.connect() as connection:
+        return await connection.run_sync(
+            lambda sync: {i["name"] for i in inspect(sync).get_indexes(table)}
+        )
+
+
+@pytest.mark.asyncio
+async def test_migrations_are_recorded_and_not_repeated(
+    session: models.AsyncSession,
+) -> None:
+    # The schema from create_all already has everything; applying is a no-op
+    await migrations.migrate(models.engine)
+    assert await migrations.migrate(models.engine) == []
+
+
+@pytest.mark.asyncio
+async def test_migrations_restore_missing_index(session: models.AsyncSession) -> None:
+    await migrations.migrate(models.engine)
+    async with models.engine.begin() as connection:
+        await connection.execute(text("DROP INDEX ix_users_email"))
+        await connection.execute(
+            delete(migrations.schema_migrations).where(
+                migrations.schema_migrations.c.id == "0003_lookup_indexes"
+            )
+        )
+    assert "ix_users_email" not in await index_names("users")
+
+    assert await migrations.migrate(models.engine) == ["0003_lookup_indexes"]
+    assert "ix_users_email" in await index_names("users")
+
+
+# The schema the first release created, before any migration
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        email VARCHAR NOT NULL,
+        username VARCHAR NOT NULL,
+        first_name VARCHAR NOT NULL,
+        last_name VARCHAR NOT NULL,
+        id INTEGER NOT NULL,
+        password VARCHAR NOT NULL,
+        roles JSON,
+        register_date DATETIME NOT NULL,
+        updated_date DATETIME NOT NULL,
+        last_login_date DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE merchants (
+        name VARCHAR NOT NULL,
+        description VARCHAR,
+        tax_id VARCHAR,
+        id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )""",
+    """CREATE TABLE wallets (
+        balance FLOAT NOT NULL,
+        id INTEGER NOT NULL,
+        last_updated DATETIME NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )""",
+    """CREATE TABLE items (
+        name VARCHAR NOT NULL,
+        description VARCHAR,
+        price FLOAT NOT NULL,
+        tax FLOAT,
+        id INTEGER NOT NULL,
+        merchant_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(merchant_id) REFERENCES merchants (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )""",
+    """CREATE TABLE transactions (
+        id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        wallet_id INTEGER NOT NULL,
+        amount FLOAT NOT NULL,
+        timestamp DATETIME NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id),
+        FOREIGN KEY(item_id) REFERENCES items (id),
+        FOREIGN KEY(wallet_id) REFERENCES wallets (id)
+    )""",
+    """INSERT INTO users VALUES (
+        'old@email.local', 'old', 'Old', 'User', 1, 'hash', '[]',
+        '2020-01-01 00:00:00', '2020-01-01 00:00:00', NULL
+    )""",
+]
+
+
+def schema(sync) -> dict:
+    inspector = inspect(sync)
+    return {
+        table: (
+            {c["name"]: c["nullable"] for c in inspector.get_columns(table)},
+            {i["name"] for i in inspector.get_indexes(table)},
+        )
+        for table in inspector.get_table_names()
+        if table != migrations.schema_migrations.name
+    }
+
+
+@pytest.mark.asyncio
+async def test_migrations_bring_baseline_schema_up_to_models(tmp_path) -> None:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'baseline.db'}")
+    try:
+        async with engine.begin() as connection:
+            for statement in BASELINE_SCHEMA:
+                await connection.execute(text(statement))
+
+        await migrations.migrate(engine)
+
+        async with engine.connect() as connection:
+            migrated = await connection.run_sync(schema)
+            status = (
+                await connection.execute(text("SELECT status FROM users"))
+            ).scalar_one()
+    finally:
+        await engine.dispose()
+
+    expected = {
+        table.name: (
+            {column.name: column.nullable for column in table.columns},
+            {index.name for index in table.indexes},
+        )
+        for table in models.SQLModel.metadata.tables.values()
+    }
+    assert migrated == expected
+    assert status == "active"
@@ -0,0 +1,65 @@
+import logging
+
+from httpx import AsyncClient
+import pytest
+
+from digital_wallet import config, profiling
+
+
+@pytest.fixture(name="profiling_settings")
+def profiling_settings_fixture(app):
+    settings = config.Settings()
+    yield lambda **update: profiling.init_profiling(
+        settings.model_copy(update=dict(QUERY_PROFILING=True, **update))
+    )
+    profiling.init_profiling(settings)
+
+
+@pytest.mark.asyncio
+async def test_profiling_is_off_by_default(client: AsyncClient) -> None:
+    response = await client.get("/")
+    assert "Server-Timing" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_server_timing_counts_request_statements(
+    client: AsyncClient, user1_headers: dict, profiling_settings
+) -> None:
+    profiling_settings()
+
+    response = await client.get("/merchants", headers=user1_headers)
+    assert response.status_code == 200
+    db, app = response.headers["Server-Timing"].split(", ")
+    assert db.startswith("db;dur=") and not db.endswith('desc="0 queries"')
+    assert app.startswith("app;dur=")
+
+    response = await client.get("/")
+    assert 'desc="0 queries"' in response.headers["Server-Timing"]
+
+
+@pytest.mark.asyncio
+async def test_repeated_and_slow_statements_are_logged(
+    client: AsyncClient,
+    user1_headers: dict,
+    profiling_settings,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    profiling_settings(QUERY_REPEAT_THRESHOLD=1, SLOW_QUERY_SECONDS=0.0)
+    before = profiling.repeated_statements.get(method="GET", route="/merchants")
+
+    with caplog.at_level(logging.WARNING, logger=profiling.logger.name):
+        await client.get("/merchants", headers=user1_headers)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(m.startswith("slow query") and "GET /merchants" in m for m in messages)
+    assert any(
+        m.startswith("statement run 1 times in GET /merchants") for m in messages
+    )
+    assert profiling.repeated_statements.get(method="GET", route="/merchants") > before
+
+    # A repeat threshold the request stays under reports nothing
+    profiling_settings(QUERY_REPEAT_THRESHOLD=1000)
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger=profiling.logger.name):
+        await client.get("/merchants", headers=user1_headers)
+    assert not any(r.getMessage().startswith("statement run") for r in caplog.records)
@@ -0,0 +1,68 @@
+from httpx import AsyncClient
+import pytest
+from sqlmodel import update
+
+from digital_wallet import models, reconcile, security
+
+
+@pytest.mark.asyncio
+async def test_reconcile_reports_drifted_wallets(
+    client: AsyncClient, session: models.AsyncSession
+) -> None:
+    user = models.DBUser(
+        username="reconciled",
+        password="123456",
+        email="reconciled@test.com",
+        first_name="Reconciled",
+        last_name="User",
+    )
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+    headers = {
+        "Authorization": f"Bearer {security.create_access_token(data={'sub': user.id})}"
+    }
+    merchant = models.DBMerchant(name="Reconciled merchant", user_id=user.id)
+    session.add(merchant)
+    await session.commit()
+    await session.refresh(merchant)
+    item = models.DBItem(
+        name="Reconciled item", price=1.1, merchant_id=merchant.id, user_id=user.id
+    )
+    session.add(item)
+    await session.commit()
+    await session.refresh(item)
+
+    response = await client.post("/wallets", json={"balance": 20.0}, headers=headers)
+    wallet_id = response.json()["id"]
+    for quantity in (1, 3, 7):
+        response = await client.post(
+            "/transactions",
+            params={"item_id": item.id, "amount": quantity},
+            headers=headers,
+        )
+        assert response.status_code == 200
+
+    reconcile._init_worker(models.sync_url.render_as_string(hide_password=False))
+    report = reconcile.reconcile_range(wallet_id, wallet_id + 1)
+    assert (report.wallets, report.mismatched) == (1, 0)
+    # The wallet, its opening and purchase entries and its transactions
+    assert report.rows == 1 + 4 + 3
+
+    # A balance overwritten outside the ledger is reported by the pooled run
+    await session.exec(
+        update(models.DBWallet)
+        .where(models.DBWallet.id == wallet_id)
+        .values(balance=models.DBWallet.balance + 1)
+    )
+    await session.commit()
+    report = reconcile.reconcile(workers=2, width=2)
+    mismatch = next(m for m in report.mismatches if m.wallet_id == wallet_id)
+    assert mismatch == reconcile.Mismatch(
+        wallet_id=wallet_id,
+        balance=2000 - 1210 + 100,
+        ledger=2000 - 1210,
+        transactions=1210,
+        purchases=1210,
+    )
+    assert report.rows_per_second > 0
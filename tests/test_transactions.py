@@ -0,0 +1,437 @@
+import asyncio
+import datetime
+import json
+from fastapi import HTTPException
+from httpx import AsyncClient
+import pytest
+import pytest_asyncio
+from sqlmodel import func
+
+from digital_wallet import group_commit, idempotency, models, purchases
+
+
+@pytest_asyncio.fixture(name="wallet1")
+async def wallet1_fixture(
+    session: models.AsyncSession, user1: models.DBUser
+) -> models.DBWallet:
+    result = await session.exec(
+        models.select(models.DBWallet).where(models.DBWallet.user_id == user1.id)
+    )
+    wallet = result.one_or_none()
+    if not wallet:
+        wallet = models.DBWallet(user_id=user1.id)
+
+    wallet.balance = 100.0
+    session.add(wallet)
+    await session.commit()
+    await session.refresh(wallet)
+    return wallet
+
+
+@pytest_asyncio.fixture(name="item1")
+async def item1_fixture(
+    session: models.AsyncSession, user1: models.DBUser
+) -> models.DBItem:
+    merchant = models.DBMerchant(name="Merchant", user_id=user1.id)
+    session.add(merchant)
+    await session.commit()
+    await session.refresh(merchant)
+
+    item = models.DBItem(
+        name="Item", price=10.0, merchant_id=merchant.id, user_id=user1.id
+    )
+    session.add(item)
+    await session.commit()
+    await session.refresh(item)
+    return item
+
+
+@pytest.mark.asyncio
+async def test_create_transaction(
+    client: AsyncClient,
+    user1_headers: dict,
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+    session: models.AsyncSession,
+) -> None:
+    response = await client.post(
+        "/transactions",
+        params={"item_id": item1.id, "amount": 3},
+        headers=user1_headers,
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["amount"] == 30.0
+    assert data["wallet_id"] == wallet1.id
+
+    await session.refresh(wallet1)
+    assert wallet1.balance == 70.0
+
+
+@pytest.mark.asyncio
+async def test_create_transaction_insufficient_balance(
+    client: AsyncClient,
+    user1_headers: dict,
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+) -> None:
+    response = await client.post(
+        "/transactions",
+        params={"item_id": item1.id, "amount": 11},
+        headers=user1_headers,
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Insufficient balance"
+
+
+@pytest.mark.asyncio
+async def test_create_transaction_item_not_found(
+    client: AsyncClient,
+    user1_headers: dict,
+    wallet1: models.DBWallet,
+) -> None:
+    response = await client.post(
+        "/transactions",
+        params={"item_id": 999999, "amount": 1},
+        headers=user1_headers,
+    )
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Item not found"
+
+
+@pytest.mark.asyncio
+async def test_purchase_never_overdraws(
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+    user1: models.DBUser,
+    session: models.AsyncSession,
+) -> None:
+    succeeded = 0
+    for _ in range(15):
+        async with models.async_session() as buyer_session:
+            try:
+                await purchases.purchase(buyer_session, user1.id, item1.id, 1)
+                succeeded += 1
+            except HTTPException as e:
+                assert e.detail == "Insufficient balance"
+
+    await session.refresh(wallet1)
+    assert succeeded == 10
+    assert wallet1.balance == 0
+
+
+@pytest.mark.asyncio
+async def test_group_commit_resolves_each_purchase(
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+    user1: models.DBUser,
+    session: models.AsyncSession,
+) -> None:
+    writer = group_commit.GroupCommitWriter(window_ms=20, max_batch=64)
+    batches = group_commit.batch_size_histogram.count()
+
+    results = await asyncio.gather(
+        *[writer.submit(user1.id, item1.id, 4) for _ in range(3)],
+        writer.submit(user1.id, 999999, 1),
+        return_exceptions=True,
+    )
+    await writer.close()
+
+    assert [r.amount for r in results[:2]] == [40.0, 40.0]
+    assert isinstance(results[2], HTTPException)
+    assert results[2].detail == "Insufficient balance"
+    assert results[3].detail == "Item not found"
+    assert group_commit.batch_size_histogram.count() == batches + 1
+
+    await session.refresh(wallet1)
+    assert wallet1.balance == 20.0
+
+
+@pytest.mark.asyncio
+async def test_group_commit_close_finishes_batch_in_flight(
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+    user1: models.DBUser,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    apply_purchases = group_commit.apply_purchases
+    applying = asyncio.Event()
+
+    async def slow_apply(session, batch):
+        applying.set()
+        await asyncio.sleep(0.1)
+        return await apply_purchases(session, batch)
+
+    monkeypatch.setattr(group_commit, "apply_purchases", slow_apply)
+    writer = group_commit.GroupCommitWriter(window_ms=1, max_batch=64)
+    purchases = asyncio.gather(
+        *[writer.submit(user1.id, item1.id, 1) for _ in range(2)]
+    )
+    await applying.wait()
+    # Closing mid-batch still lets the batch commit and resolve its callers
+    await writer.close()
+    results = await asyncio.wait_for(purchases, 1)
+    assert [r.amount for r in results] == [10.0, 10.0]
+
+
+@pytest.mark.asyncio
+async def test_read_transactions_cursor(
+    client: AsyncClient,
+    user1: models.DBUser,
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+    session: models.AsyncSession,
+) -> None:
+    session.add_all(
+        [
+            models.DBTransaction(
+                user_id=user1.id,
+                item_id=item1.id,
+                wallet_id=wallet1.id,
+                amount=1.0,
+                timestamp=datetime.datetime(2024, 1, 1),
+            )
+            for _ in range(60)
+        ]
+    )
+    await session.commit()
+
+    response = await client.get("/transactions")
+    data = response.json()
+    ids = [transaction["id"] for transaction in data["transactions"]]
+
+    cursor = data["next_cursor"]
+    assert cursor is not None
+    while cursor:
+        data = (await client.get("/transactions", params={"cursor": cursor})).json()
+        ids += [transaction["id"] for transaction in data["transactions"]]
+        cursor = data["next_cursor"]
+
+    total = len((await session.exec(models.select(models.DBTransaction.id))).all())
+    assert len(ids) == len(set(ids)) == total
+
+
+@pytest.mark.asyncio
+async def test_wallet_etag_changes_after_purchase(
+    client: AsyncClient,
+    user1_headers: dict,
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+) -> None:
+    response = await client.get(f"/wallets/{wallet1.id}")
+    etag = response.headers["ETag"]
+
+    response = await client.get(
+        f"/wallets/{wallet1.id}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+    await client.post(
+        "/transactions",
+        params={"item_id": item1.id, "amount": 1},
+        headers=user1_headers,
+    )
+    response = await client.get(
+        f"/wallets/{wallet1.id}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_export_transactions(
+    client: AsyncClient,
+    user1: models.DBUser,
+    user1_headers: dict,
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+) -> None:
+    for _ in range(2):
+        await client.post(
+            "/transactions",
+            params={"item_id": item1.id, "amount": 1},
+            headers=user1_headers,
+        )
+
+    response = await client.get(
+        "/transactions/export",
+        params={"item_id": item1.id},
+        headers=user1_headers,
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 2
+    assert {row["user_id"] for row in rows} == {user1.id}
+    assert rows == sorted(rows, key=lambda row: (row["timestamp"], row["id"]))
+
+    response = await client.get(
+        "/transactions/export",
+        params={"format": "csv", "item_id": item1.id, "since": rows[1]["timestamp"]},
+        headers=user1_headers,
+    )
+    lines = response.text.splitlines()
+    assert lines[0] == "id,user_id,item_id,wallet_id,amount,timestamp"
+    assert [int(line.split(",")[0]) for line in lines[1:]] == [rows[1]["id"]]
+
+    response = await client.get(
+        "/transactions/export",
+        params={"user_id": user1.id + 1},
+        headers=user1_headers,
+    )
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_checkout_is_all_or_nothing(
+    client: AsyncClient,
+    user1: models.DBUser,
+    user1_headers: dict,
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+) -> None:
+    async with models.async_session() as session:
+        item2 = models.DBItem(
+            name="Second", price=5.0, merchant_id=item1.merchant_id, user_id=user1.id
+        )
+        session.add(item2)
+        await session.commit()
+        await session.refresh(item2)
+
+    basket = {
+        "items": [
+            {"item_id": item1.id, "quantity": 2},
+            {"item_id": item2.id, "quantity": 3},
+        ]
+    }
+    response = await client.post(
+        "/transactions/checkout", json=basket, headers=user1_headers
+    )
+    assert response.status_code == 200
+    receipt = response.json()
+    assert receipt["total"] == 35.0
+    assert [t["amount"] for t in receipt["transactions"]] == [20.0, 15.0]
+    assert [t["item_id"] for t in receipt["transactions"]] == [item1.id, item2.id]
+
+    # 65 left: the basket below costs 70 and must leave nothing behind
+    basket["items"].append({"item_id": item1.id, "quantity": 4})
+    response = await client.post(
+        "/transactions/checkout", json=basket, headers=user1_headers
+    )
+    assert response.status_code == 400
+
+    basket = {
+        "items": [
+            {"item_id": item1.id, "quantity": 1},
+            {"item_id": 999_999, "quantity": 1},
+        ]
+    }
+    response = await client.post(
+        "/transactions/checkout", json=basket, headers=user1_headers
+    )
+    assert response.status_code == 404
+
+    async with models.async_session() as session:
+        wallet = await session.get(models.DBWallet, wallet1.id)
+        assert wallet.balance == 65.0
+        result = await session.exec(
+            models.select(func.count())
+            .select_from(models.DBTransaction)
+            .where(models.DBTransaction.item_id == item2.id)
+        )
+        assert result.one() == 1
+
+
+@pytest.mark.asyncio
+async def test_read_wallets_streamed_matches_pages(
+    client: AsyncClient, wallet1: models.DBWallet
+) -> None:
+    paged = (await client.get("/wallets")).json()
+    assert paged["next_cursor"] is None
+
+    response = await client.get("/wallets", params={"stream": True})
+    assert response.json() == paged["wallets"]
+
+
+@pytest.mark.asyncio
+async def test_idempotency_key_replays_the_first_purchase(
+    client: AsyncClient,
+    user1_headers: dict,
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+    session: models.AsyncSession,
+) -> None:
+    headers = {**user1_headers, "Idempotency-Key": "retry-1"}
+    params = {"item_id": item1.id, "amount": 2}
+
+    # Concurrent duplicates wait for the first one
+    concurrent = await asyncio.gather(
+        *[client.post("/transactions", params=params, headers=headers) for _ in range(5)]
+    )
+    first = concurrent[0]
+    assert [response.status_code for response in concurrent] == [200] * 5
+    assert all(response.json() == first.json() for response in concurrent)
+    replayed = [r.headers.get("Idempotent-Replayed") for r in concurrent]
+    assert sorted(replayed, key=str) == [None] + ["true"] * 4
+
+    # Served from the table once the in-process cache has forgotten it
+    idempotency.cache.clear()
+    response = await client.post("/transactions", params=params, headers=headers)
+    assert response.json() == first.json()
+
+    response = await client.post(
+        "/transactions", params={**params, "amount": 3}, headers=headers
+    )
+    assert response.status_code == 422
+
+    await session.refresh(wallet1)
+    assert wallet1.balance == 80.0
+
+    # Client errors are stored too: topping up does not change the retried answer
+    headers["Idempotency-Key"] = "retry-2"
+    params["amount"] = 9
+    response = await client.post("/transactions", params=params, headers=headers)
+    assert response.status_code == 400
+    wallet1.balance = 1000.0
+    session.add(wallet1)
+    await session.commit()
+    response = await client.post("/transactions", params=params, headers=headers)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Insufficient balance"}
+
+
+@pytest.mark.asyncio
+async def test_idempotency_store_failure_rolls_back_the_purchase(
+    client: AsyncClient,
+    user1_headers: dict,
+    wallet1: models.DBWallet,
+    item1: models.DBItem,
+    session: models.AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    store = idempotency._store
+
+    async def failing_store(*args):
+        await store(*args)
+        raise RuntimeError("connection lost")
+
+    headers = {**user1_headers, "Idempotency-Key": "store-fails"}
+    params = {"item_id": item1.id, "amount": 1}
+    monkeypatch.setattr(idempotency, "_store", failing_store)
+    with pytest.raises(RuntimeError):
+        await client.post("/transactions", params=params, headers=headers)
+
+    # The debit went with the response, and the claim is free for the retry
+    await session.refresh(wallet1)
+    assert wallet1.balance == 100.0
+    monkeypatch.setattr(idempotency, "_store", store)
+    response = await client.post("/transactions", params=params, headers=headers)
+    assert response.status_code == 200
+    response = await client.post("/transactions", params=params, headers=headers)
+    assert response.headers["Idempotent-Replayed"] == "true"
+    await session.refresh(wallet1)
+    assert wallet1.balance == 90.0
@@ -1,80 +1,7 @@
-import asyncio
-from contextlib import asynccontextmanager
-from fastapi import FastAPI
-from fastapi.testclient import TestClient
-from httpx import AsyncClient, ASGITransport
-from typing import Any, Dict, Optional
+from httpx import AsyncClient
 import pytest
-import pytest_asyncio
-import pathlib
-import datetime
 
-from digital_wallet import models, config, main, security
-
-# Update settings for testing
-SettingsTesting = config.Settings
-SettingsTesting.model_config = config.SettingsConfigDict(
-    env_file=".testing.env", validate_assignment=True, extra="allow"
-)
-
-# Fixture to create the app instance
-@pytest.fixture(name="app", scope="session")
-def app_fixture():
-    settings = SettingsTesting()
-    path = pathlib.Path("test-data")
-    if not path.exists():
-        path.mkdir()
-
-    app = main.create_app(settings)
-
-    asyncio.run(models.recreate_table())
-
-    yield app
-
-# Fixture to create the HTTP client
-@pytest.fixture(name="client", scope="session")
-def client_fixture(app: FastAPI) -> AsyncClient:
-    return AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost")
-
-# Fixture to create a database session
-@pytest_asyncio.fixture(name="session", scope="session")
-async def get_session() -> models.AsyncSession:
-    settings = SettingsTesting()
-    models.init_db(settings)
-
-    async_session = models.sessionmaker(
-        models.engine, class_=models.AsyncSession, expire_on_commit=False
-    )
-    async with async_session() as session:
-        yield session
-
-# Fixture to create a user
-@pytest_asyncio.fixture(name="user1")
-async def example_user1(session: models.AsyncSession) -> models.DBUser:
-    password = "123456"
-    username = "user1"
-
-    query = await session.exec(
-        models.select(models.DBUser).where(models.DBUser.username == username).limit(1)
-    )
-    user = query.one_or_none()
-    if user:
-        return user
-
-    user = models.DBUser(
-        username=username,
-        password=password,
-        email="test@test.com",
-        first_name="Firstname",
-        last_name="lastname",
-        last_login_date=datetime.datetime.now(tz=datetime.timezone.utc),
-    )
-
-    await user.set_password(password)
-    session.add(user)
-    await session.commit()
-    await session.refresh(user)
-    return user
+from digital_wallet import caching, deps, models, security
 
 # Test to create a user
 @pytest.mark.asyncio
@@ -95,3 +22,61 @@ async def test_create_user(client: AsyncClient, session: models.AsyncSession) ->
     assert data["first_name"] == "New"
     assert data["last_name"] == "User"
     assert data["last_login_date"] is None
+
+
+@pytest.mark.asyncio
+async def test_get_me_uses_principal_cache(
+    client: AsyncClient, user1: models.DBUser, user1_headers: dict
+) -> None:
+    deps.invalidate_principal(user1.id)
+    misses = caching.misses.get(cache="users")
+    hits = caching.hits.get(cache="users")
+
+    for _ in range(2):
+        response = await client.get(f"/users/{user1.id}", headers=user1_headers)
+        assert response.status_code == 200
+        assert response.json()["username"] == "user1"
+
+    assert caching.misses.get(cache="users") == misses + 1
+    assert caching.hits.get(cache="users") == hits + 1
+
+
+@pytest.mark.asyncio
+async def test_update_user_invalidates_principal_cache(
+    client: AsyncClient,
+    user1: models.DBUser,
+    user1_headers: dict,
+) -> None:
+    await client.get(f"/users/{user1.id}", headers=user1_headers)
+
+    response = await client.put(
+        "/users/update",
+        json={
+            "email": user1.email,
+            "username": user1.username,
+            "first_name": "Renamed",
+            "last_name": user1.last_name,
+        },
+        headers=user1_headers,
+    )
+    assert response.status_code == 200
+
+    token = user1_headers["Authorization"].split()[1]
+    async with models.async_session() as fresh_session:
+        current_user = await deps.get_current_user(token, fresh_session)
+    assert current_user.first_name == "Renamed"
+
+
+@pytest.mark.asyncio
+async def test_claims_only_principal_skips_database(monkeypatch) -> None:
+    monkeypatch.setattr(deps.settings, "PRINCIPAL_CLAIMS_ONLY", True)
+    token = security.create_access_token(
+        data={"sub": 42, "roles": ["admin"], "status": "active"}
+    )
+
+    # No session: the database must not be touched
+    principal = await deps.get_current_principal(token, None)
+    assert principal.id == 42
+    assert principal.roles == ["admin"]
+
+    deps.RoleChecker("admin")(await deps.get_current_active_user(principal))